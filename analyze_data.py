@@ -1,72 +1,66 @@
-import pandas as pd
 from pathlib import Path
 import os
+import argparse
 from dotenv import load_dotenv
-from collections import Counter
 
-# 1. טעינת הנתיב מהקובץ .env
-load_dotenv()
-env_path = os.getenv("DATA_PATH")
+from condition_counts import find_condition_column, scan_condition_counts
+from data_io import MERGED_CSV, resolve_table, table_columns
+import instrumentation
 
-# בדיקה שהנתיב נטען
-if not env_path:
-    print("ERROR: Could not find DATA_PATH in .env file")
-    exit()
 
-base_path = Path(env_path)
+def main():
+    parser = argparse.ArgumentParser(description="Count the conditions in the merged table")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
 
-# 2. טעינת הקובץ המאוחד
-csv_path = base_path / "indiana_merged_data.csv"
-print(f"Loading data from: {csv_path}...")
+    # 1. טעינת הנתיב מהקובץ .env
+    load_dotenv()
+    env_path = os.getenv("DATA_PATH")
 
-try:
-    df = pd.read_csv(csv_path)
-except FileNotFoundError:
-    print(f"ERROR: File not found at {csv_path}")
-    print("Did you run the previous script successfully?")
-    exit()
+    # בדיקה שהנתיב נטען
+    if not env_path:
+        print("ERROR: Could not find DATA_PATH in .env file")
+        exit()
 
-# 3. ניתוח עמודת Problems
-print("-" * 30)
-print("Analyzing 'Problems' column...")
+    base_path = Path(env_path)
 
-all_conditions = []
+    # 2. טעינת הקובץ המאוחד - רק העמודות שצריך ובחלקים (chunks)
+    try:
+        # parquet אם קיים - נקראת רק העמודה הדרושה
+        csv_path = resolve_table(base_path, MERGED_CSV)
+        print(f"Loading data from: {csv_path}...")
+        header = table_columns(csv_path)
+    except FileNotFoundError:
+        print(f"ERROR: File not found at {base_path / MERGED_CSV}")
+        print("Did you run the previous script successfully?")
+        exit()
 
-# הופכים למחרוזת, אותיות קטנות, וממלאים חוסרים
-# אנחנו בודקים את עמודת "Problems" (עם P גדולה כמו שראינו בתמונה שלך)
-if "Problems" in df.columns:
-    problems_series = df["Problems"].astype(str).str.lower().fillna("unknown")
-else:
-    # למקרה שהשם כתוב בקטן
-    problems_series = df["problems"].astype(str).str.lower().fillna("unknown")
+    # 3. ניתוח עמודת Problems
+    print("-" * 30)
+    # אנחנו בודקים את עמודת "Problems" (עם P גדולה), ולמקרה שהשם כתוב בקטן גם "problems"
+    target_col = "Problems" if "Problems" in header else find_condition_column(header)
+    print(f"Analyzing '{target_col}' column...")
 
-for row in problems_series:
-    # אם כתוב "normal", נשמור אותו
-    if row == "normal":
-        all_conditions.append("normal")
-        continue
+    # סריקה אחת: ספירה לכל הטבלה וגם לפי סוג הצילום (Frontal / Lateral)
+    by = "projection" if "projection" in header else None
+    counts, _ = scan_condition_counts(csv_path, target_col, by=by, style="merged")
 
-    # אם יש כמה מחלות מופרדות בנקודה-פסיק או פסיק
-    # מנקים תווים מיותרים
-    clean_row = row.replace(";", ",").replace("/", ",")
-    diseases = clean_row.split(",")
+    # 4. ספירה והצגה
+    total_normal = counts["all"].get("normal", 0)
+    print(f"\nTotal 'Normal' images: {total_normal}")
+    print("\nTop 10 Diseases found (Candidates for your model):")
+    print("-" * 30)
 
-    for d in diseases:
-        d = d.strip()  # הורדת רווחים מיותרים
-        if d != "normal" and d != "nan" and d != "unknown" and len(d) > 2:
-            all_conditions.append(d)
+    # מציג את 11 הנפוצים בלי normal (כמו most_common(11) המקורי - 11 שורות אם normal לא ביניהם)
+    projections = [c for c in counts.columns if c != "all"]
+    for disease, row in counts.head(11).drop(index="normal", errors="ignore").iterrows():
+        per_projection = ", ".join(f"{p}: {row[p]}" for p in projections)
+        print(f"{disease}: {row['all']}" + (f" ({per_projection})" if per_projection else ""))
 
-# 4. ספירה והצגה
-counts = Counter(all_conditions)
+    print("-" * 30)
 
-print(f"\nTotal 'Normal' images: {counts['normal']}")
-print("\nTop 10 Diseases found (Candidates for your model):")
-print("-" * 30)
+    instrumentation.finish(args)
 
-# מציג את 10 המחלות הכי נפוצות
-for i, (disease, count) in enumerate(counts.most_common(11)):
-    if disease == "normal":
-        continue
-    print(f"{disease}: {count}")
 
-print("-" * 30)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from data_io import FRONTAL_CSV, MERGED_CSV, PROJECTIONS_CSV, REPORTS_CSV, resolve_table, write_table
+from instrumentation import metrics
+from read_the_db import get_images_folder, merge_projections_reports
+from filter_frontal_images import filter_frontal
+from create_clinical_summary import add_clinical_summary
+from create_poc_dataset import build_poc_dataset
+from condition_counts import scan_condition_counts
+
+# ברירות מחדל: דאטה סינתטי בתיקייה זמנית, תוצאות בקובץ JSONL אחד לכל הריצות
+DEFAULT_ROOT = "benchmark_data"
+DEFAULT_RESULTS = "benchmark_results.jsonl"
+GENERATOR_FILE = "generator.json"
+
+# מאגרי ערכים בסגנון Indiana - מספיק כדי שהתיוג, הסיכום והספירה יעבדו על טקסט אמיתי
+PROBLEMS = [
+    "normal", "normal", "normal", "Cardiomegaly", "Opacity;Lung", "Pulmonary Atelectasis",
+    "Calcified Granuloma", "Pneumonia/ Opacity", "Cardiomegaly;Pulmonary Congestion",
+    "Spine;Degenerative", "Nodule", "Lung/hypoinflation", "Thoracic Vertebrae/degenerative",
+    "Airspace Disease;Lung", "Markings/Bronchovascular", None,
+]
+MESH = ["normal", "Cardiomegaly/mild", "Opacity/lung/base/left", "Calcified Granuloma/lung/upper lobe/right",
+        "Pulmonary Atelectasis/base/bilateral"]
+INDICATIONS = ["Chest pain", "dyspnea", "Cough and fever", "Preop exam", "XXXX-year-old male with shortness of breath",
+               None]
+COMPARISONS = ["None.", "Chest radiographs XXXX.", "PA and lateral chest XXXX", None]
+FINDINGS = [
+    "The heart is normal in size. The mediastinum is unremarkable. The lungs are clear.",
+    "The cardiomediastinal silhouette is enlarged. No focal airspace disease. No pleural effusion.",
+    "There is a focal opacity in the right lower lobe. No pneumothorax.",
+    "Calcified granuloma in the left upper lobe. Otherwise the lungs are clear.",
+    "Low lung volumes with bibasilar atelectasis. Heart size within normal limits.",
+    None,
+]
+IMPRESSIONS = [
+    "No acute cardiopulmonary abnormality.", "Normal chest x-XXXX.", "Cardiomegaly without acute disease.",
+    "Right lower lobe pneumonia.", "Stable calcified granuloma.", "Mild bibasilar atelectasis.", None,
+]
+
+# מילים למילון של ה-BERT הקטן (בנוסף לכל המילים שמופיעות בטקסטים למעלה)
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+def _pick(pool, n, rng):
+    """בחירה וקטורית ממאגר שיכול להכיל None (ערך חסר)"""
+    values = np.array(pool, dtype=object)
+    return values[rng.integers(0, len(values), n)]
+
+
+def generate_tables(n_rows, seed=0):
+    """
+    Builds (projections, reports) shaped like the Indiana CSVs with about
+    n_rows image rows: every study has one Frontal image and one or two
+    Lateral/extra Frontal images.
+    """
+    rng = np.random.default_rng(seed)
+    n_studies = max(1, n_rows // 2)
+    images_per_study = np.where(rng.random(n_studies) < 0.1, 3, 2)
+    # חיתוך כך שמספר השורות יהיה בדיוק n_rows
+    ends = np.cumsum(images_per_study)
+    n_studies = min(n_studies, int(np.searchsorted(ends, n_rows)) + 1)
+    images_per_study = images_per_study[:n_studies]
+    images_per_study[-1] -= max(0, int(images_per_study.sum()) - n_rows)
+
+    uid = np.repeat(np.arange(1, n_studies + 1), images_per_study)
+    # מספר סידורי של התמונה בתוך המחקר (0, 1, 2)
+    position = np.arange(len(uid)) - np.repeat(np.cumsum(images_per_study) - images_per_study, images_per_study)
+    projection = np.where(position == 1, "Lateral", "Frontal")
+    filename = pd.Series(uid).astype(str) + "_IM-" + pd.Series(uid % 10000).map("{:04d}".format) \
+        + "-" + pd.Series(1001 + position).astype(str) + ".dcm.png"
+
+    projections = pd.DataFrame({"uid": uid, "filename": filename.to_numpy(), "projection": projection})
+    reports = pd.DataFrame({
+        "uid": np.arange(1, n_studies + 1),
+        "MeSH": _pick(MESH, n_studies, rng),
+        "Problems": _pick(PROBLEMS, n_studies, rng),
+        "image": "Xray Chest PA and Lateral",
+        "indication": _pick(INDICATIONS, n_studies, rng),
+        "comparison": _pick(COMPARISONS, n_studies, rng),
+        "findings": _pick(FINDINGS, n_studies, rng),
+        "impression": _pick(IMPRESSIONS, n_studies, rng),
+    })
+    return projections, reports
+
+
+def _write_png(task):
+    path, size, seed = task
+    rng = np.random.default_rng(seed)
+    # שיפוע + רעש - PNG שדחיסתו ופענוחו דומים יותר לצילום מאשר תמונה אחידה
+    gradient = np.linspace(0, 200, size, dtype=np.float32)[None, :]
+    pixels = np.clip(gradient + rng.normal(0, 25, (size, size)), 0, 255).astype(np.uint8)
+    Image.fromarray(pixels, mode="L").save(path)
+
+
+def generate_dataset(root, n_rows, n_images=2000, image_size=256, seed=0, workers=8):
+    """
+    Writes a DATA_PATH-like folder: the two source CSVs plus grayscale PNGs
+    for the first n_images rows (the rest are "missing", as happens with
+    partial downloads). An existing folder with the same parameters is reused.
+    """
+    root = Path(root)
+    params = {"rows": n_rows, "images": n_images, "image_size": image_size, "seed": seed}
+    marker = root / GENERATOR_FILE
+    if marker.exists() and json.loads(marker.read_text(encoding="utf-8")) == params:
+        print(f"Reusing synthetic data in {root}")
+        return root
+
+    print(f"Generating {n_rows} rows and {min(n_images, n_rows)} images in {root}...")
+    marker.unlink(missing_ok=True)
+    projections, reports = generate_tables(n_rows, seed)
+    root.mkdir(parents=True, exist_ok=True)
+    # קבצי המקור של Indiana הם תמיד CSV
+    write_table(projections, root, PROJECTIONS_CSV, fmt="csv")
+    write_table(reports, root, REPORTS_CSV, fmt="csv")
+
+    images_folder = get_images_folder(root)
+    images_folder.mkdir(parents=True, exist_ok=True)
+    for old in images_folder.glob("*.png"):
+        old.unlink()
+    tasks = [(images_folder / name, image_size, seed + i)
+             for i, name in enumerate(projections["filename"].iloc[:n_images])]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_write_png, tasks))
+
+    marker.write_text(json.dumps(params), encoding="utf-8")
+    return root
+
+
+def tiny_densenet():
+    """DenseNet קטן במקום DenseNet121 - אותו מבנה, משקלים אקראיים, בלי הורדה"""
+    import torch.nn as nn
+    from torchvision.models import DenseNet
+
+    model = DenseNet(growth_rate=8, block_config=(2, 2, 2, 2), num_init_features=16)
+    model.classifier = nn.Identity()
+    return model.eval()
+
+
+def tiny_bert(root):
+    """
+    Saves a 2-layer BERT with a vocabulary built from the synthetic report
+    words into root/tiny_bert and returns the directory (usable as
+    --model-name, no network needed).
+    """
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    model_dir = Path(root) / "tiny_bert"
+    if (model_dir / "config.json").exists():
+        return model_dir
+
+    texts = [t for pool in (PROBLEMS, INDICATIONS, FINDINGS, IMPRESSIONS) for t in pool if t]
+    words = sorted({w for t in texts for w in t.lower().replace(".", " . ").replace(",", " , ").split()})
+    model_dir.mkdir(parents=True, exist_ok=True)
+    vocab_path = model_dir / "vocab.txt"
+    vocab_path.write_text("\n".join(SPECIAL_TOKENS + [".", ",", ":", "-"] + words) + "\n", encoding="utf-8")
+
+    tokenizer = BertTokenizerFast(vocab_file=str(vocab_path), do_lower_case=True)
+    config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=128, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=256, max_position_embeddings=256)
+    BertModel(config).save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+    return model_dir
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(root, embed_rows=256, batch_size=32, workers=2, threads=None, skip_embeddings=False,
+                  loader="dataloader"):
+    """
+    Runs every stage on the synthetic folder and returns the metrics report
+    (seconds, rows/images/tokens per second and peak RSS per stage).
+    """
+    root = Path(root)
+    metrics.reset()
+
+    with metrics.stage("bench.merge"):
+        # האינדקס נבנה מחדש בכל ריצה - מודדים גם את סריקת התמונות
+        merged = merge_projections_reports(root, rebuild_index=True)
+        metrics.count("rows", len(merged))
+    write_table(merged, root, MERGED_CSV)
+
+    with metrics.stage("bench.frontal"):
+        frontal = filter_frontal(merged)
+        metrics.count("rows", len(merged))
+    write_table(frontal, root, FRONTAL_CSV)
+
+    with metrics.stage("bench.summary"):
+        summary = add_clinical_summary(merged)
+        metrics.count("rows", len(merged))
+
+    with metrics.stage("bench.poc"):
+        build_poc_dataset(frontal)
+        metrics.count("rows", len(frontal))
+
+    with metrics.stage("bench.conditions"):
+        scan_condition_counts(resolve_table(root, MERGED_CSV), "Problems", by="projection", style="merged")
+        scan_condition_counts(resolve_table(root, FRONTAL_CSV), style="frontal")
+        metrics.count("rows", len(merged) + len(frontal))
+
+    if not skip_embeddings:
+        from generate_densenet_features import extract_image_features, get_device
+        from inference_opt import set_threads
+        from project_db.create_text_embeddings import embed_summaries
+
+        if threads:
+            set_threads(threads)
+        # רק שורות שיש להן קובץ תמונה (הדאטה הסינתטי מייצר PNG רק לחלק מהשורות)
+        images = frontal[frontal["img_path"].notna()].head(embed_rows)
+        with metrics.stage("bench.embed-image"):
+            model = tiny_densenet().to(get_device())
+            extract_image_features(images, root, batch_size, workers, model=model, loader=loader)
+            metrics.count("images", len(images))
+
+        with metrics.stage("bench.embed-text"):
+            embed_summaries(summary.head(embed_rows), str(tiny_bert(root)), batch_size)
+            metrics.count("rows", min(embed_rows, len(summary)))
+
+    return metrics.report()
+
+
+def save_result(results_path, report, params):
+    """מוסיף שורה לקובץ התוצאות (JSONL) - ריצה אחת בכל שורה"""
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "peak_rss_mb": report["peak_rss_mb"],
+        "stages": report["stages"],
+    }
+    with open(results_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+    return record
+
+
+def load_results(results_path):
+    if not Path(results_path).exists():
+        return []
+    with open(results_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_runs(previous, current):
+    """
+    Seconds per stage of two runs side by side, with current/previous ratio
+    (above 1 = slower than before).
+    """
+    rows = []
+    for stage, values in current["stages"].items():
+        before = previous["stages"].get(stage, {}).get("seconds")
+        now = values["seconds"]
+        rows.append({
+            "stage": stage,
+            "previous_s": before,
+            "current_s": now,
+            "ratio": round(now / before, 3) if before else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic Indiana-shaped data")
+    parser.add_argument("--rows", default="1000", help="comma separated scales, e.g. 1000,100000,1000000")
+    parser.add_argument("--images", type=int, default=2000, help="PNG files to generate (max)")
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="folder for the synthetic data")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSONL file the results are appended to")
+    parser.add_argument("--embed-rows", type=int, default=256, help="rows sent to each stand-in model")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--skip-embeddings", action="store_true")
+    parser.add_argument("--loader", choices=["dataloader", "prefetch"], default="dataloader",
+                        help="image loader for the embed-image stage")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for n_rows in [int(n) for n in args.rows.split(",")]:
+        root = generate_dataset(Path(args.root) / f"rows_{n_rows}", n_rows, args.images, args.image_size,
+                                args.seed)
+        params = {"rows": n_rows, "images": min(args.images, n_rows), "image_size": args.image_size,
+                  "embed_rows": args.embed_rows, "batch_size": args.batch_size, "workers": args.workers,
+                  "threads": args.threads, "skip_embeddings": args.skip_embeddings, "loader": args.loader}
+
+        # הריצה הקודמת עם אותם פרמטרים - להשוואה
+        previous = [r for r in load_results(args.results) if r["params"] == params]
+        report = run_benchmark(root, args.embed_rows, args.batch_size, args.workers, args.threads,
+                               args.skip_embeddings, args.loader)
+        record = save_result(args.results, report, params)
+
+        print("\n" + "=" * 60)
+        print(f"Benchmark: {n_rows} rows (peak RSS {record['peak_rss_mb'] or 0:.0f} MB)")
+        if previous:
+            print(f"Compared with {previous[-1]['timestamp']} ({previous[-1]['commit']}):")
+            print(compare_runs(previous[-1], record).to_string(index=False))
+        else:
+            metrics.print_summary()
+        print("=" * 60)
+    print(f"Results appended to: {args.results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import importlib
+import subprocess
+import sys
+import time
+
+# נקודת כניסה אחת לכל השלבים: python -m cli <command> [האפשרויות של הסקריפט]
+# רק המודול של הפקודה נטען, ורק כשהיא רצה - השלבים הקלים לא טוענים torch בכלל
+# פקודה -> (מודול, תיאור)
+COMMANDS = {
+    "merge": ("read_the_db", "merge projections + reports and link the images"),
+    "filter": ("filter_frontal_images", "keep the frontal images"),
+    "summary": ("create_clinical_summary", "build the clinical summary column"),
+    "poc": ("create_poc_dataset", "label and sample the balanced POC dataset (+ splits)"),
+    "analyze": ("analyze_data", "condition counts of the merged table"),
+    "analyze-frontal": ("analyze_frontal_stats", "condition counts of the frontal table"),
+    "dedup": ("image_dedup", "perceptual-hash near-duplicate groups of the images"),
+    "embed-image": ("generate_densenet_features", "DenseNet121 image features"),
+    "embed-text": ("project_db.create_text_embeddings", "ClinicalBERT summary embeddings"),
+    "pipeline": ("pipeline", "run several stages in one process"),
+    "train": ("training", "classifiers / sweeps over the feature stores"),
+    "retrieve": ("retrieval", "nearest-neighbor search over a feature store"),
+    "serve": ("embedding_service", "warm embedding service on localhost"),
+    "benchmark": ("benchmark", "benchmark on synthetic data"),
+}
+
+# הפקודות שחייבות לעלות מהר, והמודולים שאסור שייטענו בהן
+LIGHT_COMMANDS = ("merge", "filter", "summary", "poc", "analyze", "analyze-frontal", "dedup")
+HEAVY_MODULES = ("torch", "torchvision", "transformers")
+STARTUP_BUDGET_S = 1.0
+
+
+def load(command):
+    """import של המודול של הפקודה (בלי להריץ אותה)"""
+    return importlib.import_module(COMMANDS[command][0])
+
+
+def run(command, argv):
+    """מריץ את main של הסקריפט כאילו הופעל ישירות, עם שאר הארגומנטים"""
+    module = load(command)
+    sys.argv = [f"cli {command}", *argv]
+    return module.main()
+
+
+# נמדד בתהליך חדש: זמן ה-import של הפקודה + אילו מודולים כבדים נטענו
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+import cli
+cli.load({command!r})
+seconds = time.perf_counter() - start
+print(seconds, ",".join(m for m in cli.HEAVY_MODULES if m in sys.modules))
+"""
+
+
+def startup_report(commands=LIGHT_COMMANDS):
+    """
+    For every command, in a fresh interpreter: the import time of its
+    module, the wall time of `python -m cli <command> --help` and which
+    heavy modules got loaded.
+    """
+    rows = []
+    for command in commands:
+        probe = subprocess.run([sys.executable, "-c", _PROBE.format(command=command)], capture_output=True,
+                               text=True, check=True)
+        seconds, _, heavy = probe.stdout.strip().partition(" ")
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "cli", command, "--help"], capture_output=True, check=True)
+        rows.append({"command": command, "import_s": float(seconds), "help_s": time.perf_counter() - start,
+                     "heavy": heavy})
+    return rows
+
+
+def check_startup(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="cli check-startup",
+                                     description="Fail if a light command is slow to start or loads torch")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_S, help="seconds per command")
+    parser.add_argument("commands", nargs="*", metavar="COMMAND", help=f"default: {' '.join(LIGHT_COMMANDS)}")
+    args = parser.parse_args(argv)
+    unknown = [c for c in args.commands if c not in COMMANDS]
+    if unknown:
+        parser.error(f"unknown command(s): {', '.join(unknown)}")
+
+    failed = False
+    print(f"{'command':<16} {'import':>8} {'--help':>8}  heavy modules")
+    for row in startup_report(args.commands or LIGHT_COMMANDS):
+        over = row["help_s"] > args.budget or (row["heavy"] and row["command"] in LIGHT_COMMANDS)
+        failed |= bool(over)
+        print(f"{row['command']:<16} {row['import_s']:7.3f}s {row['help_s']:7.3f}s  {row['heavy'] or '-'}"
+              + ("  <-- over budget" if over else ""))
+    print(f"Budget: {args.budget:.2f}s per command - {'FAILED' if failed else 'OK'}")
+    return 1 if failed else 0
+
+
+def print_usage():
+    print("usage: python -m cli <command> [options]   (python -m cli <command> --help for its options)")
+    print("\ncommands:")
+    for name, (_, description) in COMMANDS.items():
+        print(f"  {name:<16} {description}")
+    print(f"  {'check-startup':<16} import-time budget of the light commands")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print_usage()
+        return 0
+    command, rest = argv[0], argv[1:]
+    if command == "check-startup":
+        return check_startup(rest)
+    if command not in COMMANDS:
+        print(f"Error: unknown command {command!r}\n")
+        print_usage()
+        return 2
+    run(command, rest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
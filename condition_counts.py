@@ -0,0 +1,121 @@
+import pandas as pd
+
+from data_io import iter_table_chunks, table_columns
+from instrumentation import metrics
+
+# שני סגנונות הספירה הקיימים בפרויקט:
+# "merged"  - כמו analyze_data.py: רק שורה שכולה 'normal' נספרת כ-normal, 'unknown' לא נספר
+# "frontal" - כמו analyze_frontal_stats.py: כל מחלה שמכילה 'normal' נספרת כ-normal
+STYLES = ("merged", "frontal")
+
+# ביטויים שמסמנים impression תקין
+IMPRESSION_NORMAL_PATTERN = "normal|no acute|unremarkable"
+
+CHUNK_SIZE = 100_000
+
+
+def find_condition_column(columns, allow_impression=False):
+    """בדיקה גמישה לשם העמודה (Problems / problems / impression)"""
+    candidates = ["problems", "Problems"] + (["impression"] if allow_impression else [])
+    for column in candidates:
+        if column in columns:
+            return column
+    return None
+
+
+def split_conditions(series, style="merged", impression=False):
+    """
+    Splits a Problems/impression column into one cleaned condition per row
+    of the result. The index is kept, so results can be grouped by any
+    column of the original table (e.g. projection).
+    """
+    if style not in STYLES:
+        raise ValueError(f"style must be one of {STYLES}, got {style!r}")
+
+    # הופכים למחרוזת ואותיות קטנות (ערך חסר הופך ל-'nan' כמו str())
+    text = series.astype(str).fillna("nan").str.lower()
+
+    if style == "merged":
+        # שורה שכולה "normal" נספרת פעם אחת
+        whole_normal = text == "normal"
+        rest = text[~whole_normal]
+    else:
+        text = text[text != "nan"]
+        whole_normal = pd.Series(False, index=text.index)
+        if impression:
+            whole_normal = text.str.contains(IMPRESSION_NORMAL_PATTERN, regex=True)
+        rest = text[~whole_normal]
+
+    # פירוק לפי ; / , וניקוי רווחים
+    tokens = rest.str.replace(r"[;/]", ",", regex=True).str.split(",").explode().str.strip()
+    tokens = tokens[tokens.str.len() > 2]
+
+    if style == "merged":
+        tokens = tokens[~tokens.isin(["normal", "nan", "unknown"])]
+    else:
+        tokens = tokens[tokens != "nan"]
+        tokens = tokens.where(~tokens.str.contains("normal", regex=False), "normal")
+
+    normals = pd.Series("normal", index=text.index[whole_normal.to_numpy()])
+    # מיון יציב לפי השורה המקורית - שומר על סדר ההופעה כמו בלולאה הישנה
+    return pd.concat([normals, tokens]).sort_index(kind="stable")
+
+
+def count_conditions(series, style="merged", impression=False):
+    """ספירת מחלות (כמו Counter) ממוינת מהנפוצה לפחות נפוצה"""
+    counts = split_conditions(series, style, impression).value_counts(sort=False)
+    return counts.sort_values(ascending=False, kind="stable")
+
+
+def condition_table(df, column, by=None, style="merged"):
+    """
+    Condition counts for several cohorts from a single split of the column:
+    an 'all' column plus one column per value of `by` (e.g. Frontal/Lateral).
+    """
+    tokens = split_conditions(df[column], style, impression=column == "impression")
+    table = tokens.value_counts(sort=False).rename("all").to_frame()
+
+    if by is not None:
+        groups = df[by].astype(str).reindex(tokens.index)
+        per_group = pd.crosstab(tokens.to_numpy(), groups.to_numpy())
+        table = table.join(per_group, how="left").fillna(0)
+
+    table = table.astype("int64")
+    return table.sort_values("all", ascending=False, kind="stable")
+
+
+def scan_condition_counts(csv_path, column=None, by=None, style="merged", chunksize=CHUNK_SIZE):
+    """
+    Reads only the needed columns of a (possibly huge) CSV or parquet table
+    in chunks and returns (condition table, number of rows per cohort).
+    """
+    if column is None:
+        header = table_columns(csv_path)
+        column = find_condition_column(header, allow_impression=style == "frontal")
+        if column is None:
+            raise ValueError(f"No Problems/impression column in {csv_path}")
+
+    usecols = [column] + ([by] if by else [])
+    dtype = {column: "object"}
+    if by:
+        dtype[by] = "category"
+
+    tables = []
+    rows = pd.Series(dtype="int64")
+    reader = metrics.timed_iter(iter_table_chunks(csv_path, usecols, chunksize, dtype), "analyze.read")
+    for chunk in reader:
+        with metrics.stage("analyze.count"):
+            tables.append(condition_table(chunk, column, by, style))
+            metrics.count("rows", len(chunk))
+        chunk_rows = pd.Series({"all": len(chunk)})
+        if by:
+            chunk_rows = pd.concat([chunk_rows, chunk[by].astype(str).value_counts()])
+        rows = rows.add(chunk_rows, fill_value=0)
+
+    if not tables:
+        return pd.DataFrame(columns=["all"], dtype="int64"), rows.astype("int64")
+
+    # איחוד הספירות של כל ה-chunks (שומרים על סדר ההופעה הראשונה)
+    combined = pd.concat(tables).groupby(level=0, sort=False).sum()
+    combined = combined.fillna(0).astype("int64").sort_values("all", ascending=False, kind="stable")
+    return combined, rows.astype("int64")
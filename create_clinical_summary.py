@@ -1,30 +1,19 @@
 import pandas as pd
+import re
+import argparse
 from pathlib import Path
 import os
 from dotenv import load_dotenv
 
-# 1. טעינת נתיבים והגדרות
-load_dotenv()
-env_path = os.getenv("DATA_PATH")
+from data_io import MERGED_CSV, SUMMARY_CSV, add_table_arguments, configure_tables, read_table, write_table
+import instrumentation
+from instrumentation import metrics
 
-if not env_path:
-    print("ERROR: DATA_PATH not found in .env file.")
-    exit()
+# מילים שמעידות שה-indication כבר מנוסח בזהירות
+SAFE_WORDS = ['suspect', 'evaluate', 'history', 'pain', 'indication', 'check']
 
-base_path = Path(env_path)
-input_csv = base_path / "indiana_merged_data.csv"
-output_csv = base_path / "indiana_reports_with_summary.csv"
 
-# 2. טעינת הטבלה
-print(f"Loading data from: {input_csv}...")
-try:
-    df = pd.read_csv(input_csv)
-except FileNotFoundError:
-    print("ERROR: Input file not found. Make sure 'indiana_merged_data.csv' exists.")
-    exit()
-
-
-# 3. הפונקציה ליצירת הסיכום (הלב של המשימה)
+# הפונקציה ליצירת הסיכום (הלב של המשימה)
 def generate_clinical_summary(row):
     """
     Generates a structured clinical summary text based on the task requirements.
@@ -61,10 +50,9 @@ def generate_clinical_summary(row):
         # אם הטקסט כבר מכיל מילות הסתייגות, נשאיר אותו כמו שהוא.
         # אחרת, נוסיף הקדמה שמבהירה שזה הקשר קליני ולא אבחנה סופית.
         lower_ind = indication.lower()
-        safe_words = ['suspect', 'evaluate', 'history', 'pain', 'indication', 'check']
 
         # בדיקה האם יש מילת קישור בטוחה
-        is_safe = any(word in lower_ind for word in safe_words)
+        is_safe = any(word in lower_ind for word in SAFE_WORDS)
 
         if is_safe:
             lines.append(indication)
@@ -80,21 +68,112 @@ def generate_clinical_summary(row):
     return "\n".join(lines)
 
 
-# 4. הפעלת הפונקציה על כל הטבלה
-print("Generating summaries for all patients...")
-# שימוש ב-apply כדי להריץ את הפונקציה שורה-שורה
-df['clinical_summary'] = df.apply(generate_clinical_summary, axis=1)
-
-# 5. בדיקת איכות (QC) - הצגת דוגמה אקראית
-print("\n" + "=" * 40)
-print("SAMPLE RESULT (Random Patient):")
-print("=" * 40)
-sample = df[df['clinical_summary'] != ""].sample(1).iloc[0]
-print(f"File: {sample.get('filename', 'Unknown')}")
-print("-" * 20)
-print(sample['clinical_summary'])
-print("=" * 40)
-
-# 6. שמירת הקובץ החדש
-df.to_csv(output_csv, index=False, encoding='utf-8-sig')
-print(f"\nSUCCESS: Saved updated data to: {output_csv}")
\ No newline at end of file
+def _summary_field(df, column):
+    """
+    Column-wide equivalent of str(row.get(column, '')).strip() plus the
+    "exists and is not 'nan'" check. Returns (text, mask).
+    """
+    if column not in df.columns:
+        empty = pd.Series("", index=df.index).astype(str)
+        return empty, pd.Series(False, index=df.index)
+
+    # str() על NaN נותן 'nan' - לכן ערך חסר נחשב ריק בדיוק כמו בגרסה השורתית
+    text = df[column].astype(str).str.strip()
+    mask = (text.notna() & (text != "") & (text.str.lower() != "nan")).fillna(False).astype(bool)
+    return text.where(mask, ""), mask
+
+
+def generate_clinical_summaries(df):
+    """
+    Vectorized version of generate_clinical_summary for the whole table.
+    Produces exactly the same strings, using pandas string ops and masks.
+    """
+    findings, has_findings = _summary_field(df, 'findings')
+    impression, has_impression = _summary_field(df, 'impression')
+    indication, has_indication = _summary_field(df, 'indication')
+
+    # ניסוח זהיר: אם אין מילת הסתייגות - מוסיפים הקדמה
+    safe_pattern = "|".join(re.escape(word) for word in SAFE_WORDS)
+    is_safe = indication.str.lower().str.contains(safe_pattern, regex=True).fillna(False).astype(bool)
+    interpretation = indication.where(is_safe, "Clinical context suggests: " + indication)
+
+    summary = (
+        "Clinical Summary:"
+        + ("\nImaging Findings:\n" + findings).where(has_findings, "")
+        + ("\nRadiological Impression:\n" + impression).where(has_impression, "")
+        + ("\nPossible Clinical Interpretation:\n" + interpretation).where(has_indication, "")
+    )
+
+    # אם לא נוסף שום מידע מעבר לכותרת הראשית - ערך ריק
+    return summary.where(has_findings | has_impression | has_indication, "").astype(object)
+
+
+def check_summary_parity(df):
+    """משווה את הגרסה הווקטורית לפונקציה השורתית, ומחזיר את מספר השורות השונות"""
+    expected = df.apply(generate_clinical_summary, axis=1) if len(df) else pd.Series([], dtype=object)
+    actual = generate_clinical_summaries(df)
+    return sum(a != b for a, b in zip(expected.tolist(), actual.tolist()))
+
+
+def add_clinical_summary(df):
+    """מוסיף לטבלה את עמודת clinical_summary (בגרסה הווקטורית)"""
+    with metrics.stage("summary"):
+        metrics.count("rows", len(df))
+        return df.assign(clinical_summary=generate_clinical_summaries(df))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add a structured clinical summary to every report")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="compare the vectorized summaries with the row-wise function and exit")
+    add_table_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    configure_tables(args)
+
+    # 1. טעינת נתיבים והגדרות
+    load_dotenv()
+    env_path = os.getenv("DATA_PATH")
+
+    if not env_path:
+        print("ERROR: DATA_PATH not found in .env file.")
+        exit()
+
+    base_path = Path(env_path)
+
+    # 2. טעינת הטבלה
+    print(f"Loading data from: {base_path / MERGED_CSV} (or its parquet version)...")
+    try:
+        df = read_table(base_path, MERGED_CSV)
+    except FileNotFoundError:
+        print("ERROR: Input file not found. Make sure 'indiana_merged_data.csv' exists.")
+        exit()
+
+    if args.check_parity:
+        mismatches = check_summary_parity(df)
+        print(f"Parity check: {mismatches} mismatching rows out of {len(df)}")
+        exit(1 if mismatches else 0)
+
+    # 3. הפעלת הפונקציה על כל הטבלה
+    print("Generating summaries for all patients...")
+    df = add_clinical_summary(df)
+
+    # 4. בדיקת איכות (QC) - הצגת דוגמה אקראית
+    print("\n" + "=" * 40)
+    print("SAMPLE RESULT (Random Patient):")
+    print("=" * 40)
+    sample = df[df['clinical_summary'] != ""].sample(1).iloc[0]
+    print(f"File: {sample.get('filename', 'Unknown')}")
+    print("-" * 20)
+    print(sample['clinical_summary'])
+    print("=" * 40)
+
+    # 5. שמירת הקובץ החדש
+    output_csv = write_table(df, base_path, SUMMARY_CSV)
+    print(f"\nSUCCESS: Saved updated data to: {output_csv}")
+
+    instrumentation.finish(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,27 @@
-import pandas as pd
 from pathlib import Path
 import os
+import argparse
 from dotenv import load_dotenv
 
-# 1. טעינת הגדרות
-load_dotenv()
-base_path = Path(os.getenv("DATA_PATH"))
-
-input_csv = base_path / "indiana_frontal.csv"
-poc_output_csv = base_path / "indiana_poc_balanced.csv"
+from data_io import (DUPLICATES_CSV, FRONTAL_CSV, POC_CSV, POC_SPLIT_TEMPLATE, add_table_arguments, configure_tables,
+                     read_table, resolve_table, write_table)
+from dataset_builder import (DEFAULT_FRACTIONS, assign_splits, drop_split_leaks, split_summary, stratified_sample,
+                             write_splits)
+from image_index import lookup_table
+from label_engine import DEFAULT_RULES_PATH, LabelEngine
+import instrumentation
+from instrumentation import metrics
 
 RANDOM_SEED = 42
 
-# 2. טעינה
-print(f"Loading data from: {input_csv}")
-df = pd.read_csv(input_csv)
+# שיניתי ל-150 לפי בקשתך - לייט ומהיר
+SAMPLES_PER_CLASS = 150
 
+# הסוגים שנכנסים ל-POC, לפי סדר הדגימה (Other לא נכנס)
+POC_CLASSES = ["Normal", "Opacity", "Cardiomegaly"]
 
-# 3. תיוג (Labeling Logic)
+
+# תיוג (Labeling Logic) - גרסת הייחוס השורתית, החוקים עצמם נמצאים ב-label_rules.json
 def assign_label(row):
     text_parts = [
         str(row.get('findings', '')),
@@ -36,47 +40,111 @@ def assign_label(row):
     return 'Other'
 
 
-print("Assigning labels...")
-df['label'] = df.apply(assign_label, axis=1)
-
-# סינון ראשוני
-df_labeled = df[df['label'] != 'Other'].copy()
-
-# 4. יצירת ה-POC המצומצם (150 מכל סוג)
-# שיניתי ל-150 לפי בקשתך - לייט ומהיר
-SAMPLES_PER_CLASS = 150
-
-print(f"\nBalancing dataset (Taking {SAMPLES_PER_CLASS} from each class)...")
-
-normal_df = df_labeled[df_labeled['label'] == 'Normal']
-opacity_df = df_labeled[df_labeled['label'] == 'Opacity']
-cardio_df = df_labeled[df_labeled['label'] == 'Cardiomegaly']
-
-# בדיקה שיש לנו מספיק (למרות שאנחנו יודעים שיש)
-try:
-    df_poc = pd.concat([
-        normal_df.sample(n=SAMPLES_PER_CLASS, random_state=RANDOM_SEED),
-        opacity_df.sample(n=SAMPLES_PER_CLASS, random_state=RANDOM_SEED),
-        cardio_df.sample(n=SAMPLES_PER_CLASS, random_state=RANDOM_SEED)
-    ])
-except ValueError:
-    print("Warning: Not enough data for requested size. Taking maximum possible.")
-    min_val = min(len(normal_df), len(opacity_df), len(cardio_df))
-    df_poc = pd.concat([
-        normal_df.sample(n=min_val, random_state=RANDOM_SEED),
-        opacity_df.sample(n=min_val, random_state=RANDOM_SEED),
-        cardio_df.sample(n=min_val, random_state=RANDOM_SEED)
-    ])
-
-# ערבוב סופי
-df_poc = df_poc.sample(frac=1, random_state=RANDOM_SEED).reset_index(drop=True)
-
-# 5. שמירה
-df_poc.to_csv(poc_output_csv, index=False, encoding='utf-8-sig')
-
-print("-" * 30)
-print(f"SUCCESS: Created Light POC dataset at: {poc_output_csv}")
-print(f"Total images: {len(df_poc)}")
-print("Class breakdown:")
-print(df_poc['label'].value_counts())
-print("-" * 30)
\ No newline at end of file
+def label_reports(df, rules_path=DEFAULT_RULES_PATH):
+    """מוסיף לטבלה את עמודת label (תיוג וקטורי לפי חוקי ה-config)"""
+    with metrics.stage("labeling"):
+        metrics.count("rows", len(df))
+        return df.assign(label=LabelEngine.from_file(rules_path).assign(df))
+
+
+def build_poc_dataset(df, samples_per_class=SAMPLES_PER_CLASS, seed=RANDOM_SEED, rules_path=DEFAULT_RULES_PATH,
+                      classes=POC_CLASSES, ratios=None):
+    """
+    תיוג, סינון ה-Other ודגימה מאוזנת של samples_per_class מכל סוג.
+    Any label set works (classes, in sampling order); with ratios the class
+    mix follows the given weights instead of equal counts.
+    """
+    df = label_reports(df, rules_path)
+    counts = df['label'].value_counts()
+
+    # אם לאחד הסוגים אין מספיק - כולם מקבלים את המינימום (כמו קודם)
+    short = [c for c in classes if counts.get(c, 0) < samples_per_class]
+    if ratios is None and short:
+        print("Warning: Not enough data for requested size. Taking maximum possible.")
+
+    # דגימה אחת לפי groupby + ערבוב סופי
+    return stratified_sample(df, "label", per_class=None if ratios else samples_per_class, ratios=ratios,
+                             equalize=ratios is None, labels=list(classes), seed=seed)
+
+
+def split_poc_dataset(df_poc, base_path, fractions=DEFAULT_FRACTIONS, seed=RANDOM_SEED, duplicates=None):
+    """
+    חלוקה ל-train/val/test לפי uid (שני הצילומים של אותו מחקר תמיד באותו חלק)
+    ושמירת קובץ לכל חלק. Returns (df with a split column, {split: path}).
+    With duplicates (the image_dedup table) near-duplicate images that
+    would land in more than one split are kept only in the first one.
+    """
+    df_poc = df_poc.assign(split=assign_splits(df_poc, "uid", fractions, seed))
+    if duplicates is not None:
+        groups = lookup_table(duplicates)["group"].reindex(df_poc["filename"].astype(str).to_numpy())
+        df_poc, dropped = drop_split_leaks(df_poc, groups.to_numpy())
+        print(f"Dropped {dropped} near-duplicate images that leaked across splits")
+    return df_poc, write_splits(df_poc, base_path, POC_SPLIT_TEMPLATE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label the frontal images and build the balanced POC dataset")
+    parser.add_argument("--rules", default=str(DEFAULT_RULES_PATH), help="label rules JSON (priority ordered)")
+    parser.add_argument("--samples-per-class", type=int, default=SAMPLES_PER_CLASS)
+    parser.add_argument("--classes", default=",".join(POC_CLASSES), help="comma separated labels to sample")
+    parser.add_argument("--ratios", default=None,
+                        help="class mix instead of equal counts, e.g. Normal=2,Opacity=1,Cardiomegaly=1")
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED)
+    parser.add_argument("--splits", nargs="?", const=",".join(map(str, DEFAULT_FRACTIONS)), default=None,
+                        metavar="TRAIN,VAL,TEST", help="also write uid-grouped train/val/test files")
+    parser.add_argument("--drop-duplicates", nargs="?", const=DUPLICATES_CSV, default=None, metavar="TABLE",
+                        help="with --splits: drop near-duplicate images leaking across splits (image_dedup table)")
+    add_table_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    configure_tables(args)
+
+    # 1. טעינת הגדרות
+    load_dotenv()
+    base_path = Path(os.getenv("DATA_PATH"))
+
+    # 2. טעינה
+    print(f"Loading data from: {resolve_table(base_path, FRONTAL_CSV)}")
+    df = read_table(base_path, FRONTAL_CSV)
+
+    # 3. תיוג ויצירת ה-POC המצומצם (150 מכל סוג)
+    print("Assigning labels...")
+    classes = [c.strip() for c in args.classes.split(",") if c.strip()]
+    ratios = None
+    if args.ratios:
+        ratios = {k.strip(): float(v) for k, v in (item.split("=") for item in args.ratios.split(","))}
+        print(f"\nSampling dataset with class ratios {ratios}...")
+    else:
+        print(f"\nBalancing dataset (Taking {args.samples_per_class} from each class)...")
+    df_poc = build_poc_dataset(df, args.samples_per_class, args.seed, args.rules, classes, ratios)
+
+    # 4. שמירה
+    poc_output_csv = write_table(df_poc, base_path, POC_CSV)
+
+    print("-" * 30)
+    print(f"SUCCESS: Created Light POC dataset at: {poc_output_csv}")
+    print(f"Total images: {len(df_poc)}")
+    print("Class breakdown:")
+    print(df_poc['label'].value_counts())
+    print("-" * 30)
+
+    # 5. חלוקה ל-train/val/test (אופציונלי)
+    if args.splits:
+        fractions = [float(f) for f in args.splits.split(",")]
+        duplicates = None
+        if args.drop_duplicates:
+            try:
+                duplicates = read_table(base_path, args.drop_duplicates)
+            except FileNotFoundError:
+                print(f"Error: {args.drop_duplicates} not found - run image_dedup.py first")
+                exit()
+        df_split, paths = split_poc_dataset(df_poc, base_path, fractions, args.seed, duplicates)
+        for split, path in paths.items():
+            print(f"Saved {split}: {path}")
+        print(split_summary(df_split))
+
+    instrumentation.finish(args)
+
+
+if __name__ == "__main__":
+    main()
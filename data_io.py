@@ -0,0 +1,244 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from instrumentation import metrics
+
+# שמות קבצי הביניים של ה-pipeline (כולם בתוך DATA_PATH)
+PROJECTIONS_CSV = "indiana_projections.csv"
+REPORTS_CSV = "indiana_reports.csv"
+MERGED_CSV = "indiana_merged_data.csv"
+FRONTAL_CSV = "indiana_frontal.csv"
+SUMMARY_CSV = "indiana_reports_with_summary.csv"
+POC_CSV = "indiana_poc_balanced.csv"
+POC_SPLIT_TEMPLATE = "indiana_poc_{split}.csv"
+DUPLICATES_CSV = "indiana_image_duplicates.csv"
+
+# BOM כדי שאקסל יפתח את העברית/הטקסט נכון
+CSV_ENCODING = "utf-8-sig"
+
+# פורמט טבלאות הביניים: parquet (עמודתי, קריאה של עמודות בודדות) או csv
+TABLE_FORMATS = ("parquet", "csv")
+PARQUET_SUFFIX = ".parquet"
+
+# נקבע ע"י configure_tables (דגלי שורת הפקודה) או משתנה הסביבה TABLE_FORMAT
+_settings = {"format": None, "export_csv": False}
+
+
+def get_base_path():
+    """טעינת DATA_PATH מקובץ ה-.env"""
+    load_dotenv()
+    env_path = os.getenv("DATA_PATH")
+    if not env_path:
+        raise ValueError("Error: DATA_PATH is missing. Please create a .env file with your path.")
+    return Path(env_path)
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def table_format():
+    """הפורמט לכתיבה: --format, אחרת TABLE_FORMAT מה-.env, אחרת parquet אם pyarrow מותקן"""
+    fmt = _settings["format"] or os.getenv("TABLE_FORMAT")
+    if fmt is None:
+        return "parquet" if parquet_available() else "csv"
+    if fmt not in TABLE_FORMATS:
+        raise ValueError(f"table format must be one of {TABLE_FORMATS}, got {fmt!r}")
+    if fmt == "parquet" and not parquet_available():
+        raise ImportError("Writing parquet needs pyarrow (pip install pyarrow), or use --format csv")
+    return fmt
+
+
+def configure_tables(args):
+    """מפעיל את --format / --export-csv של הסקריפט על כל הכתיבות בתהליך"""
+    _settings["format"] = getattr(args, "format", None)
+    _settings["export_csv"] = getattr(args, "export_csv", False)
+
+
+def add_table_arguments(parser):
+    """הדגלים המשותפים לכל סקריפט שכותב טבלת ביניים"""
+    parser.add_argument("--format", choices=TABLE_FORMATS, default=None,
+                        help="intermediate table format (default: parquet when pyarrow is installed)")
+    parser.add_argument("--export-csv", action="store_true", help="also write a CSV copy of every table")
+
+
+def table_path(base_path, name, fmt):
+    """השם הלוגי הוא תמיד ה-.csv; בפורמט parquet רק הסיומת מתחלפת"""
+    path = Path(base_path) / name
+    return path.with_suffix(PARQUET_SUFFIX) if fmt == "parquet" else path
+
+
+def resolve_table(base_path, name):
+    """
+    Returns the file that holds a table: the parquet or the CSV version,
+    whichever exists (the newer one if both do, so a stale copy is never
+    read). Raises FileNotFoundError if there is neither.
+    """
+    candidates = [p for p in (table_path(base_path, name, "parquet"), table_path(base_path, name, "csv"))
+                  if p.exists()]
+    if not candidates:
+        raise FileNotFoundError(f"No such table: {Path(base_path) / name}")
+    return max(candidates, key=lambda p: p.stat().st_mtime_ns)
+
+
+def table_columns(path):
+    """שמות העמודות בלבד (בלי לקרוא את הנתונים)"""
+    path = Path(path)
+    if path.suffix == PARQUET_SUFFIX:
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def table_num_rows(path):
+    """מספר השורות מתוך ה-metadata של parquet (בלי לקרוא נתונים); ב-CSV אין כזה - None"""
+    path = Path(path)
+    if path.suffix != PARQUET_SUFFIX:
+        return None
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def _apply_filters(df, filters):
+    """אותם filters כמו ב-read_parquet: רשימת (עמודה, אופרטור, ערך)"""
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        if op == "==":
+            mask &= df[column] == value
+        elif op == "!=":
+            mask &= df[column] != value
+        elif op == "in":
+            mask &= df[column].isin(value)
+        else:
+            raise ValueError(f"unsupported filter operator {op!r}")
+    return df[mask]
+
+
+def read_table(base_path, name, columns=None, filters=None, **kwargs):
+    """
+    קריאת טבלת ביניים מתוך DATA_PATH.
+    columns - רק העמודות האלה (ב-parquet שאר העמודות לא נקראות מהדיסק כלל)
+    filters - [(column, "==", value), ...] סינון שורות (ב-parquet כבר בזמן הקריאה)
+    """
+    path = resolve_table(base_path, name)
+    with metrics.stage("io.read"):
+        if path.suffix == PARQUET_SUFFIX:
+            df = pd.read_parquet(path, columns=columns, filters=filters, **kwargs)
+        else:
+            usecols = columns
+            if columns is not None and filters:
+                usecols = list(dict.fromkeys(list(columns) + [f[0] for f in filters]))
+            df = pd.read_csv(path, usecols=usecols, **kwargs)
+            if filters:
+                df = _apply_filters(df, filters)[columns if columns is not None else df.columns]
+                df = df.reset_index(drop=True)
+        if isinstance(df, pd.DataFrame):
+            metrics.count("rows", len(df))
+    return df
+
+
+def iter_table_chunks(path, columns, chunksize, dtype=None):
+    """קריאה בחלקים של עמודות נבחרות - גם מ-CSV וגם מ-parquet (לפי row groups/batches)"""
+    path = Path(path)
+    if path.suffix != PARQUET_SUFFIX:
+        yield from pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=chunksize)
+        return
+
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+        chunk = batch.to_pandas()
+        yield chunk.astype(dtype) if dtype else chunk
+
+
+def write_table(df, base_path, name, fmt=None):
+    """שמירת טבלת ביניים לתוך DATA_PATH ומחזיר את הנתיב (עם --export-csv נשמר גם CSV)"""
+    fmt = fmt or table_format()
+    output_path = table_path(base_path, name, fmt)
+    with metrics.stage("io.write"):
+        # ה-CSV נכתב ראשון - כך ה-parquet הוא העותק החדש יותר ו-resolve_table יבחר בו
+        if fmt == "csv" or _settings["export_csv"]:
+            df.to_csv(table_path(base_path, name, "csv"), index=False, encoding=CSV_ENCODING)
+        if fmt == "parquet":
+            df.to_parquet(output_path, index=False)
+        metrics.count("rows", len(df))
+    return output_path
+
+
+class TableWriter:
+    """
+    Incremental write_table: DataFrame chunks are appended as they arrive
+    (parquet row groups / CSV rows) to temporary files, which replace the
+    final files only on close - an interrupted run never leaves half a table.
+    """
+
+    def __init__(self, base_path, name, fmt=None):
+        self.fmt = fmt or table_format()
+        self.path = table_path(base_path, name, self.fmt)
+        self.csv_path = table_path(base_path, name, "csv") if self.fmt == "csv" or _settings["export_csv"] else None
+        self.rows = 0
+        self._parquet = None
+        self._schema = None
+        self._tmp = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _tmp_path(self, path):
+        tmp = path.with_name(path.name + ".tmp")
+        if tmp not in self._tmp:
+            self._tmp.append(tmp)
+        return tmp
+
+    def write(self, df):
+        with metrics.stage("io.write"):
+            if self.csv_path is not None:
+                # BOM רק בתחילת הקובץ
+                first = self.rows == 0
+                df.to_csv(self._tmp_path(self.csv_path), index=False, header=first, mode="w" if first else "a",
+                          encoding=CSV_ENCODING if first else "utf-8")
+            if self.fmt == "parquet":
+                self._write_parquet(df)
+            self.rows += len(df)
+            metrics.count("rows", len(df))
+
+    def _write_parquet(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._parquet is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            # עמודה שכולה ריקה ב-chunk הראשון תקבל טקסט ב-chunk הבא
+            self._schema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f
+                                      for f in table.schema], metadata=table.schema.metadata)
+            self._parquet = pq.ParquetWriter(self._tmp_path(self.path), self._schema)
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        self._parquet.write_table(table)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        # אותו סדר כמו ב-write_table: ה-CSV קודם, ה-parquet אחרון (החדש יותר)
+        if self.csv_path is not None and self.rows:
+            os.replace(self._tmp_path(self.csv_path), self.csv_path)
+        if self._parquet is not None:
+            os.replace(self._tmp_path(self.path), self.path)
+        return self.path
+
+    def abort(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        for tmp in self._tmp:
+            tmp.unlink(missing_ok=True)
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from data_io import write_table
+
+SPLITS = ("train", "val", "test")
+DEFAULT_FRACTIONS = (0.7, 0.15, 0.15)
+
+
+def class_targets(counts, per_class=None, ratios=None, total=None, equalize=False):
+    """
+    How many rows to take from every label, given the available counts:
+      per_class - a cap for all labels (int) or per label (dict)
+      ratios    - target mix, e.g. {"Normal": 2, "Opacity": 1}; with total the
+                  sample has that size, otherwise the largest size the
+                  available rows allow
+      equalize  - every label gets the same number (the smallest target),
+                  like the old POC fallback
+    Labels missing from per_class/ratios are dropped.
+    """
+    counts = counts.astype("int64")
+    if ratios is not None:
+        weights = pd.Series(ratios, dtype="float64").reindex(counts.index).dropna()
+        weights = weights[weights > 0] / weights[weights > 0].sum()
+        available = counts[weights.index]
+        size = total if total is not None else int((available / weights).min())
+        targets = np.floor(weights * size).astype("int64").clip(upper=available)
+    elif per_class is not None:
+        caps = pd.Series(per_class, index=counts.index) if np.isscalar(per_class) \
+            else pd.Series(per_class).reindex(counts.index).dropna()
+        targets = np.minimum(caps.astype("int64"), counts[caps.index])
+    else:
+        targets = counts.copy()
+
+    if equalize and len(targets):
+        targets[:] = targets.min()
+    return targets
+
+
+def stratified_sample(df, label_col="label", per_class=None, ratios=None, total=None, equalize=False,
+                      labels=None, seed=42, shuffle=True):
+    """
+    One grouped pass over df: every label group is sampled to its target
+    (see class_targets) with the same random_state, the groups are joined in
+    `labels` order (default: first appearance) and optionally shuffled.
+    """
+    groups = df.groupby(label_col, sort=False, observed=True)
+    counts = groups.size()
+    if labels is not None:
+        counts = counts.reindex(labels, fill_value=0)
+    targets = class_targets(counts, per_class, ratios, total, equalize)
+
+    parts = [groups.get_group(label).sample(n=int(n), random_state=seed)
+             for label, n in targets.items() if n > 0]
+    sample = pd.concat(parts) if parts else df.iloc[:0]
+    if shuffle:
+        sample = sample.sample(frac=1, random_state=seed)
+    return sample.reset_index(drop=True)
+
+
+def group_uniform(groups, seed=0):
+    """
+    A deterministic number in [0, 1) per group id (hash of id + seed): the
+    same uid always lands in the same split, whatever the row order or the
+    other rows in the table.
+    """
+    hashed = pd.util.hash_pandas_object(pd.Series(groups).astype(str), index=False,
+                                        hash_key=f"{seed:016d}"[-16:])
+    return hashed.to_numpy() / float(2 ** 64)
+
+
+def assign_splits(df, group_col="uid", fractions=DEFAULT_FRACTIONS, seed=0):
+    """
+    Split name (train/val/test) for every row. All rows of a group (e.g. the
+    frontal and lateral views of one study) get the same split.
+    """
+    fractions = np.asarray(fractions, dtype="float64")
+    if len(fractions) != len(SPLITS) or fractions.min() < 0 or fractions.sum() <= 0:
+        raise ValueError(f"fractions must be {len(SPLITS)} non-negative numbers, got {fractions.tolist()}")
+    bounds = np.cumsum(fractions / fractions.sum())
+    position = np.searchsorted(bounds, group_uniform(df[group_col], seed), side="right")
+    return pd.Series(np.asarray(SPLITS)[np.minimum(position, len(SPLITS) - 1)], index=df.index, name="split")
+
+
+def split_summary(df, label_col="label", split_col="split"):
+    """טבלת label x split - לבדוק שהחלוקה מאוזנת"""
+    return pd.crosstab(df[label_col], df[split_col]).reindex(columns=list(SPLITS), fill_value=0)
+
+
+def drop_split_leaks(df, groups, split_col="split"):
+    """
+    Drops rows whose duplicate group (e.g. near-identical images) already
+    appears in an earlier split - train before val before test - so the
+    same image never sits on both sides of an evaluation. groups holds a
+    group id per row (NaN = no group). Returns (kept rows, number dropped).
+    """
+    groups = pd.Series(np.asarray(groups, dtype=object), index=df.index)
+    groups = groups.where(groups.notna(), pd.Series("row:" + df.index.astype(str), index=df.index))
+    rank = df[split_col].map({split: i for i, split in enumerate(SPLITS)})
+    leak = rank > rank.groupby(groups).transform("min")
+    return df[~leak].reset_index(drop=True), int(leak.sum())
+
+
+def write_splits(df, base_path, name_template, split_col="split"):
+    """
+    Writes one table per split; name_template contains '{split}'
+    (e.g. 'indiana_poc_{split}.csv'). Returns {split: path}.
+    """
+    return {split: write_table(df[df[split_col] == split].reset_index(drop=True), base_path,
+                               name_template.format(split=split))
+            for split in SPLITS}
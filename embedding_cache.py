@@ -0,0 +1,127 @@
+import hashlib
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# קובץ ה-cache נשמר בתוך DATA_PATH ליד שאר התוצרים
+DEFAULT_CACHE_NAME = "embedding_cache.sqlite"
+
+# SQLite מגביל את מספר הפרמטרים בשאילתה אחת
+_QUERY_CHUNK = 500
+
+
+def config_fingerprint(config):
+    """מחרוזת יציבה שמייצגת את ההגדרות (מודל, preprocessing וכו')"""
+    return json.dumps(config, sort_keys=True, default=str)
+
+
+def image_key(path, config):
+    """SHA-256 של תוכן קובץ התמונה + ההגדרות שיצרו את הווקטור"""
+    digest = hashlib.sha256(config_fingerprint(config).encode("utf-8"))
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def image_keys(paths, config, workers=4):
+    """מחשב מפתחות לרשימת תמונות במקביל (hashlib משחרר את ה-GIL)"""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(lambda p: image_key(p, config), paths))
+
+
+def text_key(text, model_name, max_length):
+    """SHA-256 של הטקסט + שם המודל + אורך מקסימלי"""
+    config = config_fingerprint({"model": model_name, "max_length": max_length})
+    return hashlib.sha256(f"{config}\n{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent key -> vector store backed by a single SQLite file.
+    Every get/put marks the entry as used in the current run, so entries
+    that were not needed (deleted or changed inputs) can be evicted afterwards.
+    Image and text vectors share the file; every entry belongs to a
+    namespace ("image" / "text") and eviction only touches its own.
+    """
+
+    def __init__(self, path, namespace="default"):
+        self.path = str(path)
+        self.namespace = namespace
+        self.run_started = time.time()
+        # timeout ארוך - כמה תהליכים (shards) יכולים לכתוב לאותו cache במקביל
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "key TEXT PRIMARY KEY, dtype TEXT NOT NULL, dim INTEGER NOT NULL, "
+            "vector BLOB NOT NULL, last_used REAL NOT NULL, namespace TEXT NOT NULL DEFAULT '')"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(vectors)")]
+        if "namespace" not in columns:
+            # קובץ ישן: הרשומות מקבלות namespace כשהן נקראות שוב, ועד אז אף eviction לא מוחק אותן
+            self.conn.execute("ALTER TABLE vectors ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def get_many(self, keys):
+        """מחזיר {key: vector} רק עבור המפתחות שכבר קיימים ב-cache"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        for start in range(0, len(keys), _QUERY_CHUNK):
+            chunk = keys[start:start + _QUERY_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, dtype, vector FROM vectors WHERE key IN ({marks})", chunk
+            ).fetchall()
+            for key, dtype, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=dtype).copy()
+            self.conn.execute(f"UPDATE vectors SET last_used = ?, namespace = ? WHERE key IN ({marks})",
+                              [now, self.namespace, *chunk])
+        self.conn.commit()
+        return found
+
+    def existing(self, keys):
+        """המפתחות שכבר קיימים ב-cache - בלי לקרוא את הווקטורים עצמם (מסומנים כ-used)"""
+        keys = list(dict.fromkeys(keys))
+        found = set()
+        now = time.time()
+        for start in range(0, len(keys), _QUERY_CHUNK):
+            chunk = keys[start:start + _QUERY_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            found.update(key for key, in self.conn.execute(f"SELECT key FROM vectors WHERE key IN ({marks})", chunk))
+            self.conn.execute(f"UPDATE vectors SET last_used = ?, namespace = ? WHERE key IN ({marks})",
+                              [now, self.namespace, *chunk])
+        self.conn.commit()
+        return found
+
+    def put_many(self, items):
+        """שומר (key, vector) - מפתח קיים נדרס"""
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            vector = np.ascontiguousarray(vector)
+            rows.append((key, vector.dtype.str, vector.shape[-1], vector.tobytes(), now, self.namespace))
+        self.conn.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+
+    def evict_stale(self):
+        """מוחק רשומות של ה-namespace הזה שלא נקראו ולא נכתבו בריצה הנוכחית, ומחזיר כמה נמחקו"""
+        removed = self.conn.execute("DELETE FROM vectors WHERE namespace = ? AND last_used < ?",
+                                    (self.namespace, self.run_started)).rowcount
+        self.conn.commit()
+        return removed
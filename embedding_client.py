@@ -0,0 +1,85 @@
+import argparse
+import base64
+import json
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+# רק ספריית התקן (ו-numpy דרך decode_array) - הלקוח לא טוען torch
+from embedding_service import DEFAULT_HOST, DEFAULT_PORT, decode_array
+
+
+class EmbeddingClient:
+    """
+    Client of embedding_service. Vectors come back as float32 matrices,
+    one row per input, in input order.
+    """
+
+    def __init__(self, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data,
+                                         headers={"Content-Type": "application/json"} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            # השרת מחזיר {"error": ...} - מעבירים את ההודעה שלו
+            raise RuntimeError(json.loads(e.read() or b"{}").get("error", str(e))) from None
+
+    def embed_texts(self, texts):
+        """מטריצה (len(texts), 768) - טקסט ריק מקבל וקטור אפסים, כמו ב-create_text_embeddings"""
+        return decode_array(self._request("/embed/text", {"texts": list(texts)})["vectors"]).copy()
+
+    def embed_images(self, paths=(), images=()):
+        """
+        paths - files the service can open itself (same machine);
+        images - PNG bytes, sent inline. Paths come first in the result.
+        """
+        body = {"paths": [str(p) for p in paths],
+                "images": [base64.b64encode(data).decode("ascii") for data in images]}
+        return decode_array(self._request("/embed/image", body)["vectors"]).copy()
+
+    def stats(self):
+        return self._request("/stats")
+
+    def health(self):
+        return self._request("/health")
+
+    def wait_ready(self, timeout=300, interval=0.5):
+        """מחכה שהשרת יעלה (טעינת המודלים לוקחת זמן)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.health()
+            except (urllib.error.URLError, ConnectionError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a running embedding service")
+    parser.add_argument("--url", default=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+    parser.add_argument("--text", action="append", default=[], help="text to embed (repeatable)")
+    parser.add_argument("--image", action="append", default=[], help="image file to embed (repeatable)")
+    parser.add_argument("--stats", action="store_true", help="print queue depth and latency percentiles")
+    args = parser.parse_args()
+
+    client = EmbeddingClient(args.url)
+    if args.text:
+        vectors = client.embed_texts(args.text)
+        print(f"Text vectors: {vectors.shape}")
+    if args.image:
+        vectors = client.embed_images([Path(p).resolve() for p in args.image])
+        print(f"Image vectors: {vectors.shape}")
+    if args.stats or not (args.text or args.image):
+        print(json.dumps(client.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import argparse
+import base64
+import io
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# השרת מאזין רק ל-localhost - אין אימות, לא לחשוף לרשת
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# batch מקסימלי, וכמה זמן הבקשה הראשונה מחכה שיצטרפו אליה עוד בקשות
+MAX_BATCH = 32
+MAX_LATENCY_MS = 10
+
+# כמה זמני בקשה אחרונים נשמרים לחישוב האחוזונים
+LATENCY_WINDOW = 10_000
+
+
+def encode_array(array):
+    """מטריצה ל-JSON: float32 גולמי ב-base64 (קטן ומהיר בהרבה מרשימת מספרים)"""
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"dtype": "float32", "shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def decode_array(payload):
+    data = base64.b64decode(payload["data"])
+    return np.frombuffer(data, dtype=payload["dtype"]).reshape(payload["shape"])
+
+
+class MicroBatcher:
+    """
+    Groups concurrent requests into one model call. A worker thread takes
+    the oldest request, then keeps adding waiting requests until the batch
+    has max_batch items or max_latency_ms have passed since that first
+    request arrived, runs `fn` on all items at once and hands every request
+    its own rows. A request is never split across batches.
+    """
+
+    def __init__(self, name, fn, max_batch=MAX_BATCH, max_latency_ms=MAX_LATENCY_MS):
+        self.name = name
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_latency = max_latency_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._pending_items = 0
+        self.requests = 0
+        self.items = 0
+        self.batches = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """מחזיר Future שהתוצאה שלו היא מטריצה - שורה לכל item"""
+        future = Future()
+        with self._lock:
+            self._pending_items += len(items)
+        self._queue.put((list(items), future, time.perf_counter()))
+        return future
+
+    def _collect(self, carry):
+        """בקשה ראשונה (מחכה בלי הגבלה) ועוד בקשות עד שה-batch מלא או שעבר max_latency"""
+        first = carry or self._queue.get()
+        batch, size = [first], len(first[0])
+        deadline = first[2] + self.max_latency
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch:
+                # לא נכנס - יפתח את ה-batch הבא
+                return batch, request
+            batch.append(request)
+            size += len(request[0])
+        return batch, None
+
+    def _run(self):
+        carry = None
+        while True:
+            batch, carry = self._collect(carry)
+            items = [item for request in batch for item in request[0]]
+            try:
+                vectors = self.fn(items)
+                error = None
+            except Exception as e:
+                vectors, error = None, e
+
+            done = time.perf_counter()
+            start = 0
+            with self._lock:
+                self._pending_items -= len(items)
+                self.requests += len(batch)
+                self.items += len(items)
+                self.batches += 1
+                self.errors += len(batch) if error is not None else 0
+                self._latencies.extend(done - submitted for _, _, submitted in batch)
+            for request_items, future, _ in batch:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(vectors[start:start + len(request_items)])
+                start += len(request_items)
+
+    def stats(self):
+        """עומק התור, כמויות ואחוזוני latency (ms) של הבקשות האחרונות"""
+        with self._lock:
+            latencies = np.asarray(self._latencies, dtype=np.float64) * 1000
+            stats = {
+                "queue_requests": self._queue.qsize(),
+                "queue_items": self._pending_items,
+                "requests": self.requests,
+                "items": self.items,
+                "batches": self.batches,
+                "errors": self.errors,
+                "mean_batch": round(self.items / self.batches, 2) if self.batches else None,
+            }
+        if len(latencies):
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            stats.update({"latency_ms_p50": round(p50, 3), "latency_ms_p90": round(p90, 3),
+                          "latency_ms_p99": round(p99, 3), "latency_ms_max": round(latencies.max(), 3)})
+        return stats
+
+
+class EmbeddingService:
+    """
+    Both models loaded once and kept warm. Images are decoded and
+    preprocessed in the request threads (in parallel); only the forward
+    passes go through the micro-batchers.
+    """
+
+    def __init__(self, image=True, text=True, text_model=None, quantize=False, optimize="none",
+                 max_batch=MAX_BATCH, max_latency_ms=MAX_LATENCY_MS, max_length=None):
+        self.batchers = {}
+        self.started = time.time()
+        self.info = {}
+        if image:
+            self._load_image(optimize, max_batch, max_latency_ms)
+        if text:
+            self._load_text(text_model, quantize, max_batch, max_latency_ms, max_length)
+
+    def _load_image(self, optimize, max_batch, max_latency_ms):
+        import torch
+        from generate_densenet_features import get_device, load_model, preprocess
+        from inference_opt import optimize_densenet
+
+        print("Loading DenseNet121 model...")
+        device = get_device()
+        model = load_model(device)
+        if optimize != "none":
+            print(f"Optimizing model ({optimize})...")
+            model = optimize_densenet(model, optimize)
+        self._preprocess = preprocess
+
+        def forward(tensors):
+            with torch.inference_mode():
+                return model(torch.stack(tensors).to(device)).flatten(1).cpu().numpy()
+
+        self.batchers["image"] = MicroBatcher("image", forward, max_batch, max_latency_ms)
+        self.info["image"] = {"model": "densenet121", "inference": optimize, "device": str(device)}
+
+    def _load_text(self, text_model, quantize, max_batch, max_latency_ms, max_length):
+        from project_db.create_text_embeddings import MAX_LENGTH, MODEL_NAME, embed_texts, load_inference_model
+
+        text_model = text_model or MODEL_NAME
+        max_length = max_length or MAX_LENGTH
+        print(f"Loading {text_model}...")
+        tokenizer, model, device = load_inference_model(text_model, quantize)
+
+        def forward(texts):
+            # אותו חילוץ CLS כמו ב-create_text_embeddings (כולל מיון לפי אורך ו-padding דינמי)
+            return embed_texts(texts, tokenizer, model, device, max_batch, max_length, progress=False)
+
+        self.batchers["text"] = MicroBatcher("text", forward, max_batch, max_latency_ms)
+        self.info["text"] = {"model": text_model, "inference": "int8" if quantize else "fp32",
+                             "max_length": max_length, "device": str(device)}
+
+    def _decode_image(self, item):
+        from PIL import Image
+
+        if "path" in item:
+            img = Image.open(item["path"])
+        else:
+            img = Image.open(io.BytesIO(base64.b64decode(item["png"])))
+        with img:
+            return self._preprocess(img.convert("RGB"))
+
+    def embed(self, kind, payload):
+        if kind not in self.batchers:
+            raise KeyError(f"{kind} model is not loaded")
+        if kind == "image":
+            items = [{"path": p} for p in payload.get("paths", [])] + [{"png": b} for b in payload.get("images", [])]
+            items = [self._decode_image(item) for item in items]
+        else:
+            items = [text or "" for text in payload.get("texts", [])]
+        if not items:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self.batchers[kind].submit(items).result()
+
+    def stats(self):
+        return {"uptime_s": round(time.time() - self.started, 1), "models": self.info,
+                **{kind: batcher.stats() for kind, batcher in self.batchers.items()}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """POST /embed/text, POST /embed/image, GET /stats, GET /health"""
+
+    service = None
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok", "models": sorted(self.service.batchers)})
+        elif self.path == "/stats":
+            self._send(200, self.service.stats())
+        else:
+            self._send(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        kind = self.path.removeprefix("/embed/")
+        if not self.path.startswith("/embed/") or kind not in ("image", "text"):
+            self._send(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            vectors = self.service.embed(kind, payload)
+        except (KeyError, ValueError, OSError) as e:
+            # תמונה שלא נפתחה / JSON שבור / מודל שלא נטען - שגיאה של הבקשה
+            self._send(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+            return
+        self._send(200, {"vectors": encode_array(vectors)})
+
+    def log_message(self, format, *args):
+        # בלי שורת לוג לכל בקשה
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # ברירת המחדל (5) מפילה חיבורים כשהרבה לקוחות שולחים בבת אחת
+    request_queue_size = 128
+
+
+def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    handler = type("Handler", (_Handler,), {"service": service})
+    server = _Server((host, port), handler)
+    print(f"Embedding service listening on http://{host}:{server.server_address[1]}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep DenseNet121 / ClinicalBERT loaded and embed on request")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="items per model call")
+    parser.add_argument("--max-latency-ms", type=float, default=MAX_LATENCY_MS,
+                        help="how long the first request of a batch waits for more requests")
+    parser.add_argument("--no-image", action="store_true", help="do not load DenseNet121")
+    parser.add_argument("--no-text", action="store_true", help="do not load ClinicalBERT")
+    parser.add_argument("--text-model", default=None)
+    parser.add_argument("--optimize", choices=["none", "channels_last", "script", "compile"], default="none",
+                        help="CPU inference mode for DenseNet")
+    parser.add_argument("--quantize", action="store_true", help="INT8 ClinicalBERT on CPU")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.no_image and args.no_text:
+        print("Error: nothing to serve (both --no-image and --no-text)")
+        exit()
+    if args.threads:
+        from inference_opt import set_threads
+        print(f"Torch threads: {set_threads(args.threads)}")
+
+    service = EmbeddingService(not args.no_image, not args.no_text, args.text_model, args.quantize, args.optimize,
+                               args.max_batch, args.max_latency_ms)
+    server = serve(service, args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
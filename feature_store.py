@@ -0,0 +1,298 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+# קבצי ה-store (תיקייה אחת לכל סוג וקטורים)
+VECTORS_FILE = "vectors.npy"
+KEYS_FILE = "keys.npy"
+ROWS_FILE = "rows.npy"
+META_FILE = "meta.json"
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def _atomic_save_npy(path, array):
+    """כתיבה לקובץ זמני והחלפה - קורא אחר לא יראה קובץ חצי כתוב"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+def _atomic_save_json(path, data):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+def save_features(path, keys, vectors, meta=None, dtype="float32", rows=None):
+    """
+    Writes a feature store directory: one contiguous vector matrix, a key
+    index (key -> row) and a JSON metadata header.
+    `rows` lets several keys share one vector row; by default key i -> row i.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"dtype must be one of {SUPPORTED_DTYPES}, got {dtype!r}")
+
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    vectors = np.ascontiguousarray(vectors, dtype=dtype)
+    if vectors.ndim != 2:
+        raise ValueError(f"vectors must be a 2D matrix, got shape {vectors.shape}")
+
+    keys = np.asarray([str(k) for k in keys], dtype=str)
+    rows = np.arange(len(keys), dtype=np.int64) if rows is None else np.asarray(rows, dtype=np.int64)
+    if len(rows) != len(keys):
+        raise ValueError(f"got {len(keys)} keys but {len(rows)} rows")
+    if len(rows) and (rows.min() < 0 or rows.max() >= len(vectors)):
+        raise ValueError("rows point outside the vector matrix")
+
+    header = dict(meta or {})
+    header.update({
+        "dim": int(vectors.shape[1]),
+        "dtype": dtype,
+        "num_vectors": int(vectors.shape[0]),
+        "num_keys": int(len(keys)),
+    })
+
+    _atomic_save_npy(path / VECTORS_FILE, vectors)
+    _atomic_save_npy(path / KEYS_FILE, keys)
+    _atomic_save_npy(path / ROWS_FILE, rows)
+    # ה-header נכתב אחרון - הוא מסמן שה-store שלם
+    _atomic_save_json(path / META_FILE, header)
+    return path
+
+
+# כל כמה שורות הכותב הזורם עושה flush לדיסק (דפים מלוכלכים לא מצטברים בזיכרון)
+FLUSH_ROWS = 8192
+
+
+class FeatureWriter:
+    """
+    Streaming save_features: the vector matrix is preallocated on disk as a
+    memory-mapped .npy of `capacity` rows (float32 or float16) and every
+    batch is written in place, so memory use does not grow with the number
+    of vectors. Dirty pages are flushed every flush_rows rows.
+
+    Two ways to fill it: append(keys, vectors) at the next free row, or
+    writer[rows] = vectors at fixed positions (like a preallocated array).
+    close() drops unused rows, writes keys/rows and the meta header last;
+    until then readers still see the previous store.
+    """
+
+    def __init__(self, path, capacity, dtype="float32", meta=None, flush_rows=FLUSH_ROWS):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"dtype must be one of {SUPPORTED_DTYPES}, got {dtype!r}")
+        self.path = Path(path)
+        self.capacity = int(capacity)
+        self.dtype = dtype
+        self.meta = dict(meta or {})
+        self.flush_rows = flush_rows
+        self.vectors = None
+        self.index = {}
+        self.size = 0
+        self._unflushed = 0
+        self._tmp = self.path / (VECTORS_FILE + ".tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.abort()
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def dim(self):
+        return None if self.vectors is None else self.vectors.shape[1]
+
+    def allocate(self, dim):
+        """יוצר את הקובץ בגודל המלא (פעם אחת; קריאות נוספות לא עושות כלום)"""
+        if self.vectors is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.vectors = np.lib.format.open_memmap(self._tmp, mode="w+", dtype=self.dtype,
+                                                     shape=(self.capacity, int(dim)))
+        return self
+
+    def _written(self, n):
+        self._unflushed += n
+        if self._unflushed >= self.flush_rows:
+            self.vectors.flush()
+            self._unflushed = 0
+
+    def __setitem__(self, rows, values):
+        values = np.asarray(values)
+        self.allocate(values.shape[-1])
+        self.vectors[rows] = values
+        # כתיבה לפי מיקום - השורות שלא נכתבו נשארות אפסים
+        self.size = max(self.size, self._last_row(rows) + 1)
+        self._written(len(values) if values.ndim == 2 else 1)
+
+    def _last_row(self, rows):
+        """השורה הגבוהה ביותר שנכתבה (בלי לבנות מערך בגודל ה-capacity)"""
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(self.capacity)
+            span = range(start, stop, step)
+            return max(span[0], span[-1]) if span else -1
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            hit = np.flatnonzero(rows)
+            return int(hit[-1]) if len(hit) else -1
+        if rows.size == 0:
+            return -1
+        # אינדקס שלילי נספר מהסוף, כמו ב-numpy
+        return int(np.where(rows < 0, rows + self.capacity, rows).max())
+
+    def append(self, keys, vectors):
+        vectors = np.asarray(vectors)
+        if len(vectors) == 0:
+            return
+        self.allocate(vectors.shape[1])
+        if self.size + len(vectors) > self.capacity:
+            raise ValueError(f"writer is full ({self.capacity} rows)")
+        self.vectors[self.size:self.size + len(vectors)] = vectors
+        for offset, key in enumerate(keys):
+            self.index[str(key)] = self.size + offset
+        self.size += len(vectors)
+        self._written(len(vectors))
+
+    def get(self, key):
+        return self.vectors[self.index[str(key)]]
+
+    def link(self, key, target):
+        """key מקבל את השורה של target (למשל תמונה כפולה) - בלי לכתוב וקטור נוסף"""
+        self.index[str(key)] = self.index[str(target)]
+
+    def _shrink(self):
+        """פחות שורות מהמתוכנן (למשל תמונות שנכשלו) - העתקה בחלקים לקובץ בגודל הנכון"""
+        tmp = self.path / (VECTORS_FILE + ".tmp2")
+        if self.size == 0:
+            # memmap בגודל 0 לא נתמך
+            with open(tmp, "wb") as f:
+                np.save(f, np.zeros((0, self.dim), dtype=self.dtype))
+        else:
+            small = np.lib.format.open_memmap(tmp, mode="w+", dtype=self.dtype, shape=(self.size, self.dim))
+            for start in range(0, self.size, self.flush_rows):
+                end = min(start + self.flush_rows, self.size)
+                small[start:end] = self.vectors[start:end]
+            small.flush()
+            del small
+        self.vectors = None
+        os.replace(tmp, self._tmp)
+
+    def close(self, keys=None, rows=None, meta=None):
+        """
+        Finishes the store. By default the keys are the appended ones; with
+        keys (and optionally rows, default key i -> row i) any order or
+        key -> shared row mapping can be stored instead.
+        """
+        if self.vectors is None:
+            raise ValueError("nothing was written (call allocate(dim) for an empty store)")
+        if keys is None:
+            keys, rows = list(self.index), list(self.index.values())
+        keys = np.asarray([str(k) for k in keys], dtype=str)
+        rows = np.arange(len(keys), dtype=np.int64) if rows is None else np.asarray(rows, dtype=np.int64)
+        if len(rows) != len(keys):
+            raise ValueError(f"got {len(keys)} keys but {len(rows)} rows")
+        if len(rows) and (rows.min() < 0 or rows.max() >= self.capacity):
+            raise ValueError("rows point outside the vector matrix")
+        # שורה שמפתח מצביע עליה נשארת גם אם לא נכתבה (וקטור אפסים, למשל טקסט ריק)
+        self.size = max(self.size, int(rows.max()) + 1 if len(rows) else 0)
+
+        dim = self.dim
+        self.vectors.flush()
+        if self.size < self.capacity:
+            self._shrink()
+        self.vectors = None
+
+        header = {**self.meta, **(meta or {})}
+        header.update({"dim": int(dim), "dtype": self.dtype, "num_vectors": int(self.size),
+                       "num_keys": int(len(keys))})
+        # כמו ב-save_features: ה-meta הישן נמחק קודם והחדש נכתב אחרון
+        (self.path / META_FILE).unlink(missing_ok=True)
+        _atomic_save_npy(self.path / KEYS_FILE, keys)
+        _atomic_save_npy(self.path / ROWS_FILE, rows)
+        os.replace(self._tmp, self.path / VECTORS_FILE)
+        _atomic_save_json(self.path / META_FILE, header)
+        return self.path
+
+    def abort(self):
+        self.vectors = None
+        self._tmp.unlink(missing_ok=True)
+
+
+class FeatureStore:
+    """
+    Read side of a feature store. Opening only parses the JSON header and
+    memory-maps the matrix; keys are loaded on first lookup.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = Path(path)
+        meta_path = self.path / META_FILE
+        if not meta_path.exists():
+            raise FileNotFoundError(f"No feature store at {self.path} (missing {META_FILE})")
+
+        with open(meta_path, encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(self.path / VECTORS_FILE, mmap_mode="r" if mmap else None)
+        self._keys = None
+        self._rows = None
+        self._index = None
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            self._keys = np.load(self.path / KEYS_FILE)
+        return self._keys
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = np.load(self.path / ROWS_FILE, mmap_mode="r")
+        return self._rows
+
+    @property
+    def index(self):
+        """מילון key -> row (נבנה פעם אחת, רק כשצריך)"""
+        if self._index is None:
+            self._index = dict(zip(self.keys.tolist(), self.rows.tolist()))
+        return self._index
+
+    def __len__(self):
+        return self.meta["num_keys"]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def row(self, key):
+        return self.index[key]
+
+    def get(self, key):
+        """וקטור בודד - view על ה-memmap, בלי העתקה"""
+        return self.vectors[self.index[key]]
+
+    def take(self, keys):
+        """מטריצה של הוקטורים לפי סדר המפתחות שהתקבל"""
+        return self.vectors[[self.index[k] for k in keys]]
+
+    def matrix(self):
+        """מטריצה מיושרת לסדר המפתחות (view בלי העתקה כשכל מפתח בשורה משלו)"""
+        rows = self.rows
+        if len(rows) == len(self.vectors) and np.array_equal(rows, np.arange(len(rows))):
+            return self.vectors
+        return self.vectors[np.asarray(rows)]
+
+    def to_dict(self):
+        """הפורמט הישן: {key: vector}"""
+        return {key: np.array(self.vectors[row]) for key, row in self.index.items()}
@@ -1,33 +1,59 @@
-import pandas as pd
 import os
+import argparse
 from pathlib import Path
 from dotenv import load_dotenv
 
-# 1. טעינת הגדרות
-load_dotenv()
-base_path = Path(os.getenv("DATA_PATH"))
-
-# נתיבי קבצים
-input_csv = base_path / "indiana_merged_data.csv"
-output_csv = base_path / "indiana_frontal.csv"
-
-# 2. טעינת הטבלה המקורית
-print(f"Loading data from: {input_csv}")
-df = pd.read_csv(input_csv)
-original_count = len(df)
-
-# 3. ביצוע הסינון (החלק החשוב)
-# שומרים רק שורות שבהן בעמודת projection כתוב 'Frontal'
-df_frontal = df[df['projection'] == 'Frontal'].copy()
-frontal_count = len(df_frontal)
-
-# 4. הצגת נתונים למשתמש
-print("-" * 30)
-print(f"Original dataset size: {original_count} images")
-print(f"Filtered (Frontal only): {frontal_count} images")
-print(f"Removed (Lateral): {original_count - frontal_count} images")
-print("-" * 30)
-
-# 5. שמירת הקובץ החדש
-df_frontal.to_csv(output_csv, index=False, encoding='utf-8-sig')
-print(f"SUCCESS: New file created at: {output_csv}")
\ No newline at end of file
+from data_io import FRONTAL_CSV, MERGED_CSV, add_table_arguments, configure_tables, read_table, resolve_table, table_num_rows, write_table
+import instrumentation
+from instrumentation import metrics
+
+
+def filter_frontal(df):
+    """שומרים רק שורות שבהן בעמודת projection כתוב 'Frontal'"""
+    with metrics.stage("frontal"):
+        metrics.count("rows", len(df))
+        return df[df['projection'] == 'Frontal'].copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep only the frontal images")
+    add_table_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    configure_tables(args)
+
+    # 1. טעינת הגדרות
+    load_dotenv()
+    base_path = Path(os.getenv("DATA_PATH"))
+
+    # 2. טעינת הטבלה המקורית
+    merged_path = resolve_table(base_path, MERGED_CSV)
+    print(f"Loading data from: {merged_path}")
+    # ב-parquet הספירה מה-metadata והשורות מסוננות כבר בזמן הקריאה; ב-CSV קריאה אחת וסופרים ממנה
+    original_count = table_num_rows(merged_path)
+    if original_count is None:
+        df = read_table(base_path, MERGED_CSV)
+        original_count = len(df)
+    else:
+        df = read_table(base_path, MERGED_CSV, filters=[("projection", "==", "Frontal")])
+
+    # 3. ביצוע הסינון (החלק החשוב)
+    df_frontal = filter_frontal(df)
+    frontal_count = len(df_frontal)
+
+    # 4. הצגת נתונים למשתמש
+    print("-" * 30)
+    print(f"Original dataset size: {original_count} images")
+    print(f"Filtered (Frontal only): {frontal_count} images")
+    print(f"Removed (Lateral): {original_count - frontal_count} images")
+    print("-" * 30)
+
+    # 5. שמירת הקובץ החדש
+    output_csv = write_table(df_frontal, base_path, FRONTAL_CSV)
+    print(f"SUCCESS: New file created at: {output_csv}")
+
+    instrumentation.finish(args)
+
+
+if __name__ == "__main__":
+    main()
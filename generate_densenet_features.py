@@ -1,42 +1,42 @@
 import torch
 import torch.nn as nn
+from torch.utils.data import Dataset, DataLoader
 from torchvision import models, transforms
 from PIL import Image
-import pandas as pd
+import numpy as np
 import os
+import argparse
 from dotenv import load_dotenv
 from pathlib import Path
 from tqdm import tqdm
 import pickle
 
-# 1. הגדרות בסיס
-load_dotenv()
-base_path = Path(os.getenv("DATA_PATH"))
+from embedding_cache import DEFAULT_CACHE_NAME, EmbeddingCache, image_keys
+from data_io import DUPLICATES_CSV, POC_CSV, read_table
+from feature_store import SUPPORTED_DTYPES, FeatureStore, FeatureWriter, save_features
+from image_dedup import collapse_duplicates
+from image_index import INDEX_FILE, load_image_index
+from image_tensor_cache import TensorCacheLoader, update_tensor_cache
+from prefetch_loader import DECODE_WORKERS, IO_THREADS, QUEUE_BATCHES, PrefetchLoader
+from sharded_extraction import remove_shards, run_sharded
+import instrumentation
+from instrumentation import metrics
+from inference_opt import IMAGE_MODES, cosine_parity, optimize_densenet, print_parity, set_threads
 
-# הקלט: הקובץ המאוזן שיצרנו (450 תמונות)
-csv_path = base_path / "indiana_poc_balanced.csv"
-# הפלט: קובץ הווקטורים הסופי
-output_path = base_path / "image_features.pkl"
+# הגדרות ברירת מחדל לחילוץ (אפשר לשנות משורת הפקודה)
+BATCH_SIZE = 32
+NUM_WORKERS = min(4, os.cpu_count() or 1)
 
-# בחירת מעבד (GPU/CPU)
-device = torch.device("cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu")
-print(f"Using device: {device}")
+# dataloader - תהליכי DataLoader; prefetch - threads שקוראים מראש (לאחסון איטי/ברשת)
+LOADERS = ("dataloader", "prefetch")
 
-# 2. טעינת המודל: DenseNet121
-print("Loading DenseNet121 model...")
-weights = models.DenseNet121_Weights.DEFAULT
-model = models.densenet121(weights=weights)
+# כמה וקטורים מה-cache נקראים ונכתבים ל-FeatureWriter בכל פעם
+FILL_ROWS = 4096
 
-# --- החלק החשוב: הסרת הראש ---
-# אנחנו רוצים את ה"הבנה" של המודל (הווקטורים), לא את הסיווג הסופי.
-# לכן אנחנו מחליפים את שכבת הסיווג ב"כלום" (Identity).
-# זה יגרום למודל להוציא וקטור באורך 1024.
-model.classifier = nn.Identity()
+# אינדקס נפרד (בתוך DATA_PATH) לתיקיית הגיבוי images/ - גם היא נסרקת רק כשהשתנתה
+FALLBACK_INDEX_FILE = "image_index_fallback.pkl"
 
-model = model.to(device)
-model.eval()  # מצב קריאה בלבד (לא לומד כרגע)
-
-# 3. הכנת התמונות (Preprocessing) - חובה לפי התקן של DenseNet
+# הכנת התמונות (Preprocessing) - חובה לפי התקן של DenseNet
 preprocess = transforms.Compose([
     transforms.Resize(256),  # הקטנה
     transforms.CenterCrop(224),  # חיתוך לריבוע
@@ -47,18 +47,44 @@ preprocess = transforms.Compose([
     ),
 ])
 
-# 4. ביצוע החילוץ
-df = pd.read_csv(csv_path)
-print(f"Processing {len(df)} images...")
+# ההגדרות שמשפיעות על הווקטור - חלק מהמפתח ב-cache
+PREPROCESS_CONFIG = {
+    "model": "densenet121",
+    "weights": str(models.DenseNet121_Weights.DEFAULT),
+    "resize": 256,
+    "crop": 224,
+    "mean": [0.485, 0.456, 0.406],
+    "std": [0.229, 0.224, 0.225],
+}
+
+
+def get_device():
+    """בחירת מעבד (GPU/CPU)"""
+    return torch.device("cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu")
+
+
+def load_model(device):
+    """טעינת DenseNet121 בלי שכבת הסיווג (מוציא וקטור באורך 1024)"""
+    weights = models.DenseNet121_Weights.DEFAULT
+    model = models.densenet121(weights=weights)
+
+    # --- החלק החשוב: הסרת הראש ---
+    # אנחנו רוצים את ה"הבנה" של המודל (הווקטורים), לא את הסיווג הסופי.
+    # לכן אנחנו מחליפים את שכבת הסיווג ב"כלום" (Identity).
+    model.classifier = nn.Identity()
 
-features_dict = {}
-missing_count = 0
+    model = model.to(device)
+    model.eval()  # מצב קריאה בלבד (לא לומד כרגע)
+    return model
 
-# לולאה על כל התמונות עם פס התקדמות
-for index, row in tqdm(df.iterrows(), total=len(df)):
-    image_name = row['filename']
 
-    # בדיקת נתיבים (תתאים את זה למבנה התיקיות שלך אם צריך)
+def cache_config(optimize="none"):
+    """וקטורים ממודל מואץ שונים מעט מ-fp32 - לכן הם נשמרים ב-cache תחת מפתח נפרד"""
+    return PREPROCESS_CONFIG if optimize == "none" else {**PREPROCESS_CONFIG, "inference": optimize}
+
+
+def resolve_image_path(base_path, image_name):
+    """מחזיר את הנתיב לתמונה, או None אם היא לא נמצאה"""
     # נסיון 1: בתוך תיקיית הנרמול
     img_path = base_path / "images" / "images_normalized" / image_name
 
@@ -66,41 +92,393 @@ for index, row in tqdm(df.iterrows(), total=len(df)):
     if not os.path.exists(img_path):
         img_path = base_path / "images" / image_name
 
-    # אם עדיין לא מצאנו - מדלגים
     if not os.path.exists(img_path):
-        missing_count += 1
-        continue
+        return None
+    return img_path
+
+
+def resolve_image_paths(base_path, image_names, known_paths=None):
+    """
+    resolve_image_path for a whole list, from the image indexes instead of
+    two os.path.exists probes per image: one listing per folder, and the
+    images_normalized index is the one read_the_db keeps in DATA_PATH, the
+    images/ fallback has its own saved index (FALLBACK_INDEX_FILE).
+    known_paths (e.g. img_path of the merged table) are used only if the
+    index of this DATA_PATH has them - a table built on another machine
+    (other DATA_PATH) is resolved again by file name.
+    Returns a path (or None) per name, same folder priority as before.
+    """
+    base_path = Path(base_path)
+    resolved = [None] * len(image_names)
+    known_paths = [None] * len(image_names) if known_paths is None else list(known_paths)
+    folders = ((base_path / "images" / "images_normalized", base_path / INDEX_FILE),
+               (base_path / "images", base_path / FALLBACK_INDEX_FILE))
+    for folder, index_path in folders:
+        left = [i for i, path in enumerate(resolved) if path is None]
+        if not left:
+            break
+        entries = load_image_index(folder, index_path)
+        paths = entries.set_index("filename")["img_path"]
+        indexed = set(map(os.path.normpath, entries["img_path"].astype(str)))
+        for i in left:
+            known = known_paths[i]
+            if isinstance(known, str) and os.path.normpath(known) in indexed:
+                resolved[i] = Path(known)
+                continue
+            path = paths.get(str(image_names[i]))
+            if path is not None:
+                resolved[i] = Path(path)
+    return resolved
+
+
+class ChestXrayDataset(Dataset):
+    """
+    Dataset of (filename, preprocessed tensor) pairs.
+    Decoding and preprocessing run inside the DataLoader workers.
+    """
+
+    def __init__(self, names, paths, transform=preprocess):
+        self.names = list(names)
+        self.paths = [str(p) for p in paths]
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, idx):
+        try:
+            img = Image.open(self.paths[idx]).convert('RGB')
+            return self.names[idx], self.transform(img)
+        except Exception as e:
+            # תמונה פגומה לא מפילה את כל הריצה - מדלגים עליה ב-collate
+            print(f"Error processing {self.names[idx]}: {e}")
+            return self.names[idx], None
+
+
+def collate_skip_errors(batch):
+    """מאחד batch ומדלג על תמונות שנכשלו בטעינה"""
+    batch = [(name, tensor) for name, tensor in batch if tensor is not None]
+    if not batch:
+        return [], None
+    names, tensors = zip(*batch)
+    return list(names), torch.stack(tensors)
+
+
+def build_dataloader(names, paths, device, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, prefetch_factor=2):
+    """DataLoader עם workers מקביליים ל-decode/resize ו-pinned memory כשיש GPU"""
+    dataset = ChestXrayDataset(names, paths)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",
+        prefetch_factor=prefetch_factor if num_workers > 0 else None,
+        persistent_workers=False,
+        collate_fn=collate_skip_errors,
+    )
+
+
+def extract_features(model, loader, device, out=None):
+    """מריץ את המודל על כל ה-batch-ים ומחזיר {filename: vector} (או כותב כל batch ל-out, FeatureWriter)"""
+    features_dict = {}
+    with torch.inference_mode():
+        # זמן ההמתנה ל-batch (קריאה + decode + preprocessing) נמדד בנפרד מזמן המודל
+        for names, batch in tqdm(metrics.timed_iter(loader, "embed-image.load"), total=len(loader)):
+            if batch is None:
+                continue
+            with metrics.stage("embed-image.forward"):
+                batch = batch.to(device, non_blocking=True)
+                vectors = model(batch).flatten(1).cpu().numpy()
+                metrics.count("images", len(names))
+            if out is not None:
+                out.append(names, vectors)
+                continue
+            for name, vector in zip(names, vectors):
+                features_dict[name] = vector
+    return features_dict if out is None else out
+
+
+def build_prefetch_loader(names, paths, device, batch_size=BATCH_SIZE, io_threads=IO_THREADS,
+                          decode_workers=DECODE_WORKERS, queue_batches=QUEUE_BATCHES):
+    """כמו build_dataloader, אבל הקבצים נקראים מראש ע"י threads (ראו prefetch_loader)"""
+    return PrefetchLoader(names, paths, preprocess, batch_size, io_threads, decode_workers, queue_batches,
+                          collate_fn=collate_skip_errors, pin_memory=device.type == "cuda")
+
+
+def extract_image_features(df, base_path, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, prefetch_factor=2,
+                           cache_path=None, evict_stale=False, tensor_cache_path=None,
+                           optimize="none", threads=None, parity_samples=0, model=None,
+                           loader="dataloader", io_threads=IO_THREADS, out=None, duplicates=None):
+    """
+    Embeds every image listed in df['filename'] and returns
+    ({filename: vector} in CSV order, number of missing images).
+    With a cache_path only new or changed images go through the model.
+    With a tensor_cache_path the cropped images are kept in a memory-mapped
+    uint8 array, so later runs skip PNG decoding and resizing.
+    optimize selects a faster inference mode (see inference_opt); with
+    parity_samples the first images are also run in fp32 and compared.
+    A ready model (e.g. a small stand-in for benchmarks) skips load_model;
+    its vectors should not share a cache with DenseNet121.
+    loader="prefetch" reads the files ahead with io_threads threads and
+    decodes with num_workers threads, then reports I/O wait vs compute.
+    With out (a FeatureWriter) cached and new vectors are written to disk
+    as they come and (out, missing) is returned instead of the dict.
+    With duplicates (the image_dedup table) one image per near-duplicate
+    group is embedded and the others reuse its vector.
+    """
+    base_path = Path(base_path)
+    device = get_device()
+    print(f"Using device: {device}")
+    if threads:
+        print(f"Torch threads: {set_threads(threads)}")
+
+    # 1. איתור התמונות (לפני הטעינה, כדי שה-workers יקבלו רק נתיבים קיימים)
+    names, paths = [], []
+    missing_count = 0
+    known_paths = df['img_path'] if 'img_path' in df.columns else [None] * len(df)
+    with metrics.stage("embed-image.locate"):
+        # הנתיב מהטבלה (read_the_db) נבדק מול האינדקס של ה-DATA_PATH הנוכחי - טבלה ממחשב
+        # אחר נמצאת מחדש לפי שם הקובץ (בלי בדיקה בדיסק לכל תמונה)
+        known_paths = resolve_image_paths(base_path, list(df['filename']), known_paths)
+        for image_name, img_path in zip(df['filename'], known_paths):
+            # אם לא מצאנו - מדלגים
+            if img_path is None:
+                missing_count += 1
+                continue
+            names.append(image_name)
+            paths.append(img_path)
+        metrics.count("images", len(names))
+
+    # כמעט-כפילויות: רק תמונה אחת מכל קבוצה עוברת במודל
+    all_names, aliases = names, {}
+    if duplicates is not None:
+        names, paths, aliases = collapse_duplicates(names, paths, duplicates)
+        metrics.count("duplicates", len(aliases), stage="embed-image.locate")
+        print(f"Near-duplicates: {len(aliases)} of {len(all_names)} images reuse the vector of their group")
+
+    # 2. בדיקה ב-cache: רק תמונות חדשות או שהשתנו עוברות במודל
+    cache = None if cache_path is None else EmbeddingCache(cache_path, "image")
+    cached = {}
+    if cache is not None:
+        with metrics.stage("embed-image.cache_lookup"):
+            keys = image_keys(paths, cache_config(optimize), workers=max(1, num_workers))
+            key_by_name = dict(zip(names, keys))
+            if out is None:
+                hits = cache.get_many(keys)
+                cached = {name: hits[key] for name, key in key_by_name.items() if key in hits}
+            else:
+                # רק המפתחות; הווקטורים נקראים מה-cache ונכתבים לקובץ FILL_ROWS בכל פעם
+                present = cache.existing(keys)
+                cached = dict.fromkeys(name for name, key in key_by_name.items() if key in present)
+                hit_names = list(cached)
+                for start in range(0, len(hit_names), FILL_ROWS):
+                    chunk = hit_names[start:start + FILL_ROWS]
+                    found = cache.get_many(key_by_name[name] for name in chunk)
+                    out.append(chunk, np.stack([found[key_by_name[name]] for name in chunk]))
+            metrics.count("hits", len(cached))
+        print(f"Cache hits: {len(cached)} / {len(names)}")
+
+    todo = [(name, path) for name, path in zip(names, paths) if name not in cached]
+
+    # 3. ביצוע החילוץ ב-batch-ים (המודל נטען רק אם יש מה לחשב)
+    new_features = {}
+    if todo:
+        if model is None:
+            print("Loading DenseNet121 model...")
+            with metrics.stage("embed-image.model_load"):
+                model = load_model(device)
+        todo_names, todo_paths = zip(*todo)
+        if tensor_cache_path is not None:
+            # תמונות מפוענחות וחתוכות מראש - רק נרמול לכל batch
+            with metrics.stage("embed-image.tensor_cache"):
+                tensor_cache, failed = update_tensor_cache(tensor_cache_path, todo_names, todo_paths,
+                                                           workers=num_workers)
+            loader = TensorCacheLoader(tensor_cache, [n for n in todo_names if n not in failed],
+                                       PREPROCESS_CONFIG["mean"], PREPROCESS_CONFIG["std"], batch_size)
+        elif loader == "prefetch":
+            loader = build_prefetch_loader(todo_names, todo_paths, device, batch_size, io_threads,
+                                           max(1, num_workers))
+        else:
+            loader = build_dataloader(todo_names, todo_paths, device, batch_size, num_workers, prefetch_factor)
+        fast_model = model
+        if optimize != "none":
+            print(f"Optimizing model ({optimize})...")
+            with metrics.stage("embed-image.optimize"):
+                fast_model = optimize_densenet(model, optimize)
+            if parity_samples:
+                sample = list(todo_names[:parity_samples])
+                sample_loader = build_dataloader(sample, todo_paths[:parity_samples], device, batch_size, 0)
+                reference = extract_features(model, sample_loader, device)
+                candidate = extract_features(fast_model, sample_loader, device)
+                common = [name for name in sample if name in reference]
+                print_parity(cosine_parity([reference[n] for n in common], [candidate[n] for n in common]),
+                             optimize)
+        new_features = extract_features(fast_model, loader, device, out)
+        if isinstance(loader, PrefetchLoader):
+            loader.print_summary()
+
+    if cache is not None:
+        if out is not None:
+            # הווקטורים החדשים נקראים חזרה מהקובץ (ה-writer) אחד-אחד, לא ממילון בזיכרון
+            new_items = ((key_by_name[name], out.get(name)) for name, _ in todo if name in out.index)
+        else:
+            new_items = ((key_by_name[name], vector) for name, vector in new_features.items())
+        cache.put_many(new_items)
+        if evict_stale:
+            print(f"Evicted {cache.evict_stale()} stale cache entries")
+        cache.close()
+
+    if out is not None:
+        for name, rep in aliases.items():
+            if str(rep) in out.index:
+                out.link(name, rep)
+        return out, missing_count
+
+    # שומרים על סדר השורות של ה-CSV
+    features_dict = {}
+    for name in all_names:
+        rep = aliases.get(name, name)
+        if rep in cached:
+            features_dict[name] = cached[rep]
+        elif rep in new_features:
+            features_dict[name] = new_features[rep]
+
+    return features_dict, missing_count
+
+
+def image_store_meta(source=None, optimize="none"):
+    return {"model": PREPROCESS_CONFIG["model"], "preprocessing": PREPROCESS_CONFIG, "inference": optimize,
+            "source": source}
+
+
+def save_legacy_pickle(features_dict, output_path):
+    legacy_path = Path(output_path).with_suffix(".pkl")
+    with open(legacy_path, 'wb') as f:
+        pickle.dump(features_dict, f)
+    print(f"Saved legacy pickle to: {legacy_path}")
+
+
+def save_image_features(features_dict, output_path, dtype="float32", source=None, legacy_output=False,
+                        optimize="none"):
+    """שמירה ל-feature store (מטריצה רציפה + אינדקס + metadata)"""
+    output_path = Path(output_path)
+    keys = list(features_dict)
+    vectors = np.stack([features_dict[k] for k in keys]) if keys else np.zeros((0, 1024), dtype=np.float32)
+    save_features(output_path, keys, vectors, dtype=dtype, meta=image_store_meta(source, optimize))
+    print(f"Saved features to: {output_path}")
+
+    if legacy_output:
+        save_legacy_pickle(features_dict, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract DenseNet121 image features")
+    parser.add_argument("--input", default=POC_CSV, help="table inside DATA_PATH (CSV or its parquet version)")
+    parser.add_argument("--output", default="image_features", help="feature store directory inside DATA_PATH")
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32")
+    parser.add_argument("--legacy-output", action="store_true", help="also write the old <output>.pkl dict")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="decode/preprocess worker processes")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches prefetched per worker")
+    parser.add_argument("--loader", choices=LOADERS, default="dataloader",
+                        help="prefetch: read files ahead with threads (slow or network storage)")
+    parser.add_argument("--io-threads", type=int, default=IO_THREADS, help="file reading threads for --loader prefetch")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_NAME, help="embedding cache file inside DATA_PATH")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every vector")
+    parser.add_argument("--evict-stale", action="store_true", help="drop cache entries not used in this run")
+    parser.add_argument("--tensor-cache", nargs="?", const="image_tensors", default=None,
+                        help="keep decoded 224x224 images in this memmap directory inside DATA_PATH")
+    parser.add_argument("--optimize", choices=IMAGE_MODES, default="none",
+                        help="CPU inference mode (channels_last / TorchScript / torch.compile)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--parity-check", type=int, default=0, metavar="N",
+                        help="compare the optimized model with fp32 on the first N images")
+    parser.add_argument("--shards", type=int, default=0, help="split the input into N shards, one process each")
+    parser.add_argument("--processes", type=int, default=None, help="parallel shard processes (default: cores)")
+    parser.add_argument("--resume", action="store_true", help="skip shards finished by an earlier run")
+    parser.add_argument("--keep-shards", action="store_true", help="keep the per-shard stores after merging")
+    parser.add_argument("--dedup", nargs="?", const=DUPLICATES_CSV, default=None, metavar="TABLE",
+                        help="embed one image per near-duplicate group (image_dedup table) and reuse its vector")
+    instrumentation.add_arguments(parser, profile=True)
+    args = parser.parse_args()
+    if args.shards:
+        # כמה shards שכותבים במקביל לאותו tensor cache ישברו אותו
+        if args.tensor_cache is not None:
+            parser.error("--tensor-cache is not supported with --shards")
+        if args.dedup:
+            parser.error("--dedup is not supported with --shards")
+        if args.evict_stale and args.resume:
+            parser.error("--evict-stale cannot be combined with --shards --resume (skipped shards would be evicted)")
+
+    # 1. הגדרות בסיס
+    load_dotenv()
+    base_path = Path(os.getenv("DATA_PATH"))
 
-    try:
-        # טעינת תמונה
-        img = Image.open(img_path).convert('RGB')
+    # 2. טעינת הקלט: הקובץ המאוזן שיצרנו (450 תמונות)
+    df = read_table(base_path, args.input)
+    print(f"Processing {len(df)} images...")
 
-        # עיבוד (הקטנה ונרמול)
-        img_tensor = preprocess(img).unsqueeze(0).to(device)
+    duplicates = None
+    if args.dedup:
+        try:
+            duplicates = read_table(base_path, args.dedup)
+        except FileNotFoundError:
+            print(f"Error: {args.dedup} not found - run image_dedup.py first")
+            exit()
 
-        # הרצה במודל וקבלת הווקטור
-        with torch.no_grad():
-            feature_vector = model(img_tensor)
+    # 3. ביצוע החילוץ
+    cache_path = None if args.no_cache else base_path / args.cache
+    with instrumentation.profile_context(args):
+        if args.shards:
+            # כל shard בתהליך נפרד ונשמר בנפרד - ריצה שנקטעה ממשיכה עם --resume
+            processes = args.processes or min(args.shards, os.cpu_count() or 1)
+            # ה-shards מתמזגים ישר ל-store של הפלט (shard אחרי shard)
+            _, missing_count = run_sharded(
+                df, base_path, base_path / args.output, args.shards, processes, args.threads, args.resume,
+                args.batch_size, args.workers // processes, cache_path, args.optimize, args.loader, args.dtype,
+                args.evict_stale, image_store_meta(args.input, args.optimize),
+            )
+        else:
+            # כל batch נכתב ישר ל-memmap בדיסק - הזיכרון לא גדל עם מספר התמונות
+            writer = FeatureWriter(base_path / args.output, len(df), args.dtype, meta=image_store_meta(
+                args.input, args.optimize))
+            with writer:
+                _, missing_count = extract_image_features(
+                    df, base_path, args.batch_size, args.workers, args.prefetch,
+                    cache_path=cache_path,
+                    evict_stale=args.evict_stale,
+                    tensor_cache_path=None if args.tensor_cache is None else base_path / args.tensor_cache,
+                    optimize=args.optimize, threads=args.threads, parity_samples=args.parity_check,
+                    loader=args.loader, io_threads=args.io_threads, out=writer, duplicates=duplicates,
+                )
+                # שומרים על סדר השורות של ה-CSV (ואם לא חושבה אף תמונה - store ריק ב-1024)
+                keys = [name for name in dict.fromkeys(df['filename'].astype(str)) if name in writer.index]
+                writer.allocate(1024)
+                writer.close(keys, np.array([writer.index[name] for name in keys], dtype=np.int64))
 
-        # המרה למערך שטוח (במקום טנסור) כדי שאפשר יהיה לשמור
-        features_dict[image_name] = feature_vector.flatten().cpu().numpy()
+    # 4. שמירת התוצאה
+    # 4. הפלט כבר נשמר (בשני המצבים) - בדיקה מול ה-store
+    store = FeatureStore(base_path / args.output)
+    print(f"\nExtraction Done.")
+    print(f"Successfully processed: {len(store)} images")
+    if len(store) > 0:
+        # בדיקה שאכן קיבלנו וקטור בגודל 1024
+        print(f"Vector size: {store.dim} (Expected: 1024)")
 
-    except Exception as e:
-        print(f"Error processing {image_name}: {e}")
+    if missing_count > 0:
+        print(f"Warning: {missing_count} images were missing from the folder.")
 
-# 5. שמירת התוצאה
-print(f"\nExtraction Done.")
-print(f"Successfully processed: {len(features_dict)} images")
-if len(features_dict) > 0:
-    # בדיקה שאכן קיבלנו וקטור בגודל 1024
-    vector_size = len(next(iter(features_dict.values())))
-    print(f"Vector size: {vector_size} (Expected: 1024)")
+    # הפלט: קובץ הווקטורים הסופי
+    print(f"Saved features to: {base_path / args.output}")
+    if args.legacy_output:
+        save_legacy_pickle(store.to_dict(), base_path / args.output)
+    if args.shards and not args.keep_shards:
+        remove_shards(base_path / args.output)
 
-if missing_count > 0:
-    print(f"Warning: {missing_count} images were missing from the folder.")
+    instrumentation.finish(args)
 
-# שמירה לקובץ
-with open(output_path, 'wb') as f:
-    pickle.dump(features_dict, f)
 
-print(f"Saved features to: {output_path}")
\ No newline at end of file
+# ההגנה הזו חובה כשה-DataLoader מריץ workers (במיוחד ב-Windows)
+if __name__ == "__main__":
+    main()
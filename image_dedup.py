@@ -0,0 +1,298 @@
+import argparse
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from data_io import DUPLICATES_CSV, add_table_arguments, configure_tables, get_base_path, write_table
+from image_index import INDEX_FILE, NUM_WORKERS, load_image_index
+from read_the_db import get_images_folder
+import instrumentation
+from instrumentation import metrics
+
+# ה-hash-ים נשמרים בתוך DATA_PATH ומחושבים מחדש רק לקבצים שהשתנו
+HASH_FILE = "image_hashes.pkl"
+HASH_VERSION = 1
+
+# 8x8 = 64 ביט לכל hash
+HASH_SIZE = 8
+PHASH_SIZE = 32
+
+# כמה ביטים שונים (בשני ה-hash-ים) עדיין נחשבים כמעט-כפילות
+MAX_DISTANCE = 8
+
+# תמונות כמעט זהות (למשל הרבה צילומי חזה דומים) נופלות לאותו דלי: ההשוואה בתוך דלי
+# נעשית בחלקים - מטריצת מרחקים של עד SCAN_CELLS תאים בכל פעם, ולא כל הזוגות בבת אחת
+SCAN_CELLS = 1 << 22
+
+
+def _dct_matrix(n):
+    k, x = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def _pack(bits):
+    """64 ביטים בוליאניים -> מספר uint64 אחד"""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def dhash(gray):
+    """difference hash: האם כל פיקסל בהיר מהשכן שמשמאלו (תמונה מוקטנת ל-9x8)"""
+    small = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR, reducing_gap=2.0), dtype=np.int16)
+    return _pack(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray):
+    """perceptual hash: התדרים הנמוכים (8x8) של DCT על 32x32, מעל/מתחת לחציון"""
+    pixels = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR, reducing_gap=2.0),
+                        dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    # רכיב ה-DC (הבהירות הממוצעת) לא נכנס לחציון
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+def hash_image(path):
+    """(dhash, phash) של קובץ, או None אם לא נפתח"""
+    try:
+        with Image.open(path) as img:
+            gray = img.convert("L")
+    except OSError:
+        return None
+    return dhash(gray), phash(gray)
+
+
+def hamming(a, b):
+    """מספר הביטים השונים בין שני מערכי uint64"""
+    x = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.int64)
+    return np.unpackbits(x.reshape(-1, 1).view(np.uint8), axis=1).sum(axis=1).reshape(x.shape)
+
+
+def compute_hashes(paths, cache_path=None, workers=NUM_WORKERS, rebuild=False):
+    """
+    dhash and phash (uint64 arrays) of every path, plus a mask of the files
+    that could be read. Decoding runs in a thread pool (PIL releases the GIL
+    while decoding and resizing); hashes of files whose size and mtime did
+    not change are taken from the copy saved at cache_path.
+    """
+    paths = [str(p) for p in paths]
+    saved = {}
+    if cache_path is not None and not rebuild and Path(cache_path).exists():
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("version") == HASH_VERSION:
+            saved = cached["hashes"]
+
+    def stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        stamps = list(pool.map(stat, paths))
+        todo = [i for i, (path, stamp) in enumerate(zip(paths, stamps))
+                if stamp is not None and saved.get(path, (None,))[0] != stamp]
+        fresh = list(pool.map(hash_image, [paths[i] for i in todo]))
+    metrics.count("hashed", len(todo))
+    metrics.count("reused", len(paths) - len(todo))
+
+    hashes = {path: saved[path] for path, stamp in zip(paths, stamps) if path in saved and saved[path][0] == stamp}
+    for i, result in zip(todo, fresh):
+        if result is not None:
+            hashes[paths[i]] = (stamps[i], *result)
+
+    if cache_path is not None:
+        tmp_path = Path(cache_path).with_name(Path(cache_path).name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": HASH_VERSION, "hashes": hashes}, f)
+        os.replace(tmp_path, cache_path)
+
+    ok = np.array([path in hashes for path in paths], dtype=bool)
+    d = np.array([hashes[p][1] if p in hashes else 0 for p in paths], dtype=np.uint64)
+    p = np.array([hashes[p][2] if p in hashes else 0 for p in paths], dtype=np.uint64)
+    return d, p, ok
+
+
+def near_duplicate_pairs(hashes, max_distance=MAX_DISTANCE, confirm=None):
+    """
+    Multi-index Hamming search. The 64 bits are cut into max_distance + 1
+    blocks; two hashes at most max_distance bits apart agree exactly on at
+    least one block (pigeonhole), so only hashes that share a block value
+    are compared instead of all pairs. With confirm (a second hash per row)
+    a pair must be close in both. Returns two index arrays (a < b).
+
+    A bucket is scanned a slab of rows at a time (at most SCAN_CELLS
+    distances at once), so a huge bucket of near-identical images costs
+    bounded memory and stays vectorized instead of listing every pair.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    confirm = None if confirm is None else np.asarray(confirm, dtype=np.uint64)
+    bounds = np.linspace(0, 64, max_distance + 2).astype(int)
+    masks = [np.uint64(((1 << int(hi - lo)) - 1) << int(lo)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    found_a, found_b = [], []
+    for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+        block = (hashes >> np.uint64(lo)) & np.uint64((1 << int(hi - lo)) - 1)
+        order = np.argsort(block, kind="stable")
+        starts = np.flatnonzero(np.r_[True, block[order][1:] != block[order][:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+            if end - start < 2:
+                continue
+            a, b = _bucket_pairs(np.sort(order[start:end]), hashes, max_distance, confirm)
+            # זוג שכבר תאם בבלוק קודם נמצא שם - כל זוג מוחזר פעם אחת
+            diff = hashes[a] ^ hashes[b]
+            first = np.ones(len(a), dtype=bool)
+            for mask in masks[:k]:
+                first &= (diff & mask) != 0
+            found_a.append(a[first])
+            found_b.append(b[first])
+    if not found_a:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(found_a), np.concatenate(found_b)
+
+
+def _bucket_pairs(members, hashes, max_distance, confirm=None):
+    """הזוגות הקרובים בתוך דלי אחד - כל שורה מול השורות שאחריה, בחלקים של עד SCAN_CELLS תאים"""
+    found_a, found_b = [], []
+    step = max(1, SCAN_CELLS // len(members))
+    for start in range(0, len(members) - 1, step):
+        rows, cols = members[start:start + step], members[start + 1:]
+        close = hamming(hashes[rows][:, None], hashes[cols][None, :]) <= max_distance
+        if confirm is not None:
+            close &= hamming(confirm[rows][:, None], confirm[cols][None, :]) <= max_distance
+        # שורה r בחלק מול עמודה c: רק c אחרי r (בלי הזוג עם עצמה ובלי כפל)
+        close &= np.arange(len(rows))[:, None] <= np.arange(len(cols))[None, :]
+        i, j = np.nonzero(close)
+        found_a.append(rows[i])
+        found_b.append(cols[j])
+    return np.concatenate(found_a), np.concatenate(found_b)
+
+
+def union_groups(n, pairs_a, pairs_b):
+    """
+    Connected components of the pairs: for every row, the smallest index in
+    its group (the representative). Vectorized union-find - every pair
+    pulls both ends to the smaller parent, then the parents are followed to
+    their roots (pointer jumping), until nothing changes.
+    """
+    parent = np.arange(n, dtype=np.int64)
+    a, b = np.asarray(pairs_a, dtype=np.int64), np.asarray(pairs_b, dtype=np.int64)
+    while True:
+        low = np.minimum(parent[a], parent[b])
+        updated = parent.copy()
+        np.minimum.at(updated, a, low)
+        np.minimum.at(updated, b, low)
+        np.minimum.at(updated, parent, updated)
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, parent):
+            return parent
+        parent = updated
+
+
+def find_duplicates(entries, cache_path=None, workers=NUM_WORKERS, max_distance=MAX_DISTANCE, rebuild=False):
+    """
+    Near-duplicate groups of an image index table (image_index rows). Adds
+    dhash/phash (hex), group (file name of the group's representative, the
+    first member in index order) and group_size. Unreadable images stay
+    alone in their own group.
+    """
+    entries = entries.reset_index(drop=True)
+    with metrics.stage("dedup.hash"):
+        d, p, ok = compute_hashes(entries["img_path"], cache_path, workers, rebuild)
+        metrics.count("images", len(entries))
+
+    with metrics.stage("dedup.search"):
+        # כפילויות מדויקות מצטמצמות קודם - דליים גדולים לא מתפוצצים לזוגות
+        rows = np.flatnonzero(ok)
+        unique, inverse = np.unique(np.stack([p[rows], d[rows]], axis=1), axis=0, return_inverse=True)
+        a, b = near_duplicate_pairs(unique[:, 0], max_distance, confirm=unique[:, 1])
+        metrics.count("pairs", len(a))
+        root = union_groups(len(unique), a, b)
+        rep = np.arange(len(entries))
+        # הנציג: השורה הראשונה (לפי האינדקס) בקבוצה
+        member_root = root[inverse.ravel()]
+        first_row = pd.Series(rows).groupby(member_root).transform("min").to_numpy()
+        rep[rows] = first_row
+
+    out = entries[["filename", "short_name", "img_path"]].copy()
+    out["dhash"] = [f"{h:016x}" if good else "" for h, good in zip(d.tolist(), ok)]
+    out["phash"] = [f"{h:016x}" if good else "" for h, good in zip(p.tolist(), ok)]
+    out["group"] = out["filename"].to_numpy()[rep]
+    out["group_size"] = out.groupby("group")["filename"].transform("size").astype("int64")
+    return out
+
+
+def collapse_duplicates(names, paths, duplicates):
+    """
+    Keeps one image per near-duplicate group for embedding. Returns the kept
+    names and paths and {dropped name: kept name}; the first image of a
+    group in `names` is kept, even if the group's representative is not in
+    this list.
+    """
+    duplicates = duplicates[duplicates["group_size"] > 1]
+    rep_path = duplicates["group"].map(duplicates.set_index("filename")["img_path"])
+    group_of = dict(zip(map(os.path.normpath, duplicates["img_path"].astype(str)),
+                        map(os.path.normpath, rep_path.astype(str))))
+    kept_names, kept_paths, aliases, seen = [], [], {}, {}
+    for name, path in zip(names, paths):
+        path_key = os.path.normpath(str(path))
+        group = group_of.get(path_key, path_key)
+        if group in seen:
+            aliases[name] = seen[group]
+            continue
+        seen[group] = name
+        kept_names.append(name)
+        kept_paths.append(path)
+    return kept_names, kept_paths, aliases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group near-duplicate images by perceptual hash (dHash + pHash)")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="threads for decoding and hashing")
+    parser.add_argument("--max-distance", type=int, default=MAX_DISTANCE,
+                        help="max differing bits (of 64) in both hashes")
+    parser.add_argument("--rebuild-hashes", action="store_true", help="ignore the saved hashes")
+    parser.add_argument("--output", default=DUPLICATES_CSV, help="duplicates table inside DATA_PATH")
+    add_table_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    configure_tables(args)
+
+    # 1. אינדקס התמונות (אותו אינדקס ש-read_the_db שומר)
+    base_path = get_base_path()
+    entries = load_image_index(get_images_folder(base_path), base_path / INDEX_FILE, workers=args.workers)
+    if entries.empty:
+        print(f"Error: no images found in {get_images_folder(base_path)}")
+        exit()
+    print(f"Hashing {len(entries)} images...")
+
+    # 2. hash-ים + חיפוש קבוצות
+    duplicates = find_duplicates(entries, base_path / HASH_FILE, args.workers, args.max_distance,
+                                 args.rebuild_hashes)
+
+    # 3. שמירה וסיכום
+    path = write_table(duplicates, base_path, args.output)
+    groups = duplicates[duplicates["group_size"] > 1]
+    print(f"Saved duplicates table to: {path}")
+    print(f"Unreadable images: {(duplicates['phash'] == '').sum()}")
+    print(f"Near-duplicate groups: {groups['group'].nunique()} "
+          f"({len(groups)} images, {len(groups) - groups['group'].nunique()} redundant)")
+
+    instrumentation.finish(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from PIL import Image
+
+# קובץ האינדקס נשמר בתוך DATA_PATH
+INDEX_FILE = "image_index.pkl"
+INDEX_VERSION = 1
+
+# תיקיות ברשת (OneDrive/NFS) - הרבה threads מסתירים את זמן ההמתנה
+NUM_WORKERS = 16
+
+COLUMNS = ["filename", "short_name", "img_path", "file_size", "width", "height"]
+
+
+def _short_name(full_name):
+    """גרסה מקוצרת (למשל 1_IM-0001) - לפני המקף השני"""
+    parts = full_name.split("-")
+    if len(parts) >= 2:
+        return f"{parts[0]}-{parts[1]}"
+    return None
+
+
+def _describe(entry):
+    """גודל קובץ ומידות תמונה (PIL קורא רק את ה-header, לא את כל התמונה)"""
+    try:
+        size = entry.stat().st_size
+        with Image.open(entry.path) as img:
+            width, height = img.size
+    except OSError:
+        size, width, height = None, None, None
+    return entry.name, _short_name(entry.name), entry.path, size, width, height
+
+
+def scan_images(images_folder, workers=NUM_WORKERS):
+    """סריקה עם os.scandir + שליפת המידע על כל קובץ במקביל"""
+    with os.scandir(images_folder) as it:
+        entries = [e for e in it if e.name.endswith(".png") and e.is_file()]
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_describe, entries))
+    else:
+        rows = [_describe(e) for e in entries]
+
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    return df.astype({"file_size": "Int64", "width": "Int64", "height": "Int64"})
+
+
+def load_image_index(images_folder, cache_path=None, workers=NUM_WORKERS, verify_count=False, rebuild=False):
+    """
+    Returns the image table of a folder (one row per PNG: name, short name,
+    path, file size, width, height), reusing the on-disk copy when it is
+    still valid. The copy is invalidated when the folder mtime changes
+    (adding/removing/renaming files updates it); with verify_count the
+    number of PNG files is compared as well, at the cost of one listing.
+    """
+    images_folder = Path(images_folder)
+    if not images_folder.is_dir():
+        return pd.DataFrame(columns=COLUMNS)
+    folder_mtime = os.stat(images_folder).st_mtime_ns
+
+    if cache_path is not None and not rebuild and Path(cache_path).exists():
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        valid = (
+            cached.get("version") == INDEX_VERSION
+            and cached.get("folder") == str(images_folder)
+            and cached.get("mtime") == folder_mtime
+        )
+        if valid and verify_count:
+            with os.scandir(images_folder) as it:
+                count = sum(1 for e in it if e.name.endswith(".png"))
+            valid = count == cached.get("count")
+        if valid:
+            return cached["entries"]
+
+    entries = scan_images(images_folder, workers)
+
+    if cache_path is not None:
+        tmp_path = Path(cache_path).with_name(Path(cache_path).name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "version": INDEX_VERSION,
+                "folder": str(images_folder),
+                "mtime": folder_mtime,
+                "count": len(entries),
+                "entries": entries,
+            }, f)
+        os.replace(tmp_path, cache_path)
+
+    return entries
+
+
+def lookup_table(entries):
+    """
+    Maps every name a CSV might use (full file name or short name) to its
+    index row. Like the old loop: full names always win, and for a short
+    name the first file in listing order is kept.
+    """
+    full = entries.set_index("filename", drop=False)
+    short = entries.dropna(subset=["short_name"]).drop_duplicates("short_name", keep="first")
+    short = short.set_index("short_name", drop=False)
+    short = short[~short.index.isin(full.index)]
+    return pd.concat([full, short])
+
+
+def attach_image_info(df, entries, key="filename", lookup=None):
+    """
+    מוסיף לטבלה img_path, file_size, width, height לפי שם הקובץ
+    (lookup - תוצאה מוכנה של lookup_table, כשמחברים הרבה chunks לאותו אינדקס)
+    """
+    table = (lookup if lookup is not None else lookup_table(entries))[["img_path", "file_size", "width", "height"]]
+    info = table.reindex(df[key].astype(str).to_numpy())
+    info.index = df.index
+    return df.assign(**{column: info[column] for column in info.columns})
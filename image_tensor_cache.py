@@ -0,0 +1,178 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+# אותו Resize + CenterCrop כמו ב-preprocess של DenseNet
+RESIZE = 256
+CROP = 224
+
+IMAGES_FILE = "images.npy"
+KEYS_FILE = "keys.npy"
+STATS_FILE = "stats.npy"
+META_FILE = "meta.json"
+
+# PIL משחרר את ה-GIL בזמן decode/resize, לכן threads מספיקים
+NUM_WORKERS = min(8, os.cpu_count() or 1)
+
+_crop = transforms.Compose([transforms.Resize(RESIZE), transforms.CenterCrop(CROP)])
+
+
+def _file_stats(path):
+    """גודל + זמן שינוי - כדי לזהות תמונה שהשתנתה מאז שנשמרה"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def decode_cropped(path, channels=1):
+    """
+    Decodes one PNG and applies Resize(256) + CenterCrop(224), returning
+    uint8 HxW (channels=1, the X-rays are single channel) or HxWx3.
+    For grayscale sources this is exactly what preprocess sees after
+    convert('RGB'), since all three channels are the same.
+    """
+    with Image.open(path) as img:
+        img = img.convert("L" if channels == 1 else "RGB")
+        return np.asarray(_crop(img), dtype=np.uint8)
+
+
+class ImageTensorCache:
+    """
+    Memory-mapped uint8 array of cropped 224x224 images, keyed by filename.
+    Normalization is applied per batch, so any backbone/normalization can be
+    run on top without decoding a single PNG.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / META_FILE, encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.images = np.load(self.path / IMAGES_FILE, mmap_mode="r")
+        self.keys = np.load(self.path / KEYS_FILE).tolist()
+        self.stats = np.load(self.path / STATS_FILE)
+        self.index = {key: row for row, key in enumerate(self.keys)}
+
+    @property
+    def channels(self):
+        return self.meta["channels"]
+
+    def rows(self, names):
+        return [self.index[name] for name in names]
+
+    def batch(self, rows, mean, std):
+        """batch מנורמל (B, 3, 224, 224) - בדיוק כמו ToTensor + Normalize"""
+        pixels = torch.from_numpy(np.ascontiguousarray(self.images[rows]))
+        if self.channels == 1:
+            pixels = pixels.unsqueeze(1).expand(-1, 3, -1, -1)
+        else:
+            pixels = pixels.permute(0, 3, 1, 2)
+        mean = torch.tensor(mean).view(1, 3, 1, 1)
+        std = torch.tensor(std).view(1, 3, 1, 1)
+        return (pixels.float() / 255.0 - mean) / std
+
+
+def update_tensor_cache(cache_path, names, paths, channels=1, workers=NUM_WORKERS):
+    """
+    Makes sure the cache holds every (name, path) in its current version.
+    Rows that are still valid are copied over from the old array; only new
+    or changed images are decoded (in parallel).
+    Returns (opened cache, set of names that could not be decoded).
+    """
+    cache_path = Path(cache_path)
+    # שם כפול נשמר פעם אחת
+    pairs = dict(zip(names, (str(p) for p in paths)))
+    names, paths = list(pairs), list(pairs.values())
+    stats = np.array([_file_stats(p) for p in paths], dtype=np.int64).reshape(-1, 2)
+    config = {"resize": RESIZE, "crop": CROP, "channels": channels}
+
+    old = None
+    if (cache_path / META_FILE).exists():
+        old = ImageTensorCache(cache_path)
+        if old.meta != config:
+            old = None
+
+    # אילו תמונות אפשר להעתיק מה-cache הקיים ואילו צריך לפענח
+    reuse, decode = {}, []
+    for i, name in enumerate(names):
+        row = old.index.get(name) if old is not None else None
+        if row is not None and np.array_equal(old.stats[row], stats[i]):
+            reuse[i] = row
+        else:
+            decode.append(i)
+
+    if old is not None and not decode:
+        return old, set()
+
+    # תמונות ישנות שלא התבקשו הפעם נשארות ב-cache (למשל POC אחרי ריצה מלאה)
+    if old is not None:
+        requested = set(names)
+        extra = [row for row, name in enumerate(old.keys) if name not in requested]
+        for row in extra:
+            reuse[len(names)] = row
+            names.append(old.keys[row])
+            paths.append(None)
+        stats = np.vstack([stats, old.stats[extra]])
+
+    shape = (len(names), CROP, CROP) if channels == 1 else (len(names), CROP, CROP, 3)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    tmp_images = cache_path / (IMAGES_FILE + ".tmp")
+    images = np.lib.format.open_memmap(tmp_images, mode="w+", dtype=np.uint8, shape=shape)
+
+    for i, row in reuse.items():
+        images[i] = old.images[row]
+
+    def _decode(i):
+        try:
+            return decode_cropped(paths[i], channels)
+        except Exception as e:
+            print(f"Error processing {names[i]}: {e}")
+            return None
+
+    print(f"Decoding {len(decode)} images into the tensor cache ({len(reuse)} reused)...")
+    failed = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for i, pixels in zip(decode, pool.map(_decode, decode)):
+            if pixels is None:
+                # סטטיסטיקה לא תקפה - ינסו לפענח שוב בריצה הבאה
+                failed.add(names[i])
+                stats[i] = -1
+            else:
+                images[i] = pixels
+
+    images.flush()
+    del images
+    old = None  # סוגרים את ה-memmap הישן לפני ההחלפה (חשוב ב-Windows)
+
+    # קודם מוחקים את ה-meta (ה-cache "לא שלם"), מחליפים את הקבצים, ורק בסוף כותבים meta חדש
+    (cache_path / META_FILE).unlink(missing_ok=True)
+    np.save(cache_path / KEYS_FILE, np.asarray(names, dtype=str))
+    np.save(cache_path / STATS_FILE, stats)
+    os.replace(tmp_images, cache_path / IMAGES_FILE)
+    with open(cache_path / META_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    return ImageTensorCache(cache_path), failed
+
+
+class TensorCacheLoader:
+    """מחליף את ה-DataLoader: מחזיר (names, batch) ישירות מה-cache, בלי PNG"""
+
+    def __init__(self, cache, names, mean, std, batch_size=32):
+        self.cache = cache
+        self.names = list(names)
+        self.mean = mean
+        self.std = std
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return (len(self.names) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        for start in range(0, len(self.names), self.batch_size):
+            names = self.names[start:start + self.batch_size]
+            yield names, self.cache.batch(self.cache.rows(names), self.mean, self.std)
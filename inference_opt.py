@@ -0,0 +1,111 @@
+import copy
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+# מצבי האופטימיזציה ל-DenseNet (none = המודל הרגיל ב-fp32)
+IMAGE_MODES = ("none", "channels_last", "script", "compile")
+
+
+def set_threads(intra_op=None, inter_op=None):
+    """
+    Pins the number of CPU threads torch uses. On shared CPU nodes the
+    default (one thread per core) often oversubscribes the machine.
+    """
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            # אפשר לקבוע רק לפני שהחישוב המקבילי הראשון התחיל
+            print("Warning: inter-op threads already initialized, keeping the current value")
+    return torch.get_num_threads()
+
+
+def quantization_available():
+    """quantize_dynamic קיים ב-torch.ao (deprecated בגרסאות חדשות) ומנוע int8 זמין"""
+    try:
+        from torch.ao.quantization import quantize_dynamic  # noqa: F401
+    except ImportError:
+        return False
+    return torch.backends.quantized.engine != "none"
+
+
+def quantize_bert(model):
+    """
+    Dynamic INT8 quantization of every nn.Linear (weights stored as int8,
+    activations quantized on the fly). CPU only; returns a new model.
+    """
+    if not quantization_available():
+        raise RuntimeError("Dynamic quantization is not available in this torch build")
+    from torch.ao.quantization import quantize_dynamic
+
+    with warnings.catch_warnings():
+        # ה-API מסומן deprecated לטובת torchao, אבל עדיין עובד
+        warnings.filterwarnings("ignore", message=".*deprecated.*")
+        return quantize_dynamic(model.cpu(), {nn.Linear}, dtype=torch.qint8)
+
+
+class ChannelsLast(nn.Module):
+    """עוטף מודל קונבולוציה: הקלט עובר ל-NHWC, שמהיר יותר ב-oneDNN על CPU"""
+
+    def __init__(self, model):
+        super().__init__()
+        # עותק - המודל המקורי נשאר NCHW ומשמש כ-reference בבדיקת ה-parity
+        self.model = copy.deepcopy(model).to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def optimize_densenet(model, mode="script", image_size=224):
+    """
+    Returns an inference-only version of the DenseNet backbone:
+      channels_last - NHWC weights and inputs
+      script        - channels_last + traced, frozen TorchScript graph
+      compile       - channels_last + torch.compile (needs a C++ compiler)
+    """
+    if mode not in IMAGE_MODES:
+        raise ValueError(f"mode must be one of {IMAGE_MODES}, got {mode!r}")
+    if mode == "none":
+        return model
+
+    model = ChannelsLast(model).eval()
+    if mode == "script":
+        device = next(model.parameters()).device
+        example = torch.randn(1, 3, image_size, image_size, device=device)
+        with torch.inference_mode(False), torch.no_grad(), warnings.catch_warnings():
+            # TorchScript מסומן deprecated לטובת torch.compile, אבל לא דורש קומפיילר
+            warnings.simplefilter("ignore", FutureWarning)
+            traced = torch.jit.trace(model, example)
+            model = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    elif mode == "compile":
+        model = torch.compile(model)
+    return model
+
+
+def cosine_parity(reference, candidate):
+    """
+    Row-wise cosine similarity between the fp32 vectors and the optimized
+    ones, summarized as {rows, mean, min, p01, max_abs_diff}.
+    """
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    cosine = (reference * candidate).sum(axis=1) / np.maximum(norms, 1e-12)
+    return {
+        "rows": len(cosine),
+        "mean": float(cosine.mean()) if len(cosine) else float("nan"),
+        "min": float(cosine.min()) if len(cosine) else float("nan"),
+        "p01": float(np.percentile(cosine, 1)) if len(cosine) else float("nan"),
+        "max_abs_diff": float(np.abs(reference - candidate).max()) if len(cosine) else float("nan"),
+    }
+
+
+def print_parity(report, label):
+    print(f"Parity vs fp32 ({label}, {report['rows']} rows): "
+          f"cosine mean={report['mean']:.6f} min={report['min']:.6f} p01={report['p01']:.6f}, "
+          f"max |diff|={report['max_abs_diff']:.2e}")
@@ -0,0 +1,197 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+PROFILERS = ("cprofile", "torch")
+
+
+def peak_rss_mb(children=False):
+    """
+    Peak resident memory of this process (or of its finished children, e.g.
+    DataLoader workers and shard processes) in MB. Uses `resource` on
+    Linux/macOS and psutil (if installed) elsewhere; None if neither exists.
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    if resource is not None:
+        who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+        peak = resource.getrusage(who).ru_maxrss
+        # ב-macOS היחידה היא bytes, ב-Linux היא KB
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+    if children:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    # ב-Windows יש peak_wset, אחרת מסתפקים ב-RSS הנוכחי
+    return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+
+class Metrics:
+    """
+    Run-wide timers and counters. Stages are named with dots
+    (e.g. 'embed-image.forward'); every counter is attributed to the
+    innermost open stage and reported together with a per-second rate.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self.stages = {}
+        self._stack = []
+
+    def _entry(self, name):
+        return self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "counters": {}})
+
+    @contextmanager
+    def stage(self, name):
+        """מודד זמן של בלוק קוד; קריאות חוזרות לאותו שם מצטברות"""
+        entry = self._entry(name)
+        self._stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["seconds"] += time.perf_counter() - start
+            entry["calls"] += 1
+            self._stack.pop()
+
+    def add_time(self, name, seconds):
+        entry = self._entry(name)
+        entry["seconds"] += seconds
+        entry["calls"] += 1
+
+    def count(self, key, n=1, stage=None):
+        """מוסיף n לספירה key של השלב הפתוח (או של stage אם צוין)"""
+        name = stage or (self._stack[-1] if self._stack else "run")
+        counters = self._entry(name)["counters"]
+        counters[key] = counters.get(key, 0) + int(n)
+
+    def timed_iter(self, iterable, name):
+        """
+        Wraps an iterator (e.g. a DataLoader) and charges the time spent
+        waiting for every next item to stage `name` - the I/O + decode wait
+        as seen by the consumer.
+        """
+        # גם יצירת ה-iterator נספרת (למשל הפעלת ה-workers של DataLoader)
+        start = time.perf_counter()
+        iterator = iter(iterable)
+        while True:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+            start = time.perf_counter()
+
+    def report(self):
+        stages = {}
+        for name, entry in self.stages.items():
+            seconds = entry["seconds"]
+            stage = {"calls": entry["calls"], "seconds": round(seconds, 6), **entry["counters"]}
+            for key, value in entry["counters"].items():
+                stage[f"{key}_per_s"] = round(value / seconds, 3) if seconds > 0 else None
+            stages[name] = stage
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": round(time.perf_counter() - self._clock, 6),
+            "argv": sys.argv,
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_rss_children_mb": peak_rss_mb(children=True),
+            "stages": stages,
+        }
+
+    def print_summary(self):
+        report = self.report()
+        print("\n" + "=" * 60)
+        print(f"Metrics (wall {report['wall_seconds']:.2f}s, peak RSS "
+              f"{report['peak_rss_mb'] or 0:.0f} MB):")
+        for name, stage in report["stages"].items():
+            rates = ", ".join(f"{k[:-6]}/s={v:,.1f}" for k, v in stage.items() if k.endswith("_per_s") and v)
+            print(f"  {name:<28} {stage['seconds']:9.3f}s  x{stage['calls']:<5} {rates}")
+        print("=" * 60)
+        return report
+
+    def write(self, path):
+        """שמירת דוח JSON של הריצה"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        return path
+
+
+# מופע אחד לכל התהליך - כל השלבים מדווחים אליו
+metrics = Metrics()
+
+
+@contextmanager
+def profiled(kind=None, output=None):
+    """
+    Optional profiler around a block: 'cprofile' dumps a .prof file and
+    prints the top functions, 'torch' uses torch.profiler and exports a
+    Chrome trace. kind=None does nothing.
+    """
+    if kind is None:
+        yield
+        return
+    if kind not in PROFILERS:
+        raise ValueError(f"kind must be one of {PROFILERS}, got {kind!r}")
+
+    if kind == "cprofile":
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            output = Path(output or "profile.prof")
+            profiler.dump_stats(output)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+            print(f"cProfile stats saved to: {output}")
+        return
+
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+    with profile(activities=activities) as prof:
+        yield
+    output = Path(output or "torch_trace.json")
+    prof.export_chrome_trace(str(output))
+    print(prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=20))
+    print(f"torch.profiler trace saved to: {output}")
+
+
+def add_arguments(parser, profile=False):
+    """הדגלים המשותפים: --metrics (ולשלבי החילוץ גם --profile)"""
+    parser.add_argument("--metrics", default=None, metavar="JSON", help="write a metrics report for this run")
+    if profile:
+        parser.add_argument("--profile", choices=PROFILERS, default=None, help="profile the extraction")
+        parser.add_argument("--profile-output", default=None, help="profiler output file")
+
+
+def profile_context(args):
+    return profiled(getattr(args, "profile", None), getattr(args, "profile_output", None))
+
+
+def finish(args):
+    """בסוף main: סיכום על המסך ושמירת ה-JSON אם התבקש"""
+    if getattr(args, "metrics", None):
+        metrics.print_summary()
+        print(f"Metrics saved to: {metrics.write(args.metrics)}")
@@ -0,0 +1,88 @@
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# קובץ ברירת המחדל של חוקי התיוג (לפי סדר עדיפות)
+DEFAULT_RULES_PATH = Path(__file__).with_name("label_rules.json")
+
+
+def load_label_rules(path=DEFAULT_RULES_PATH):
+    """טעינת חוקי התיוג מקובץ JSON"""
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+    if not rules.get("rules"):
+        raise ValueError(f"No label rules found in {path}")
+    return rules
+
+
+class LabelEngine:
+    """
+    Keyword labeler that works on whole columns.
+    Every rule's keywords are compiled into one regex, and each regex is
+    evaluated with a single vectorized str.contains over the text column
+    (plain substring semantics, exactly like `'normal' in text`).
+    Rules are in priority order: the first matching rule wins in assign().
+    """
+
+    def __init__(self, rules):
+        self.columns = rules.get("columns", ["findings", "impression", "Problems", "problems"])
+        self.default = rules.get("default", "Other")
+        self.labels = [rule["label"] for rule in rules["rules"]]
+        self.patterns = [
+            "|".join(re.escape(k.lower()) for k in rule["keywords"])
+            for rule in rules["rules"]
+        ]
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_RULES_PATH):
+        return cls(load_label_rules(path))
+
+    def label_text(self, df):
+        """כל עמודות הטקסט מחוברות ברווח ובאותיות קטנות (כמו ב-assign_label)"""
+        parts = []
+        for column in self.columns:
+            if column in df.columns:
+                # str() על NaN נותן 'nan' - שומרים על אותה התנהגות
+                parts.append(df[column].astype(str).fillna("nan"))
+            else:
+                parts.append(pd.Series("", index=df.index).astype(str))
+        text = parts[0]
+        for part in parts[1:]:
+            text = text + " " + part
+        return text.str.lower()
+
+    def match_matrix(self, df):
+        """טבלת True/False - איזה label נמצא בכל שורה (multi-label)"""
+        text = self.label_text(df)
+        matches = {
+            label: text.str.contains(pattern, regex=True).fillna(False).to_numpy(dtype=bool)
+            for label, pattern in zip(self.labels, self.patterns)
+        }
+        return pd.DataFrame(matches, index=df.index, columns=self.labels)
+
+    def assign(self, df):
+        """label יחיד לכל שורה - החוק הראשון (בסדר העדיפות) שמתאים"""
+        text = self.label_text(df)
+        labels = pd.Series(self.default, index=df.index, dtype=object)
+        pending = np.ones(len(df), dtype=bool)
+
+        # כל חוק נבדק רק על השורות שעוד לא קיבלו label
+        for label, pattern in zip(self.labels, self.patterns):
+            if not pending.any():
+                break
+            hit = text[pending].str.contains(pattern, regex=True).fillna(False).to_numpy(dtype=bool)
+            rows = np.flatnonzero(pending)[hit]
+            labels.iloc[rows] = label
+            pending[rows] = False
+        return labels
+
+    def assign_multi(self, df, sep="|"):
+        """כל ה-labels שמתאימים לשורה, מחוברים ב-sep לפי סדר העדיפות"""
+        matches = self.match_matrix(df).to_numpy()
+        joined = pd.Series("", index=df.index).astype(str)
+        for i, label in enumerate(self.labels):
+            joined = joined + pd.Series(np.where(matches[:, i], label + sep, ""), index=df.index).astype(str)
+        return joined.str[:-len(sep)].where(matches.any(axis=1), self.default)
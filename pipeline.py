@@ -0,0 +1,155 @@
+import argparse
+import time
+
+from embedding_cache import DEFAULT_CACHE_NAME
+from data_io import (FRONTAL_CSV, MERGED_CSV, POC_CSV, SUMMARY_CSV, add_table_arguments, configure_tables,
+                     get_base_path, read_table, resolve_table, write_table)
+from read_the_db import merge_projections_reports
+from filter_frontal_images import filter_frontal
+from create_clinical_summary import add_clinical_summary
+from create_poc_dataset import build_poc_dataset
+import instrumentation
+from instrumentation import metrics
+
+# סדר השלבים המלא
+STAGES = ["merge", "frontal", "summary", "poc", "embed-image", "embed-text"]
+
+# על איזו טבלה כל שלב עובד
+INPUTS = {
+    "frontal": "merge",
+    "summary": "merge",
+    "poc": "frontal",
+    "embed-image": "poc",
+    "embed-text": "summary",
+}
+
+# קובץ ה-checkpoint של כל שלב (אותם שמות שהסקריפטים הבודדים משתמשים בהם)
+CHECKPOINTS = {
+    "merge": MERGED_CSV,
+    "frontal": FRONTAL_CSV,
+    "summary": SUMMARY_CSV,
+    "poc": POC_CSV,
+}
+
+
+def _embed_image(df, base_path, options):
+    # torch נטען רק אם באמת מריצים את השלב הזה
+    from generate_densenet_features import extract_image_features, save_image_features
+
+    features_dict, missing_count = extract_image_features(
+        df, base_path, options.batch_size, options.workers, cache_path=options.cache_path,
+        optimize=options.optimize, threads=options.threads, loader=options.loader)
+    if missing_count > 0:
+        print(f"Warning: {missing_count} images were missing from the folder.")
+    save_image_features(features_dict, base_path / "image_features", source=POC_CSV, optimize=options.optimize)
+    return df
+
+
+def _embed_text(df, base_path, options):
+    from project_db.create_text_embeddings import embed_distinct_summaries, embed_summaries, save_text_embeddings
+
+    embed = embed_distinct_summaries if options.dedup_text else embed_summaries
+    result = embed(df, options.text_model, options.batch_size, cache_path=options.cache_path,
+                   quantize=options.quantize, threads=options.threads)
+    embeddings, rows = result if options.dedup_text else (result, None)
+    save_text_embeddings(df, embeddings, base_path / "text_embeddings", model_name=options.text_model,
+                         source=SUMMARY_CSV, quantize=options.quantize, rows=rows)
+    return df
+
+
+STAGE_FUNCTIONS = {
+    "frontal": lambda df, base_path, options: filter_frontal(df),
+    "summary": lambda df, base_path, options: add_clinical_summary(df),
+    "poc": lambda df, base_path, options: build_poc_dataset(df),
+    "embed-image": _embed_image,
+    "embed-text": _embed_text,
+}
+
+
+def run_pipeline(base_path, stages=STAGES, checkpoint=False, options=None):
+    """
+    Runs the selected stages in order, passing DataFrames in memory.
+    A stage whose input was not produced in this run reads it from the
+    input stage's checkpoint table. Returns (frames, seconds per stage).
+    """
+    frames = {}
+    timings = {}
+
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+
+        start = time.perf_counter()
+        with metrics.stage(f"pipeline.{stage}"):
+            print(f"\n>>> Stage: {stage}")
+
+            if stage == "merge":
+                result = merge_projections_reports(base_path)
+            else:
+                source = INPUTS[stage]
+                if source not in frames:
+                    print(f"Loading '{source}' checkpoint: {resolve_table(base_path, CHECKPOINTS[source]).name}")
+                    frames[source] = read_table(base_path, CHECKPOINTS[source])
+                result = STAGE_FUNCTIONS[stage](frames[source], base_path, options)
+
+            frames[stage] = result
+            metrics.count("rows", len(result))
+            # checkpoint לכל שלב רק כשמבקשים; טבלת ה-POC (התוצר הסופי) תמיד נשמרת
+            if stage in CHECKPOINTS and (checkpoint or stage == "poc"):
+                print(f"Saved: {write_table(result, base_path, CHECKPOINTS[stage])}")
+
+        timings[stage] = time.perf_counter() - start
+        print(f"<<< {stage}: {len(result)} rows, {timings[stage]:.2f}s")
+
+    return frames, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Indiana data pipeline in a single process")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"comma separated subset of: {','.join(STAGES)}")
+    parser.add_argument("--skip-embeddings", action="store_true", help="stop after the POC dataset")
+    parser.add_argument("--checkpoint", action="store_true", help="also write every intermediate CSV")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--text-model", default="emilyalsentzer/Bio_ClinicalBERT")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every embedding")
+    # בלי import של inference_opt כאן - torch נטען רק בשלבי ה-embedding
+    parser.add_argument("--optimize", choices=["none", "channels_last", "script", "compile"], default="none",
+                        help="CPU inference mode for DenseNet")
+    parser.add_argument("--loader", choices=["dataloader", "prefetch"], default="dataloader",
+                        help="prefetch: read images ahead with threads (slow or network storage)")
+    parser.add_argument("--quantize", action="store_true", help="INT8 ClinicalBERT on CPU")
+    parser.add_argument("--dedup-text", action="store_true", help="embed every distinct summary once")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    add_table_arguments(parser)
+    instrumentation.add_arguments(parser, profile=True)
+    args = parser.parse_args()
+    configure_tables(args)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {unknown}")
+    if args.skip_embeddings:
+        stages = [s for s in stages if not s.startswith("embed")]
+
+    base_path = get_base_path()
+    args.cache_path = None if args.no_cache else base_path / DEFAULT_CACHE_NAME
+
+    with instrumentation.profile_context(args):
+        _, timings = run_pipeline(base_path, stages, args.checkpoint, args)
+
+    # סיכום זמנים לכל שלב
+    print("\n" + "=" * 40)
+    print("Stage timings:")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<12} {seconds:8.2f}s")
+    print(f"  {'total':<12} {sum(timings.values()):8.2f}s")
+    print("=" * 40)
+
+    instrumentation.finish(args)
+
+
+if __name__ == "__main__":
+    main()
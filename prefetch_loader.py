@@ -0,0 +1,153 @@
+import io
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+from PIL import Image
+
+from instrumentation import metrics
+
+# קריאה מ-OneDrive/NFS חסומה בעיקר על latency - הרבה threads קוראים במקביל
+IO_THREADS = 16
+# decode + preprocessing (PIL ו-torch משחררים את ה-GIL)
+DECODE_WORKERS = min(4, os.cpu_count() or 1)
+# כמה batch-ים נקראים מראש (בתור חסום - הזיכרון לא גדל בלי סוף)
+QUEUE_BATCHES = 4
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _stack(batch):
+    names, tensors = zip(*batch)
+    return list(names), torch.stack(tensors)
+
+
+class PrefetchLoader:
+    """
+    Drop-in replacement for the image DataLoader on slow storage: raw file
+    bytes are read ahead of the model by a pool of I/O threads, decoded and
+    preprocessed by a second pool, and handed over as (names, batch) in the
+    original order. At most queue_batches batches are in flight at once.
+
+    After every pass `stats` holds the time spent reading and decoding
+    (summed over the worker threads), the time the consumer waited for a
+    batch (I/O wait) and the time it spent between batches (compute).
+    """
+
+    def __init__(self, names, paths, transform, batch_size=32, io_threads=IO_THREADS,
+                 decode_workers=DECODE_WORKERS, queue_batches=QUEUE_BATCHES, collate_fn=_stack, pin_memory=False):
+        self.names = list(names)
+        self.paths = [str(p) for p in paths]
+        self.transform = transform
+        self.batch_size = batch_size
+        self.io_threads = max(1, io_threads)
+        self.decode_workers = max(1, decode_workers)
+        self.queue_size = max(1, queue_batches) * batch_size
+        self.collate_fn = collate_fn
+        self.pin_memory = pin_memory
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def __len__(self):
+        return (len(self.names) + self.batch_size - 1) // self.batch_size
+
+    def _add(self, key, value):
+        with self._lock:
+            self.stats[key] += value
+
+    def _read(self, idx):
+        start = time.perf_counter()
+        try:
+            data = read_bytes(self.paths[idx])
+        finally:
+            self._add("read_seconds", time.perf_counter() - start)
+        self._add("bytes", len(data))
+        return data
+
+    def _decode(self, idx, data):
+        start = time.perf_counter()
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                return self.transform(img.convert("RGB"))
+        finally:
+            self._add("decode_seconds", time.perf_counter() - start)
+
+    def _submit(self, idx, read_pool, decode_pool):
+        """קריאה ואז decode - ה-decode נשלח רק כשה-bytes הגיעו, כך שאף worker לא מחכה לדיסק"""
+        result = Future()
+
+        def on_decoded(decoded):
+            try:
+                result.set_result(decoded.result())
+            except Exception as e:
+                result.set_exception(e)
+
+        def on_read(read):
+            try:
+                decode_pool.submit(self._decode, idx, read.result()).add_done_callback(on_decoded)
+            except Exception as e:
+                result.set_exception(e)
+
+        read_pool.submit(self._read, idx).add_done_callback(on_read)
+        return result
+
+    def __iter__(self):
+        self.stats = {"images": 0, "failed": 0, "bytes": 0, "read_seconds": 0.0, "decode_seconds": 0.0,
+                      "wait_seconds": 0.0, "compute_seconds": 0.0}
+        read_pool = ThreadPoolExecutor(max_workers=self.io_threads, thread_name_prefix="prefetch-read")
+        decode_pool = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="prefetch-decode")
+        pending = deque()
+        submitted = 0
+        try:
+            for start in range(0, len(self.names), self.batch_size):
+                # התור מתמלא מחדש עד queue_size תמונות קדימה
+                while submitted < len(self.names) and len(pending) < self.queue_size:
+                    pending.append(self._submit(submitted, read_pool, decode_pool))
+                    submitted += 1
+
+                wait_start = time.perf_counter()
+                batch = []
+                for idx in range(start, min(start + self.batch_size, len(self.names))):
+                    try:
+                        batch.append((self.names[idx], pending.popleft().result()))
+                    except Exception as e:
+                        # תמונה פגומה לא מפילה את כל הריצה (כמו ב-ChestXrayDataset)
+                        print(f"Error processing {self.names[idx]}: {e}")
+                        batch.append((self.names[idx], None))
+                names, tensors = self.collate_fn(batch)
+                if tensors is not None and self.pin_memory:
+                    tensors = tensors.pin_memory()
+                self.stats["wait_seconds"] += time.perf_counter() - wait_start
+                self.stats["images"] += len(names)
+                self.stats["failed"] += len(batch) - len(names)
+
+                compute_start = time.perf_counter()
+                yield names, tensors
+                self.stats["compute_seconds"] += time.perf_counter() - compute_start
+        finally:
+            # יציאה באמצע (break/חריגה) - מבטלים את מה שעוד לא התחיל
+            read_pool.shutdown(wait=True, cancel_futures=True)
+            decode_pool.shutdown(wait=True, cancel_futures=True)
+            self._record()
+
+    def _record(self):
+        metrics.add_time("embed-image.read", self.stats["read_seconds"])
+        metrics.count("bytes", self.stats["bytes"], stage="embed-image.read")
+        metrics.add_time("embed-image.decode", self.stats["decode_seconds"])
+        metrics.count("images", self.stats["images"], stage="embed-image.decode")
+
+    def print_summary(self):
+        """כמה מהזמן הלך להמתנה ל-I/O לעומת חישוב"""
+        s = self.stats
+        total = s["wait_seconds"] + s["compute_seconds"]
+        share = 100 * s["wait_seconds"] / total if total else 0.0
+        print(f"Prefetch: {s['images']} images, {s['bytes'] / 2 ** 20:.1f} MB read "
+              f"({s['read_seconds']:.2f}s read + {s['decode_seconds']:.2f}s decode across workers)")
+        print(f"  I/O wait {s['wait_seconds']:.2f}s vs compute {s['compute_seconds']:.2f}s "
+              f"({share:.0f}% of the loop waiting for images)")
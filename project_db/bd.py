@@ -1,7 +1,12 @@
 import pandas as pd
+import sys
 from pathlib import Path
 from PIL import Image
 
+# אינדקס התמונות המשותף נמצא בתיקייה הראשית של הפרויקט
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from image_index import INDEX_FILE, attach_image_info, load_image_index  # noqa: E402
+
 # ========= 1) הגדרות נתיבים =========
 base_path = Path(r"C:\Users\igal6\OneDrive\שולחן העבודה\project_db")
 # שים לב: השתמשתי בשם התיקייה כפי שציינת
@@ -16,28 +21,13 @@ df = df_proj.merge(df_rep, on="uid", how="left")
 example_filename = str(df["filename"].iloc[0])
 print(f"DEBUG: Example filename from CSV: '{example_filename}'")
 
-# ========= 4) בניית אינדקס תמונות (גמיש) =========
+# ========= 4) אינדקס תמונות (שמור בדיסק, נבנה מחדש רק אם התיקייה השתנתה) =========
 print("Indexing images...")
-image_index = {}
-
-# אנחנו נסרוק את התיקייה ונשמור את הנתיב לפי שם הקובץ ללא סיומת
-for img_path in images_folder.glob("*.png"):
-    # שם הקובץ המלא (למשל: 1_IM-0001-3001.dcm.png)
-    full_name = img_path.name
-
-    # ננסה להתאים לפי השם המלא או לפי ה-Base (לפני המקף השני)
-    image_index[full_name] = str(img_path)
-
-    # הוספת גרסה מקוצרת (למשל 1_IM-0001)
-    parts = full_name.split("-")
-    if len(parts) >= 2:
-        short_name = f"{parts[0]}-{parts[1]}"
-        if short_name not in image_index:
-            image_index[short_name] = str(img_path)
+entries = load_image_index(images_folder, base_path / INDEX_FILE)
 
 # ========= 5) קישור התמונות =========
-# ננסה למצוא התאמה ישירה
-df["img_path"] = df["filename"].astype(str).map(image_index)
+# ננסה למצוא התאמה ישירה (שם מלא או מקוצר), כולל גודל ומידות התמונה
+df = attach_image_info(df, entries)
 
 # ========= 6) בדיקה אם זה עבד =========
 matches = df["img_path"].notna().sum()
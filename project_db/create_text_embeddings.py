@@ -1,64 +1,331 @@
 import pandas as pd
-import torch
-from transformers import AutoTokenizer, AutoModel
 from tqdm import tqdm
 import numpy as np
 import os
+import sys
+import argparse
 from pathlib import Path
 from dotenv import load_dotenv
 
-# 1. הגדרות ונתיבים
-load_dotenv()
-env_path = os.getenv("DATA_PATH")
-base_path = Path(env_path)
-input_csv = base_path / "indiana_reports_with_summary.csv"
-output_embeddings = base_path / "text_embeddings.npy"
+# המודולים המשותפים נמצאים בתיקייה הראשית של הפרויקט
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from embedding_cache import DEFAULT_CACHE_NAME, EmbeddingCache, text_key  # noqa: E402
+from data_io import SUMMARY_CSV, read_table  # noqa: E402
+from feature_store import SUPPORTED_DTYPES, FeatureStore, FeatureWriter, save_features  # noqa: E402
+import instrumentation  # noqa: E402
+from instrumentation import metrics  # noqa: E402
+# torch / transformers נטענים רק בתוך הפונקציות שצריכות אותם (כמה שניות של import) -
+# כך --help, python -m cli וריצה שכולה מה-cache לא משלמים עליהם
 
-# 2. טעינת המודל והטוקנייזר (ClinicalBERT)
-print("Loading ClinicalBERT model...")
-model_name = "emilyalsentzer/Bio_ClinicalBERT"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModel.from_pretrained(model_name)
+# הגדרות ברירת מחדל של המודל וה-batch-ים
+MODEL_NAME = "emilyalsentzer/Bio_ClinicalBERT"
+MAX_LENGTH = 128
+BATCH_SIZE = 32
 
-# העברה ל-GPU אם קיים
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = model.to(device)
-model.eval()  # מצב הערכה (ללא Dropout)
+# מילוי הפלט מה-cache בחלקים (לא מטריצה מלאה נוספת בזיכרון)
+FILL_ROWS = 4096
 
 
-def get_embedding(text):
+def load_model(model_name=MODEL_NAME):
+    """טעינת המודל והטוקנייזר (ClinicalBERT)"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    with metrics.stage("embed-text.model_load"):
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+
+    # העברה ל-GPU אם קיים
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = model.to(device)
+    model.eval()  # מצב הערכה (ללא Dropout)
+    return tokenizer, model, device
+
+
+def load_inference_model(model_name=MODEL_NAME, quantize=False, parity_texts=None,
+                         batch_size=BATCH_SIZE, max_length=MAX_LENGTH):
+    """
+    load_model, optionally followed by dynamic INT8 quantization (CPU).
+    With parity_texts both versions embed those texts and the cosine
+    similarity to fp32 is printed.
+    """
+    import torch
+    from inference_opt import cosine_parity, print_parity, quantize_bert
+
+    tokenizer, model, device = load_model(model_name)
+    if not quantize:
+        return tokenizer, model, device
+
+    print("Quantizing Linear layers to INT8 (CPU)...")
+    quantized = quantize_bert(model)
+    if parity_texts:
+        parity_texts = [text for text in parity_texts if text]
+        reference = embed_texts(parity_texts, tokenizer, model, torch.device("cpu"), batch_size, max_length, False)
+        candidate = embed_texts(parity_texts, tokenizer, quantized, torch.device("cpu"), batch_size, max_length,
+                                False)
+        print_parity(cosine_parity(reference, candidate), "int8")
+    return tokenizer, quantized, torch.device("cpu")
+
+
+def model_key(model_name, quantize=False):
+    """השם שנכנס למפתח ה-cache - וקטורי int8 לא מתערבבים עם fp32"""
+    return f"{model_name}:int8" if quantize else model_name
+
+
+def get_embedding(text, tokenizer, model, device, max_length=MAX_LENGTH):
     """הופך טקסט בודד לווקטור באורך 768"""
-    if not text or text == "":
-        return np.zeros(768)
+    return embed_texts([text], tokenizer, model, device, batch_size=1, max_length=max_length, progress=False)[0]
+
+
+def embed_texts(texts, tokenizer, model, device, batch_size=BATCH_SIZE, max_length=MAX_LENGTH, progress=True,
+                out=None):
+    """
+    Embeds a list of texts in batches and returns a float32 matrix in input order.
+    Texts are sorted by token length so every batch is padded only to its own
+    longest text. Empty texts never reach the model and keep a zero vector.
+    With out (a FeatureWriter) every batch is written straight to disk
+    instead of into an in-memory matrix, and the writer is returned.
+    """
+    import torch
+
+    texts = list(texts)
+    if out is None:
+        embeddings = np.zeros((len(texts), model.config.hidden_size), dtype=np.float32)
+    else:
+        embeddings = out.allocate(model.config.hidden_size)
+
+    # טקסטים ריקים נשארים וקטור אפסים - לא שולחים אותם למודל
+    todo = [i for i, text in enumerate(texts) if text]
+    if not todo:
+        return embeddings
+
+    # מעבר טוקניזציה ראשון רק כדי לדעת את האורכים, ואז מיון לפי אורך (bucketing)
+    with metrics.stage("embed-text.tokenize"):
+        lengths = tokenizer([texts[i] for i in todo], truncation=True, max_length=max_length,
+                            return_length=True)["length"]
+    order = [todo[j] for j in np.argsort(lengths, kind="stable")]
+
+    batches = range(0, len(order), batch_size)
+    with torch.inference_mode():
+        for start in tqdm(batches, disable=not progress):
+            rows = order[start:start + batch_size]
+            # padding דינמי - רק עד הטקסט הארוך ביותר ב-batch
+            with metrics.stage("embed-text.tokenize"):
+                inputs = tokenizer([texts[i] for i in rows], return_tensors="pt", truncation=True,
+                                   padding=True, max_length=max_length).to(device)
+            with metrics.stage("embed-text.forward"):
+                outputs = model(**inputs)
+
+                # אנחנו לוקחים את ה-Hidden State של ה-Token הראשון ([CLS])
+                # הוא נחשב למייצג הטוב ביותר של כל המשפט במודלי BERT
+                embeddings[rows] = outputs.last_hidden_state[:, 0, :].float().cpu().numpy()
+                metrics.count("texts", len(rows))
+                metrics.count("tokens", int(inputs["attention_mask"].sum()))
+
+    return embeddings
+
+
+def embed_texts_cached(texts, cache, model_name=MODEL_NAME, batch_size=BATCH_SIZE, max_length=MAX_LENGTH,
+                       quantize=False, parity_samples=0, out=None):
+    """
+    Same result as embed_texts, but vectors already in the cache are reused and
+    only new or changed texts go through the model (loaded only when needed).
+    Both sides work in chunks of FILL_ROWS: new texts are embedded, cached
+    and written to their rows chunk by chunk, and the cached vectors are
+    read back one chunk at a time - with out nothing grows with the table.
+    """
+    texts = list(texts)
+    keys = [text_key(text, model_key(model_name, quantize), max_length) if text else None for text in texts]
+    present = cache.existing(k for k in keys if k)
+    print(f"Cache hits: {sum(k in present for k in keys if k)} / {sum(1 for k in keys if k)}")
+
+    # כל טקסט חסר מחושב פעם אחת, ונכתב לכל השורות שבהן הוא מופיע
+    missing = {}
+    for row, (key, text) in enumerate(zip(keys, texts)):
+        if key and key not in present:
+            missing.setdefault(key, (text, []))[1].append(row)
+
+    dim = None
+    if present:
+        dim = len(next(iter(cache.get_many([next(iter(present))]).values())))
+    if missing or dim is None:
+        print("Loading ClinicalBERT model...")
+        tokenizer, model, device = load_inference_model(model_name, quantize,
+                                                        [text for text, _ in missing.values()][:parity_samples],
+                                                        batch_size, max_length)
+        dim = model.config.hidden_size
+    embeddings = np.zeros((len(texts), dim), dtype=np.float32) if out is None else out.allocate(dim)
+
+    # 1. טקסטים חדשים: חלק אחרי חלק - מודל, cache, ושורות היעד
+    new = list(missing.items())
+    for start in range(0, len(new), FILL_ROWS):
+        chunk = new[start:start + FILL_ROWS]
+        vectors = embed_texts([text for _, (text, _) in chunk], tokenizer, model, device, batch_size, max_length)
+        cache.put_many(zip((key for key, _ in chunk), vectors))
+        rows = [rows for _, (_, rows) in chunk]
+        embeddings[np.concatenate(rows)] = np.repeat(vectors, [len(r) for r in rows], axis=0)
+
+    # 2. מה שכבר היה ב-cache: נקרא ונכתב FILL_ROWS שורות בכל פעם
+    hit_rows = [row for row, key in enumerate(keys) if key in present]
+    for start in range(0, len(hit_rows), FILL_ROWS):
+        rows = hit_rows[start:start + FILL_ROWS]
+        found = cache.get_many(keys[row] for row in rows)
+        embeddings[np.asarray(rows)] = np.stack([found[keys[row]] for row in rows])
+    return embeddings
+
+
+def embed_summaries(df, model_name=MODEL_NAME, batch_size=BATCH_SIZE, max_length=MAX_LENGTH,
+                    cache_path=None, evict_stale=False, quantize=False, threads=None, parity_samples=0, out=None):
+    """מחזיר מטריצת embeddings לעמודת clinical_summary, לפי סדר השורות (או כותב ל-out)"""
+    # נמלא ערכים ריקים בסיכום ליתר ביטחון
+    texts = df['clinical_summary'].fillna("")
+    if threads:
+        from inference_opt import set_threads
+        print(f"Torch threads: {set_threads(threads)}")
+
+    print(f"Generating embeddings for {len(df)} reports...")
+    if cache_path is None:
+        print("Loading ClinicalBERT model...")
+        tokenizer, model, device = load_inference_model(model_name, quantize, texts[:parity_samples].tolist(),
+                                                        batch_size, max_length)
+        return embed_texts(texts, tokenizer, model, device, batch_size=batch_size, max_length=max_length, out=out)
+
+    # עם cache - רק שורות חדשות או שהשתנו עוברות במודל
+    with EmbeddingCache(cache_path, "text") as cache:
+        embeddings = embed_texts_cached(texts, cache, model_name, batch_size, max_length, quantize, parity_samples,
+                                        out)
+        if evict_stale:
+            print(f"Evicted {cache.evict_stale()} stale cache entries")
+    return embeddings
+
+
+def distinct_summaries(df):
+    """
+    The distinct clinical summaries of df and, for every row, the index of
+    its summary. Both views of a study (same uid) always share one summary,
+    and so do the many identical 'normal' reports - each is embedded once.
+    """
+    codes, texts = pd.factorize(df['clinical_summary'].fillna(""), sort=False)
+    return pd.DataFrame({"clinical_summary": texts}), codes.astype(np.int64)
+
+
+def embed_distinct_summaries(df, model_name=MODEL_NAME, batch_size=BATCH_SIZE, max_length=MAX_LENGTH,
+                             cache_path=None, evict_stale=False, quantize=False, threads=None, parity_samples=0):
+    """
+    embed_summaries over the distinct summaries only. Returns (vectors, rows):
+    row i of df has the vector vectors[rows[i]] (see save_text_embeddings).
+    """
+    with metrics.stage("embed-text.dedup"):
+        distinct, rows = distinct_summaries(df)
+        metrics.count("texts", len(distinct))
+    print(f"Distinct summaries: {len(distinct)} / {len(df)} rows")
+    embeddings = embed_summaries(distinct, model_name, batch_size, max_length, cache_path, evict_stale, quantize,
+                                 threads, parity_samples)
+    return embeddings, rows
+
+
+def _store_keys(df):
+    return df['filename'].astype(str) if 'filename' in df.columns else df.index.astype(str)
+
+
+def _store_meta(model_name, max_length, quantize, source, dedup):
+    return {"model": model_name, "max_length": max_length, "pooling": "cls",
+            "inference": "int8" if quantize else "fp32", "source": source, "dedup": dedup}
+
+
+def save_text_embeddings(df, embeddings, output_store, dtype="float32", model_name=MODEL_NAME,
+                         max_length=MAX_LENGTH, source=None, legacy_output=False, quantize=False, rows=None):
+    """
+    שמירה ל-feature store - המפתח הוא שם הקובץ, כך שלא תלויים בסדר השורות.
+    With rows (from embed_distinct_summaries) every distinct vector is
+    stored once and the keys point at it through the store's row index.
+    """
+    output_store = Path(output_store)
+    save_features(output_store, _store_keys(df), embeddings, dtype=dtype, rows=rows,
+                  meta=_store_meta(model_name, max_length, quantize, source, rows is not None))
+
+    print(f"\nSUCCESS: Created embeddings array of shape {embeddings.shape}"
+          + ("" if rows is None else f" for {len(rows)} rows"))
+    print(f"Saved to: {output_store}")
+
+    if legacy_output:
+        legacy_path = output_store.with_suffix(".npy")
+        # הקובץ הישן הוא שורה לכל שורה בטבלה
+        np.save(legacy_path, embeddings if rows is None else embeddings[rows])
+        print(f"Saved legacy array to: {legacy_path}")
+
+
+def stream_text_embeddings(df, output_store, dtype="float32", model_name=MODEL_NAME, batch_size=BATCH_SIZE,
+                           max_length=MAX_LENGTH, cache_path=None, evict_stale=False, quantize=False, threads=None,
+                           parity_samples=0, dedup=False, source=None, legacy_output=False):
+    """
+    embed_summaries + save_text_embeddings without the matrix in memory:
+    a FeatureWriter sized from the row count (or the distinct summaries
+    with dedup) receives every batch, so memory stays flat for any table.
+    """
+    output_store = Path(output_store)
+    table, rows = df, None
+    if dedup:
+        with metrics.stage("embed-text.dedup"):
+            table, rows = distinct_summaries(df)
+            metrics.count("texts", len(table))
+        print(f"Distinct summaries: {len(table)} / {len(df)} rows")
+
+    writer = FeatureWriter(output_store, len(table), dtype, _store_meta(model_name, max_length, quantize, source,
+                                                                        dedup))
+    with writer:
+        embed_summaries(table, model_name, batch_size, max_length, cache_path, evict_stale, quantize, threads,
+                        parity_samples, out=writer)
+        writer.close(_store_keys(df), rows)
 
-    # טוקניזציה
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=128).to(device)
+    store = FeatureStore(output_store)
+    print(f"\nSUCCESS: Created embeddings array of shape {store.vectors.shape} for {len(df)} rows")
+    print(f"Saved to: {output_store}")
+    if legacy_output:
+        legacy_path = output_store.with_suffix(".npy")
+        np.save(legacy_path, store.matrix())
+        print(f"Saved legacy array to: {legacy_path}")
 
-    with torch.no_grad():
-        outputs = model(**inputs)
 
-    # אנחנו לוקחים את ה-Hidden State של ה-Token הראשון ([CLS])
-    # הוא נחשב למייצג הטוב ביותר של כל המשפט במודלי BERT
-    embedding = outputs.last_hidden_state[:, 0, :].cpu().numpy().flatten()
-    return embedding
+def main():
+    parser = argparse.ArgumentParser(description="Create ClinicalBERT embeddings for the clinical summaries")
+    parser.add_argument("--model-name", default=MODEL_NAME)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-length", type=int, default=MAX_LENGTH)
+    parser.add_argument("--output", default="text_embeddings", help="feature store directory inside DATA_PATH")
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32")
+    parser.add_argument("--legacy-output", action="store_true", help="also write the old positional <output>.npy")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_NAME, help="embedding cache file inside DATA_PATH")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every vector")
+    parser.add_argument("--evict-stale", action="store_true", help="drop cache entries not used in this run")
+    parser.add_argument("--quantize", action="store_true", help="dynamic INT8 quantization of the Linear layers (CPU)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--parity-check", type=int, default=0, metavar="N",
+                        help="compare the quantized model with fp32 on the first N texts")
+    parser.add_argument("--dedup", action="store_true",
+                        help="embed every distinct summary once (both views of a study, identical reports)")
+    instrumentation.add_arguments(parser, profile=True)
+    args = parser.parse_args()
 
+    # 1. הגדרות ונתיבים
+    load_dotenv()
+    env_path = os.getenv("DATA_PATH")
+    base_path = Path(env_path)
 
-# 3. טעינת הנתונים
-df = pd.read_csv(input_csv)
-# נמלא ערכים ריקים בסיכום ליתר ביטחון
-df['clinical_summary'] = df['clinical_summary'].fillna("")
+    # 2. טעינת הנתונים
+    df = read_table(base_path, SUMMARY_CSV)
 
-# 4. הרצה על כל הטבלה
-print(f"Generating embeddings for {len(df)} reports...")
-all_embeddings = []
+    # 3. הרצה על כל הטבלה ב-batch-ים - כל batch נכתב ישר לקובץ ה-store
+    # (עם --dedup: וקטור לכל סיכום שונה + אינדקס שורה -> וקטור)
+    with instrumentation.profile_context(args):
+        stream_text_embeddings(df, base_path / args.output, args.dtype, args.model_name, args.batch_size,
+                               args.max_length, cache_path=None if args.no_cache else base_path / args.cache,
+                               evict_stale=args.evict_stale, quantize=args.quantize, threads=args.threads,
+                               parity_samples=args.parity_check, dedup=args.dedup, source=SUMMARY_CSV,
+                               legacy_output=args.legacy_output)
 
-for text in tqdm(df['clinical_summary']):
-    vector = get_embedding(text)
-    all_embeddings.append(vector)
+    instrumentation.finish(args)
 
-# 5. שמירה
-embeddings_array = np.array(all_embeddings)
-np.save(output_embeddings, embeddings_array)
 
-print(f"\nSUCCESS: Created embeddings array of shape {embeddings_array.shape}")
-print(f"Saved to: {output_embeddings}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -2,75 +2,182 @@ import pandas as pd
 from pathlib import Path
 from PIL import Image
 import os
+import argparse
 from dotenv import load_dotenv
 
-# טעינת המשתנים מקובץ ה-.env
-load_dotenv()
-
-# ========= 1) הגדרות נתיבים =========
-# במקום נתיב קשיח, אנחנו קוראים אותו מהקובץ הסודי שיצרת
-env_path = os.getenv("DATA_PATH")
-
-if not env_path:
-    raise ValueError("Error: DATA_PATH is missing. Please create a .env file with your path.")
-
-base_path = Path(env_path)
-
-# שים לב: השתמשתי בשם התיקייה כפי שציינת
-images_folder = base_path / "images" / "images_normalized"
-
-# ========= 2) טעינת הנתונים =========
-df_proj = pd.read_csv(base_path / "indiana_projections.csv")
-df_rep = pd.read_csv(base_path / "indiana_reports.csv")
-df = df_proj.merge(df_rep, on="uid", how="left")
-
-# ========= 3) בדיקה: מה כתוב ב-CSV? =========
-example_filename = str(df["filename"].iloc[0])
-print(f"DEBUG: Example filename from CSV: '{example_filename}'")
-
-# ========= 4) בניית אינדקס תמונות (גמיש) =========
-print("Indexing images...")
-image_index = {}
-
-# אנחנו נסרוק את התיקייה ונשמור את הנתיב לפי שם הקובץ ללא סיומת
-for img_path in images_folder.glob("*.png"):
-    # שם הקובץ המלא (למשל: 1_IM-0001-3001.dcm.png)
-    full_name = img_path.name
-
-    # ננסה להתאים לפי השם המלא או לפי ה-Base (לפני המקף השני)
-    image_index[full_name] = str(img_path)
-
-    # הוספת גרסה מקוצרת (למשל 1_IM-0001)
-    parts = full_name.split("-")
-    if len(parts) >= 2:
-        short_name = f"{parts[0]}-{parts[1]}"
-        if short_name not in image_index:
-            image_index[short_name] = str(img_path)
-
-# ========= 5) קישור התמונות =========
-# ננסה למצוא התאמה ישירה
-df["img_path"] = df["filename"].astype(str).map(image_index)
+from data_io import (MERGED_CSV, PROJECTIONS_CSV, REPORTS_CSV, TableWriter, add_table_arguments, configure_tables,
+                     iter_table_chunks, read_table, resolve_table, write_table)
+from image_index import INDEX_FILE, NUM_WORKERS, attach_image_info, load_image_index, lookup_table
+import instrumentation
+from instrumentation import metrics
+
+
+# גודל chunk של טבלת ה-projections במצב הזורם (--chunksize)
+CHUNK_SIZE = 100_000
+
+# uid מספרי ו-projection קטגוריאלי - חוסך זיכרון בכל chunk
+PROJECTION_DTYPES = {"uid": "int64", "projection": "category"}
+
+
+def get_images_folder(base_path):
+    # שים לב: השתמשתי בשם התיקייה כפי שציינת
+    return Path(base_path) / "images" / "images_normalized"
+
+
+def merge_projections_reports(base_path, workers=NUM_WORKERS, rebuild_index=False, verify_count=False):
+    """
+    טעינת שתי הטבלאות, איחוד לפי uid וקישור כל שורה לתמונה שלה
+    (נתיב, גודל קובץ ומידות - מתוך אינדקס התמונות השמור)
+    """
+    df_proj = read_table(base_path, PROJECTIONS_CSV)
+    df_rep = read_table(base_path, REPORTS_CSV)
+    with metrics.stage("merge.join"):
+        df = df_proj.merge(df_rep, on="uid", how="left")
+        metrics.count("rows", len(df))
+
+    # האינדקס נבנה מחדש רק אם התיקייה השתנתה מאז הריצה הקודמת
+    with metrics.stage("merge.image_index"):
+        entries = load_image_index(get_images_folder(base_path), Path(base_path) / INDEX_FILE,
+                                   workers=workers, verify_count=verify_count, rebuild=rebuild_index)
+        metrics.count("images", len(entries))
+    # ננסה למצוא התאמה ישירה (שם מלא או מקוצר)
+    with metrics.stage("merge.attach"):
+        df = attach_image_info(df, entries)
+        metrics.count("rows", len(df))
+    return df
+
+
+def iter_merged_chunks(base_path, chunksize=CHUNK_SIZE, workers=NUM_WORKERS, rebuild_index=False,
+                       verify_count=False):
+    """
+    Streaming version of merge_projections_reports: the reports are indexed
+    by uid once, the projections are read chunk by chunk, and every chunk is
+    joined and linked to its images on its own. Yields merged chunks in the
+    original row order; only one projections chunk is in memory at a time.
+    """
+    df_rep = read_table(base_path, REPORTS_CSV)
+    with metrics.stage("merge.image_index"):
+        entries = load_image_index(get_images_folder(base_path), Path(base_path) / INDEX_FILE,
+                                   workers=workers, verify_count=verify_count, rebuild=rebuild_index)
+        lookup = lookup_table(entries)
+        metrics.count("images", len(entries))
+
+    reports = df_rep.set_index("uid")
+    # uid כפול ב-reports - merge רגיל (כמו בגרסה המלאה, שורה לכל התאמה)
+    unique = reports.index.is_unique
+
+    chunks = iter_table_chunks(resolve_table(base_path, PROJECTIONS_CSV), None, chunksize, PROJECTION_DTYPES)
+    for chunk in metrics.timed_iter(chunks, "merge.read_chunk"):
+        with metrics.stage("merge.chunk"):
+            # הקטגוריה חוזרת לטקסט - הקטגוריות שונות בין chunks ובקובץ הפלט צריך סוג אחד
+            # (object ולא str: projection חסר נשאר NaN, כמו בגרסה המלאה, ולא 'nan')
+            chunk = chunk.assign(projection=chunk["projection"].astype(object)).reset_index(drop=True)
+            if unique:
+                part = reports.reindex(chunk["uid"].to_numpy()).reset_index(drop=True)
+                merged = pd.concat([chunk, part], axis=1)
+            else:
+                merged = chunk.merge(df_rep, on="uid", how="left")
+            merged = attach_image_info(merged, entries, lookup=lookup)
+            metrics.count("rows", len(merged))
+        yield merged
+
+
+def stream_merge(base_path, chunksize=CHUNK_SIZE, workers=NUM_WORKERS, rebuild_index=False, verify_count=False):
+    """
+    Writes the merged table chunk by chunk. Returns (path or None, rows,
+    matched images, first matched image path, first filename); nothing is
+    kept if no image matched (like the in-memory mode).
+    """
+    writer = TableWriter(base_path, MERGED_CSV)
+    rows, matches, sample, example = 0, 0, None, None
+    try:
+        for merged in iter_merged_chunks(base_path, chunksize, workers, rebuild_index, verify_count):
+            if example is None and len(merged):
+                example = str(merged["filename"].iloc[0])
+            writer.write(merged)
+            rows += len(merged)
+            linked = merged["img_path"].dropna()
+            matches += len(linked)
+            if sample is None and len(linked):
+                sample = linked.iloc[0]
+    except BaseException:
+        writer.abort()
+        raise
+
+    if matches == 0:
+        writer.abort()
+        return None, rows, 0, None, example
+    return writer.close(), rows, matches, sample, example
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge projections with reports and link every image")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="threads for reading file stats/headers")
+    parser.add_argument("--rebuild-index", action="store_true", help="ignore the saved image index")
+    parser.add_argument("--verify-count", action="store_true",
+                        help="also compare the number of PNG files before trusting the saved index")
+    parser.add_argument("--chunksize", type=int, default=0,
+                        help="streaming merge: read the projections in chunks of this many rows")
+    add_table_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    configure_tables(args)
+
+    # טעינת המשתנים מקובץ ה-.env
+    load_dotenv()
+
+    # ========= 1) הגדרות נתיבים =========
+    # במקום נתיב קשיח, אנחנו קוראים אותו מהקובץ הסודי שיצרת
+    env_path = os.getenv("DATA_PATH")
+
+    if not env_path:
+        raise ValueError("Error: DATA_PATH is missing. Please create a .env file with your path.")
+
+    base_path = Path(env_path)
+    images_folder = get_images_folder(base_path)
+
+    # ========= 2) טעינת הנתונים, בניית אינדקס תמונות וקישור =========
+    print("Indexing images...")
+    if args.chunksize:
+        # מצב זורם: הטבלה המאוחדת נכתבת chunk אחרי chunk ולא נמצאת כולה בזיכרון
+        # שם הקובץ לדוגמה נלקח מה-chunk הראשון (בלי קריאה נוספת של הטבלה)
+        saved_path, total, matches, sample_path, example_filename = stream_merge(
+            base_path, args.chunksize, args.workers, args.rebuild_index, args.verify_count)
+    else:
+        df = merge_projections_reports(base_path, args.workers, args.rebuild_index, args.verify_count)
+        total = len(df)
+        example_filename = str(df["filename"].iloc[0])
+        matches = df["img_path"].notna().sum()
+
+    # ========= 3) בדיקה: מה כתוב ב-CSV? =========
+    print(f"DEBUG: Example filename from CSV: '{example_filename}'")
+
+    # ========= 4) בדיקה אם זה עבד =========
+    print(f"Matched images: {matches} out of {total}")
+
+    if matches == 0:
+        print("\n--- ERROR DIAGNOSIS ---")
+        print("Could not match any image. Here are some files I found in the folder:")
+        # הוספתי בדיקה קטנה למקרה שהתיקייה לא קיימת כדי שהקוד לא יקרוס פה
+        if images_folder.exists():
+            found_files = [f.name for f in list(images_folder.glob("*.png"))[:5]]
+            for f in found_files: print(f" - Found on disk: {f}")
+        else:
+            print(f"ERROR: The folder {images_folder} does not exist.")
+
+        print(f"Compare these to the CSV filename: {example_filename}")
+    else:
+        # שמירה והצגת דוגמה רק אם יש התאמות
+        if not args.chunksize:
+            saved_path = write_table(df, base_path, MERGED_CSV)
+            sample_path = df.dropna(subset=["img_path"]).iloc[0]["img_path"]
+        print(f"Saved: {saved_path}")
 
-# ========= 6) בדיקה אם זה עבד =========
-matches = df["img_path"].notna().sum()
-print(f"Matched images: {matches} out of {len(df)}")
+        print(f"\nSUCCESS! Opening: {sample_path}")
+        Image.open(sample_path).show()
 
-if matches == 0:
-    print("\n--- ERROR DIAGNOSIS ---")
-    print("Could not match any image. Here are some files I found in the folder:")
-    # הוספתי בדיקה קטנה למקרה שהתיקייה לא קיימת כדי שהקוד לא יקרוס פה
-    if images_folder.exists():
-        found_files = [f.name for f in list(images_folder.glob("*.png"))[:5]]
-        for f in found_files: print(f" - Found on disk: {f}")
-    else:
-        print(f"ERROR: The folder {images_folder} does not exist.")
+    instrumentation.finish(args)
 
-    print(f"Compare these to the CSV filename: {example_filename}")
-else:
-    # שמירה והצגת דוגמה רק אם יש התאמות
-    output_file = base_path / "indiana_merged_data.csv"
-    df.to_csv(output_file, index=False, encoding="utf-8-sig")
 
-    sample = df.dropna(subset=["img_path"]).iloc[0]
-    print(f"\nSUCCESS! Opening: {sample['img_path']}")
-    Image.open(sample["img_path"]).show()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_store import FeatureStore
+
+# גודל batch של שאילתות בחיפוש המדויק (שומר על זיכרון המטריצה sims חסום)
+QUERY_BATCH = 1024
+
+# גדלי ה-benchmark: ה-POC (450 תמונות) וכל צילומי ה-Frontal/Lateral של Indiana
+BENCHMARK_SIZES = (450, 7500)
+
+
+def normalize_rows(vectors):
+    """נרמול כל וקטור לאורך 1 - כך שמכפלה פנימית = cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(sims, k):
+    """k הגבוהים בכל שורה, ממוינים (argpartition במקום מיון מלא)"""
+    k = min(k, sims.shape[1])
+    part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    part_sims = np.take_along_axis(sims, part, axis=1)
+    order = np.argsort(-part_sims, axis=1)
+    return np.take_along_axis(part_sims, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+class ExactIndex:
+    """Brute-force cosine search: one BLAS matmul per query batch."""
+
+    def __init__(self, vectors, keys=None):
+        self.vectors = normalize_rows(vectors)
+        self.keys = np.asarray(keys if keys is not None else np.arange(len(self.vectors)))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, k=10):
+        """מחזיר (scores, rows) בצורה (n_queries, k)"""
+        queries = normalize_rows(np.atleast_2d(queries))
+        scores, rows = [], []
+        for start in range(0, len(queries), QUERY_BATCH):
+            s, r = _top_k(queries[start:start + QUERY_BATCH] @ self.vectors.T, k)
+            scores.append(s)
+            rows.append(r)
+        return np.vstack(scores), np.vstack(rows)
+
+
+class IVFIndex:
+    """
+    Approximate cosine search with an inverted file: vectors are clustered
+    with spherical k-means and a query only scans the n_probe closest lists.
+    """
+
+    def __init__(self, vectors, keys=None, n_lists=None, n_probe=8, n_iter=15, seed=42):
+        self.vectors = normalize_rows(vectors)
+        self.keys = np.asarray(keys if keys is not None else np.arange(len(self.vectors)))
+        n = len(self.vectors)
+        # כלל אצבע: בערך sqrt(n) רשימות
+        self.n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+        self.n_probe = min(n_probe, self.n_lists)
+
+        self.centroids = self._kmeans(n_iter, np.random.default_rng(seed))
+        assign = np.argmax(self.vectors @ self.centroids.T, axis=1)
+
+        # הרשימות נשמרות רציף: כל הוקטורים של רשימה אחת צמודים בזיכרון
+        order = np.argsort(assign, kind="stable")
+        self.list_rows = order
+        self.list_vectors = self.vectors[order]
+        bounds = np.searchsorted(assign[order], np.arange(self.n_lists + 1))
+        self.list_bounds = bounds
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _kmeans(self, n_iter, rng):
+        # מספיק לאמן את המרכזים על מדגם (עד 64 וקטורים לרשימה)
+        sample_size = min(len(self.vectors), 64 * self.n_lists)
+        sample = self.vectors[rng.choice(len(self.vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, self.n_lists, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=self.n_lists)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+            sums = np.zeros_like(centroids)
+            used = counts > 0
+            sums[used] = np.add.reduceat(sample[order], starts[used], axis=0)
+            # רשימה ריקה מקבלת מרכז חדש אקראי
+            sums[~used] = sample[rng.choice(sample_size, (~used).sum())]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def search(self, queries, k=10):
+        """מחזיר (scores, rows) בצורה (n_queries, k); חסרים מסומנים ב-1-"""
+        queries = normalize_rows(np.atleast_2d(queries))
+        probes = _top_k(queries @ self.centroids.T, self.n_probe)[1]
+
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+
+        # עוברים רשימה-רשימה: כל השאילתות שבודקות אותה מחושבות במכפלה אחת
+        query_ids = np.repeat(np.arange(len(queries)), probes.shape[1])
+        list_ids = probes.ravel()
+        order = np.argsort(list_ids, kind="stable")
+        list_ids, query_ids = list_ids[order], query_ids[order]
+        splits = np.flatnonzero(np.diff(list_ids)) + 1
+
+        for lists, qs in zip(np.split(list_ids, splits), np.split(query_ids, splits)):
+            if len(lists) == 0:
+                continue
+            start, end = self.list_bounds[lists[0]], self.list_bounds[lists[0] + 1]
+            if start == end:
+                continue
+            sims = queries[qs] @ self.list_vectors[start:end].T
+            # מיזוג עם k הטובים שכבר נמצאו לכל שאילתה
+            merged_scores = np.hstack([scores[qs], sims])
+            merged_rows = np.hstack([rows[qs], np.broadcast_to(self.list_rows[start:end], sims.shape)])
+            top_scores, top = _top_k(merged_scores, k)
+            scores[qs] = top_scores
+            rows[qs] = np.take_along_axis(merged_rows, top, axis=1)
+        return scores, rows
+
+
+def build_index(vectors, keys=None, kind="exact", **kwargs):
+    if kind == "exact":
+        return ExactIndex(vectors, keys)
+    if kind == "ivf":
+        return IVFIndex(vectors, keys, **kwargs)
+    raise ValueError(f"kind must be 'exact' or 'ivf', got {kind!r}")
+
+
+def index_from_store(path, kind="exact", **kwargs):
+    """בניית אינדקס ישירות מ-feature store (image_features / text_embeddings)"""
+    store = FeatureStore(path)
+    return build_index(store.matrix(), store.keys, kind, **kwargs)
+
+
+def similar_studies(index, query_keys, k=5):
+    """
+    For every query key returns its k nearest other entries of the same
+    index as a DataFrame (query, neighbor, score, rank).
+    """
+    position = {key: i for i, key in enumerate(index.keys.tolist())}
+    query_rows = [position[key] for key in query_keys]
+    scores, rows = index.search(index.vectors[query_rows], k + 1)
+
+    records = []
+    for query, row_scores, row_ids in zip(query_keys, scores, rows):
+        rank = 0
+        for score, row in zip(row_scores, row_ids):
+            # מדלגים על התוצאה של התמונה עצמה
+            if row < 0 or index.keys[row] == query or rank == k:
+                continue
+            rank += 1
+            records.append((query, index.keys[row], float(score), rank))
+    return pd.DataFrame(records, columns=["query", "neighbor", "score", "rank"])
+
+
+def image_to_report(image_index, query_vectors, reports_df, k=5):
+    """
+    Image -> report lookup: finds the k most similar known images and
+    returns the clinical summaries of their studies. (DenseNet and
+    ClinicalBERT vectors live in different spaces, so the lookup goes
+    through image neighbours.)
+    """
+    scores, rows = image_index.search(query_vectors, k)
+    reports = reports_df.drop_duplicates("filename").set_index("filename")
+
+    records = []
+    for q, (row_scores, row_ids) in enumerate(zip(scores, rows)):
+        for rank, (score, row) in enumerate(zip(row_scores, row_ids), start=1):
+            if row < 0:
+                continue
+            filename = image_index.keys[row]
+            report = reports.loc[filename] if filename in reports.index else None
+            records.append({
+                "query": q,
+                "rank": rank,
+                "filename": filename,
+                "score": float(score),
+                "uid": None if report is None else report.get("uid"),
+                "clinical_summary": None if report is None else report.get("clinical_summary"),
+            })
+    return pd.DataFrame(records)
+
+
+def _synthetic_vectors(n, dim, rng, n_clusters=50):
+    """וקטורים מקובצים (כמו embeddings אמיתיים) ולא רעש אחיד"""
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    return centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def benchmark(n, dim, k=10, n_queries=200, n_probe=8, seed=0):
+    """זמני בנייה, latency לשאילתה ו-recall@k של IVF מול החיפוש המדויק"""
+    rng = np.random.default_rng(seed)
+    vectors = _synthetic_vectors(n, dim, rng)
+    queries = vectors[rng.choice(n, min(n_queries, n), replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    results = {"n": n, "dim": dim, "k": k, "queries": len(queries)}
+    truth = None
+    for kind in ("exact", "ivf"):
+        start = time.perf_counter()
+        index = build_index(vectors, kind=kind, **({"n_probe": n_probe} if kind == "ivf" else {}))
+        results[f"{kind}_build_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, rows = index.search(queries, k)
+        elapsed = time.perf_counter() - start
+        results[f"{kind}_ms_per_query"] = 1000 * elapsed / len(queries)
+
+        if kind == "exact":
+            truth = rows
+        else:
+            hits = [len(set(a) & set(b)) for a, b in zip(truth, rows)]
+            results["ivf_recall"] = float(np.mean(hits)) / k
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest-neighbor search over the feature stores")
+    parser.add_argument("--benchmark", action="store_true", help="latency/recall on synthetic data")
+    parser.add_argument("--sizes", default=",".join(map(str, BENCHMARK_SIZES)))
+    parser.add_argument("--store", help="feature store directory to query (e.g. DATA_PATH/image_features)")
+    parser.add_argument("--query", action="append", default=[], help="key to find similar studies for")
+    parser.add_argument("--kind", choices=["exact", "ivf"], default="exact")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        rows = [benchmark(int(n), dim, args.k) for n in args.sizes.split(",") for dim in (1024, 768)]
+        print(pd.DataFrame(rows).to_string(index=False, float_format="%.4f"))
+
+    if args.store:
+        index = index_from_store(args.store, args.kind)
+        queries = args.query or index.keys[:1].tolist()
+        print(similar_studies(index, queries, args.k).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
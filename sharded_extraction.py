@@ -0,0 +1,168 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+from feature_store import FLUSH_ROWS, META_FILE, FeatureStore, FeatureWriter, save_features
+
+# כל shard הוא feature store קטן בתוך <output>.shards
+SHARDS_SUFFIX = ".shards"
+
+
+def shard_dir(shards_root, shard_id, num_shards):
+    return Path(shards_root) / f"shard-{shard_id:04d}-of-{num_shards:04d}"
+
+
+def split_shards(df, num_shards):
+    """חלוקה לרצפים צמודים לפי סדר השורות - כך שהמיזוג שומר על סדר ה-CSV"""
+    num_shards = max(1, min(num_shards, len(df)))
+    bounds = np.linspace(0, len(df), num_shards + 1).astype(int)
+    return [df.iloc[bounds[i]:bounds[i + 1]] for i in range(num_shards)]
+
+
+def shard_fingerprint(shard_df, settings):
+    """
+    Identifies the work of a shard: its image names and every setting that
+    changes the vectors. A finished shard is reused only if this matches.
+    """
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    for name in shard_df["filename"].astype(str):
+        digest.update(name.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def shard_is_done(path, fingerprint):
+    """shard גמור = יש meta.json (נכתב אחרון) עם אותה טביעת אצבע"""
+    meta_path = Path(path) / META_FILE
+    if not meta_path.exists():
+        return False
+    with open(meta_path, encoding="utf-8") as f:
+        return json.load(f).get("shard_fingerprint") == fingerprint
+
+
+def _run_shard(task):
+    """
+    Worker process: embeds one shard and writes it as a feature store.
+    Runs in a fresh (spawned) interpreter, so torch threads are pinned here
+    before the model is loaded.
+    """
+    from generate_densenet_features import extract_image_features
+    from inference_opt import set_threads
+
+    set_threads(task["threads"])
+    out = Path(task["path"])
+    # מוחקים meta ישן לפני הכתיבה - shard שנקטע באמצע לא ייחשב גמור
+    (out / META_FILE).unlink(missing_ok=True)
+
+    features_dict, missing_count = extract_image_features(
+        task["df"], task["base_path"], task["batch_size"], task["num_workers"],
+        cache_path=task["cache_path"], optimize=task["optimize"], loader=task["loader"],
+    )
+    keys = list(features_dict)
+    vectors = np.stack([features_dict[k] for k in keys]) if keys else np.zeros((0, 1024), dtype=np.float32)
+    save_features(out, keys, vectors, dtype=task["dtype"], meta={
+        "shard_fingerprint": task["fingerprint"],
+        "missing": missing_count,
+    })
+    return task["shard_id"], len(keys), missing_count
+
+
+def merge_shards(paths, output_path, dtype="float32", meta=None):
+    """
+    Writes the shards, in order, into one feature store at output_path
+    through a FeatureWriter: one shard matrix at a time (memory-mapped, in
+    FLUSH_ROWS slices), so the merged vectors are never all in memory.
+    A key that appears in several shards keeps its first row.
+    Returns (number of keys, number of missing images).
+    """
+    stores = [FeatureStore(path) for path in paths]
+    writer = FeatureWriter(output_path, sum(len(store.vectors) for store in stores), dtype, meta)
+    keys, rows, seen, missing_count = [], [], set(), 0
+    with writer:
+        offset = 0
+        for store in stores:
+            for start in range(0, len(store.vectors), FLUSH_ROWS):
+                block = store.vectors[start:start + FLUSH_ROWS]
+                writer[offset + start:offset + start + len(block)] = block
+            for key, row in zip(store.keys, store.rows):
+                if key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+                    rows.append(offset + int(row))
+            offset += len(store.vectors)
+            missing_count += store.meta.get("missing", 0)
+        # אף shard לא החזיר וקטורים - store ריק ב-1024
+        writer.allocate(stores[0].dim if stores else 1024)
+        writer.close(keys, np.asarray(rows, dtype=np.int64))
+    return len(keys), missing_count
+
+
+def remove_shards(output_path):
+    """נקרא רק אחרי שהפלט הממוזג נשמר - עד אז אפשר להמשיך עם resume"""
+    shutil.rmtree(str(output_path) + SHARDS_SUFFIX, ignore_errors=True)
+
+
+def run_sharded(df, base_path, output_path, num_shards, processes=None, threads=None, resume=False,
+                batch_size=32, num_workers=0, cache_path=None, optimize="none", loader="dataloader",
+                dtype="float32", evict_stale=False, meta=None):
+    """
+    Splits df into num_shards contiguous shards, embeds them in separate
+    processes (each with its own pinned torch thread count) and merges the
+    per-shard stores into the feature store at output_path (meta is its
+    header). With resume, shards finished by an earlier run with the same
+    inputs and settings are skipped.
+    With evict_stale the cache is cleaned once, after all shards ran (a
+    shard on its own would evict the entries the other shards just used).
+    Returns (number of stored images, number of missing images).
+    """
+    from generate_densenet_features import cache_config
+
+    if evict_stale and resume:
+        # shard שדולג לא מסמן את הרשומות שלו כ-used - הן היו נמחקות
+        raise ValueError("evict_stale cannot be combined with resume")
+    shards = split_shards(df, num_shards)
+    num_shards = len(shards)
+    processes = max(1, min(processes or os.cpu_count() or 1, num_shards))
+    threads = threads or max(1, (os.cpu_count() or 1) // processes)
+    shards_root = Path(str(output_path) + SHARDS_SUFFIX)
+    # כל מה שמשנה את הווקטורים השמורים ב-shard
+    settings = {"model": cache_config(optimize), "base_path": str(base_path), "dtype": dtype}
+
+    tasks, paths = [], []
+    for shard_id, shard_df in enumerate(shards):
+        path = shard_dir(shards_root, shard_id, num_shards)
+        paths.append(path)
+        fingerprint = shard_fingerprint(shard_df, settings)
+        if resume and shard_is_done(path, fingerprint):
+            continue
+        tasks.append({
+            "shard_id": shard_id, "df": shard_df, "path": str(path), "fingerprint": fingerprint,
+            "base_path": str(base_path), "batch_size": batch_size, "num_workers": num_workers,
+            "cache_path": cache_path, "optimize": optimize, "threads": threads, "loader": loader, "dtype": dtype,
+        })
+
+    print(f"Shards: {num_shards} ({num_shards - len(tasks)} already done), "
+          f"{processes} processes x {threads} threads")
+
+    # זמן ההתחלה של ה-cache נקבע לפני כל ה-shards - מה שהם השתמשו בו לא יימחק
+    cache = EmbeddingCache(cache_path, "image") if evict_stale and cache_path is not None else None
+    if tasks:
+        # spawn - לא מעתיקים מצב של torch/OpenMP מהתהליך הראשי (וזה גם ברירת המחדל ב-Windows)
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks)), mp_context=context) as pool:
+            futures = [pool.submit(_run_shard, task) for task in tasks]
+            for future in as_completed(futures):
+                shard_id, done, missing = future.result()
+                print(f"Shard {shard_id + 1}/{num_shards} done: {done} images, {missing} missing")
+    if cache is not None:
+        print(f"Evicted {cache.evict_stale()} stale cache entries")
+        cache.close()
+
+    return merge_shards(paths, output_path, dtype, meta)
@@ -0,0 +1,455 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from dotenv import load_dotenv
+
+from data_io import POC_CSV, read_table
+from dataset_builder import DEFAULT_FRACTIONS, assign_splits, group_uniform
+from feature_store import FeatureStore
+import instrumentation
+from instrumentation import metrics
+
+# ה-stores שהחילוץ כותב לתוך DATA_PATH
+STORES = {"image": "image_features", "text": "text_embeddings"}
+MODELS = ("linear", "mlp")
+
+# הגדרות ברירת המחדל - כל config ב-sweep משנה רק חלק מהן
+DEFAULT_CONFIG = {
+    "model": "linear",
+    "hidden": 256,
+    "dropout": 0.2,
+    "lr": 1e-3,
+    "weight_decay": 1e-4,
+    "epochs": 30,
+    "batch_size": 64,
+}
+
+CONTRASTIVE_CONFIG = {"dim": 128, "lr": 1e-3, "weight_decay": 1e-4, "epochs": 50, "batch_size": 128}
+
+# כמה שורות נקראות מה-memmap בכל פעם בחישוב ממוצע/סטיית תקן ובחיזוי
+CHUNK_ROWS = 4096
+
+
+class JointFeatures:
+    """
+    The feature vectors of a labeled table, read straight from one or more
+    memory-mapped feature stores. Row i of the dataset is the concatenation
+    of vectors[rows[m][i]] of every store m; nothing is copied until a
+    mini-batch is taken. Pickles as paths + row numbers, so worker
+    processes map the same files instead of receiving the matrices.
+    """
+
+    def __init__(self, paths, rows):
+        self.paths = [str(p) for p in paths]
+        self.rows = [np.asarray(r, dtype=np.int64) for r in rows]
+        self._vectors = None
+
+    def __getstate__(self):
+        return {"paths": self.paths, "rows": self.rows, "_vectors": None}
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            self._vectors = [FeatureStore(p).vectors for p in self.paths]
+        return self._vectors
+
+    def __len__(self):
+        return len(self.rows[0])
+
+    @property
+    def dim(self):
+        return sum(v.shape[1] for v in self.vectors)
+
+    def part(self, i):
+        """store אחד מתוך החיבור (למשל רק התמונות)"""
+        return JointFeatures([self.paths[i]], [self.rows[i]])
+
+    def take(self, idx):
+        """float32 (len(idx), dim) - רק השורות המבוקשות נקראות מהדיסק"""
+        return np.hstack([v[rows[idx]] for v, rows in zip(self.vectors, self.rows)]).astype(np.float32)
+
+    def moments(self, idx):
+        """ממוצע וסטיית תקן לכל עמודה, מחושבים בחלקים (לנרמול לפי סט האימון בלבד)"""
+        total = np.zeros(self.dim, dtype=np.float64)
+        squares = np.zeros(self.dim, dtype=np.float64)
+        for start in range(0, len(idx), CHUNK_ROWS):
+            x = self.take(idx[start:start + CHUNK_ROWS]).astype(np.float64)
+            total += x.sum(axis=0)
+            squares += (x * x).sum(axis=0)
+        mean = total / max(len(idx), 1)
+        std = np.sqrt(np.maximum(squares / max(len(idx), 1) - mean * mean, 0))
+        return mean.astype(np.float32), np.maximum(std, 1e-6).astype(np.float32)
+
+
+def load_training_data(base_path, modalities=("image", "text"), labels_table=POC_CSV, stores=None,
+                       label_col="label", group_col="uid", seed=42):
+    """
+    Joins the labeled table with the feature stores by filename. Rows
+    without a vector in every requested store are dropped.
+    Returns (features, y, classes, table): y holds class codes and the
+    table keeps filename, uid, label and the train/val/test split (the same
+    uid-hash split as create_poc_dataset --splits).
+    """
+    base_path = Path(base_path)
+    stores = {**STORES, **(stores or {})}
+    df = read_table(base_path, labels_table)
+    opened = [FeatureStore(base_path / stores[m]) for m in modalities]
+
+    present = np.ones(len(df), dtype=bool)
+    names = df["filename"].astype(str)
+    for store in opened:
+        present &= names.isin(store.index).to_numpy()
+    if not present.all():
+        print(f"Warning: {int((~present).sum())} rows have no vector in every store, skipping them.")
+    df = df[present].reset_index(drop=True)
+    names = df["filename"].astype(str)
+
+    rows = [names.map(store.index).to_numpy() for store in opened]
+    features = JointFeatures([store.path for store in opened], rows)
+    labels = pd.Categorical(df[label_col])
+    if "split" not in df.columns:
+        df["split"] = assign_splits(df, group_col, DEFAULT_FRACTIONS, seed)
+    table = df[["filename", group_col, label_col, "split"]]
+    return features, np.asarray(labels.codes, dtype=np.int64), list(labels.categories), table
+
+
+def build_model(config, in_dim, n_classes):
+    if config["model"] == "linear":
+        return nn.Linear(in_dim, n_classes)
+    if config["model"] == "mlp":
+        return nn.Sequential(nn.Linear(in_dim, config["hidden"]), nn.ReLU(), nn.Dropout(config["dropout"]),
+                             nn.Linear(config["hidden"], n_classes))
+    raise ValueError(f"model must be one of {MODELS}, got {config['model']!r}")
+
+
+def iter_minibatches(idx, batch_size, rng):
+    """סדר אקראי בכל epoch; בתוך batch השורות ממוינות - קריאה רציפה יותר מה-memmap"""
+    order = rng.permutation(idx)
+    for start in range(0, len(order), batch_size):
+        yield np.sort(order[start:start + batch_size])
+
+
+def train_classifier(features, y, train_idx, config, n_classes, seed=42):
+    """
+    Trains one classifier on the rows train_idx with AdamW and mini-batches
+    streamed from the feature stores. Inputs are standardized with the
+    training rows' statistics. Returns (model, mean, std).
+    """
+    config = {**DEFAULT_CONFIG, **config}
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    mean, std = features.moments(train_idx)
+    model = build_model(config, features.dim, n_classes)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=config["lr"], weight_decay=config["weight_decay"])
+    targets = torch.from_numpy(y)
+
+    model.train()
+    for _ in range(int(config["epochs"])):
+        for batch in iter_minibatches(train_idx, int(config["batch_size"]), rng):
+            x = torch.from_numpy((features.take(batch) - mean) / std)
+            loss = F.cross_entropy(model(x), targets[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    model.eval()
+    return model, mean, std
+
+
+def predict_proba(model, features, idx, mean, std):
+    """הסתברויות לכל סוג, בחלקים של CHUNK_ROWS שורות"""
+    out = []
+    with torch.inference_mode():
+        for start in range(0, len(idx), CHUNK_ROWS):
+            x = torch.from_numpy((features.take(idx[start:start + CHUNK_ROWS]) - mean) / std)
+            out.append(torch.softmax(model(x), dim=1).numpy())
+    return np.vstack(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+
+def _macro_auc(y_true, proba):
+    """one-vs-rest AUC לכל סוג לפי דירוגים (Mann-Whitney), בלי לולאה על ספים"""
+    n_classes = proba.shape[1]
+    ranks = pd.DataFrame(proba).rank(axis=0).to_numpy()
+    positive = y_true[:, None] == np.arange(n_classes)[None, :]
+    n_pos = positive.sum(axis=0)
+    n_neg = len(y_true) - n_pos
+    valid = (n_pos > 0) & (n_neg > 0)
+    auc = ((ranks * positive).sum(axis=0) - n_pos * (n_pos + 1) / 2) / np.maximum(n_pos * n_neg, 1)
+    return float(auc[valid].mean()) if valid.any() else float("nan")
+
+
+def classification_metrics(y_true, proba):
+    """
+    Accuracy, balanced accuracy, macro F1, macro one-vs-rest AUC and log
+    loss from one confusion matrix (np.bincount) - no per-class Python loop.
+    """
+    n_classes = proba.shape[1]
+    y_true = np.asarray(y_true)
+    pred = proba.argmax(axis=1)
+    confusion = np.bincount(y_true * n_classes + pred, minlength=n_classes ** 2).reshape(n_classes, n_classes)
+    tp = np.diag(confusion).astype(np.float64)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+    precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(tp), where=precision + recall > 0)
+    return {
+        "accuracy": float(tp.sum() / max(len(y_true), 1)),
+        "balanced_accuracy": float(recall[support > 0].mean()),
+        "macro_f1": float(f1[support > 0].mean()),
+        "macro_auc": _macro_auc(y_true, proba),
+        "log_loss": float(-np.log(np.clip(proba[np.arange(len(y_true)), y_true], 1e-12, 1)).mean()),
+    }
+
+
+def group_folds(groups, n_folds=5, seed=42):
+    """
+    Fold number per row; all rows of a group (uid) share a fold. The
+    distinct groups are shuffled by a hash with a different seed than
+    assign_splits (that hash already picked train/val/test, so on the
+    train+val rows its values are not uniform) and dealt round-robin, so
+    every fold gets the same number of groups.
+    """
+    unique, inverse = np.unique(np.asarray(groups).astype(str), return_inverse=True)
+    order = np.argsort(group_uniform(unique, seed + 1), kind="stable")
+    fold_of = np.empty(len(unique), dtype=np.int64)
+    fold_of[order] = np.arange(len(unique)) % n_folds
+    return fold_of[inverse.ravel()]
+
+
+def check_fold_sizes(folds, n_folds, tolerance=0.5):
+    """גדלי ה-folds (בשורות); שגיאה אם fold ריק או קטן בהרבה מהאחרים"""
+    sizes = np.bincount(folds, minlength=n_folds)
+    if sizes.min() == 0 or sizes.min() < tolerance * sizes.max():
+        raise ValueError(f"unbalanced folds (rows per fold: {sizes.tolist()})")
+    return sizes
+
+
+def _fit_fold(task):
+    """
+    Worker: one (config, fold) fit. Each process runs torch on a single
+    thread, so n processes use n cores without oversubscription.
+    """
+    from inference_opt import set_threads
+
+    set_threads(1)
+    model, mean, std = train_classifier(task["features"], task["y"], task["train_idx"], task["config"],
+                                        task["n_classes"], task["seed"])
+    proba = predict_proba(model, task["features"], task["val_idx"], mean, std)
+    return task["config_id"], task["fold"], classification_metrics(task["y"][task["val_idx"]], proba)
+
+
+def cross_validate(features, y, idx, groups, configs, n_classes, n_folds=5, processes=None, seed=42):
+    """
+    Grouped k-fold cross-validation of every config over the rows idx.
+    All (config, fold) fits run in parallel worker processes.
+    Returns one row per config: its settings and the mean/std of every
+    metric over the folds, best macro F1 first.
+    """
+    folds = group_folds(groups[idx], n_folds, seed)
+    print(f"Rows per fold: {check_fold_sizes(folds, n_folds).tolist()}")
+    tasks = []
+    for config_id, config in enumerate(configs):
+        for fold in range(n_folds):
+            tasks.append({"config_id": config_id, "fold": fold, "config": config, "features": features, "y": y,
+                          "train_idx": idx[folds != fold], "val_idx": idx[folds == fold],
+                          "n_classes": n_classes, "seed": seed})
+
+    processes = max(1, min(processes or os.cpu_count() or 1, len(tasks)))
+    print(f"Cross-validation: {len(configs)} configs x {n_folds} folds on {processes} processes")
+    results = []
+    with metrics.stage("train.cv"):
+        if processes == 1:
+            results = [_fit_fold(task) for task in tasks]
+        else:
+            # spawn - כמו ב-sharded_extraction, בלי להעתיק את מצב ה-threads של torch
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+                results = list(pool.map(_fit_fold, tasks, chunksize=max(1, len(tasks) // (processes * 4))))
+        metrics.count("fits", len(tasks))
+
+    scores = pd.DataFrame([{"config_id": c, "fold": f, **m} for c, f, m in results])
+    summary = scores.drop(columns="fold").groupby("config_id").agg(["mean", "std"])
+    summary.columns = [f"{metric}_{stat}" for metric, stat in summary.columns]
+    settings = pd.DataFrame([{**DEFAULT_CONFIG, **c} for c in configs])
+    return settings.join(summary).sort_values("macro_f1_mean", ascending=False)
+
+
+def parse_grid(items):
+    """
+    ['model=linear,mlp', 'lr=1e-3,3e-3'] -> every combination as a config
+    dict (values are parsed as JSON when possible, e.g. numbers).
+    """
+    def value(text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return text
+
+    keys, values = [], []
+    for item in items:
+        key, _, options = item.partition("=")
+        if key not in DEFAULT_CONFIG:
+            raise ValueError(f"unknown setting {key!r} (expected one of {list(DEFAULT_CONFIG)})")
+        keys.append(key)
+        values.append([value(v) for v in options.split(",")])
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+class ContrastiveHead(nn.Module):
+    """
+    CLIP-style projection of image and text vectors into one shared space:
+    a linear map per modality, unit-normalized outputs and a learned
+    temperature, trained with the symmetric InfoNCE loss on matching
+    (image, report) pairs.
+    """
+
+    def __init__(self, image_dim, text_dim, dim=128):
+        super().__init__()
+        self.image_proj = nn.Linear(image_dim, dim)
+        self.text_proj = nn.Linear(text_dim, dim)
+        self.logit_scale = nn.Parameter(torch.tensor(float(np.log(1 / 0.07))))
+
+    def embed_image(self, x):
+        return F.normalize(self.image_proj(x), dim=1)
+
+    def embed_text(self, x):
+        return F.normalize(self.text_proj(x), dim=1)
+
+    def forward(self, image, text):
+        """מטריצת logits: תמונה i מול דו"ח j"""
+        return self.logit_scale.exp().clamp(max=100) * self.embed_image(image) @ self.embed_text(text).T
+
+
+def train_contrastive(image, text, train_idx, config=None, seed=42):
+    """image/text: JointFeatures של store אחד כל אחד, מיושרים לאותן שורות"""
+    config = {**CONTRASTIVE_CONFIG, **(config or {})}
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    image_stats, text_stats = image.moments(train_idx), text.moments(train_idx)
+    head = ContrastiveHead(image.dim, text.dim, config["dim"])
+    optimizer = torch.optim.AdamW(head.parameters(), lr=config["lr"], weight_decay=config["weight_decay"])
+
+    with metrics.stage("train.contrastive"):
+        for _ in range(int(config["epochs"])):
+            for batch in iter_minibatches(train_idx, int(config["batch_size"]), rng):
+                if len(batch) < 2:
+                    continue
+                x_img = torch.from_numpy((image.take(batch) - image_stats[0]) / image_stats[1])
+                x_txt = torch.from_numpy((text.take(batch) - text_stats[0]) / text_stats[1])
+                logits = head(x_img, x_txt)
+                target = torch.arange(len(batch))
+                loss = (F.cross_entropy(logits, target) + F.cross_entropy(logits.T, target)) / 2
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+            metrics.count("pairs", len(train_idx))
+    head.eval()
+    return head, image_stats, text_stats
+
+
+def retrieval_recall(head, image, text, idx, image_stats, text_stats, ks=(1, 5, 10)):
+    """
+    Image -> report recall@k on the rows idx: the rank of the matching
+    report among all reports of idx, for every image at once.
+    """
+    with torch.inference_mode():
+        img = head.embed_image(torch.from_numpy((image.take(idx) - image_stats[0]) / image_stats[1]))
+        txt = head.embed_text(torch.from_numpy((text.take(idx) - text_stats[0]) / text_stats[1]))
+        sims = (img @ txt.T).numpy()
+    correct = np.diag(sims)
+    rank = (sims > correct[:, None]).sum(axis=1)
+    return {f"recall@{k}": float((rank < k).mean()) for k in ks}
+
+
+def save_classifier(path, model, config, classes, modalities, mean, std, scores):
+    """המודל + כל מה שצריך כדי להריץ אותו שוב (סוגים, נרמול, config)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save({"state_dict": model.state_dict(), "config": config, "classes": classes,
+                "modalities": list(modalities), "mean": mean, "std": std, "scores": scores}, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train POC classifiers on the cached image/text features")
+    parser.add_argument("--labels", default=POC_CSV, help="labeled table inside DATA_PATH")
+    parser.add_argument("--features", default="image,text", help="stores to concatenate: image, text or both")
+    parser.add_argument("--image-store", default=STORES["image"])
+    parser.add_argument("--text-store", default=STORES["text"])
+    parser.add_argument("--grid", nargs="*", default=[], metavar="KEY=V1,V2",
+                        help="hyperparameter sweep, e.g. model=linear,mlp lr=1e-3,3e-3 hidden=128,512")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--processes", type=int, default=None, help="parallel CV fits (default: cores)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--results", default="training_results.csv", help="sweep table inside DATA_PATH")
+    parser.add_argument("--output", default="models/poc_classifier.pt", help="best model inside DATA_PATH")
+    parser.add_argument("--contrastive", action="store_true", help="also train an image-text projection head")
+    parser.add_argument("--contrastive-output", default="models/contrastive_head.pt")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    load_dotenv()
+    base_path = Path(os.getenv("DATA_PATH"))
+    modalities = [m.strip() for m in args.features.split(",") if m.strip()]
+    stores = {"image": args.image_store, "text": args.text_store}
+    if args.contrastive and not {"image", "text"} <= set(modalities):
+        print("Error: --contrastive needs --features image,text")
+        exit()
+
+    # 1. טעינה: תוויות + שורות ב-stores (הווקטורים עצמם נשארים על הדיסק)
+    features, y, classes, table = load_training_data(base_path, modalities, args.labels, stores, seed=args.seed)
+    splits = table["split"].to_numpy()
+    groups = table["uid"].to_numpy()
+    train_idx = np.flatnonzero(splits != "test")
+    test_idx = np.flatnonzero(splits == "test")
+    print(f"Rows: {len(y)} ({len(train_idx)} train+val, {len(test_idx)} test), classes: {classes}, "
+          f"dim: {features.dim}")
+
+    # 2. Cross-validation על כל ה-configs (train+val) - ה-test לא נוגעים בו עד הסוף
+    configs = parse_grid(args.grid) if args.grid else [{}]
+    sweep = cross_validate(features, y, train_idx, groups, configs, len(classes), args.folds, args.processes,
+                           args.seed)
+    sweep.to_csv(base_path / args.results, index=False)
+    print(sweep.head(10).to_string(index=False, float_format="%.4f"))
+    print(f"Sweep results saved to: {base_path / args.results}")
+
+    # 3. המודל הטוב ביותר - אימון על כל ה-train+val ובדיקה על ה-test
+    best = {k: sweep.iloc[0][k] for k in DEFAULT_CONFIG}
+    best = {k: (v.item() if hasattr(v, "item") else v) for k, v in best.items()}
+    print(f"\nBest config: {best}")
+    with metrics.stage("train.fit"):
+        model, mean, std = train_classifier(features, y, train_idx, best, len(classes), args.seed)
+        metrics.count("rows", len(train_idx))
+    scores = classification_metrics(y[test_idx], predict_proba(model, features, test_idx, mean, std)) \
+        if len(test_idx) else {}
+    print(f"Test: {json.dumps(scores, indent=2)}")
+    path = save_classifier(base_path / args.output, model, best, classes, modalities, mean, std, scores)
+    print(f"Model saved to: {path}")
+
+    # 4. ראש contrastive (אופציונלי): תמונה <-> דו"ח באותו מרחב
+    if args.contrastive:
+        image, text = features.part(modalities.index("image")), features.part(modalities.index("text"))
+        head, image_stats, text_stats = train_contrastive(image, text, train_idx, seed=args.seed)
+        recall = retrieval_recall(head, image, text, test_idx, image_stats, text_stats) if len(test_idx) else {}
+        print(f"Contrastive test recall (image -> report): {recall}")
+        path = base_path / args.contrastive_output
+        path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save({"state_dict": head.state_dict(), "config": CONTRASTIVE_CONFIG, "image_stats": image_stats,
+                    "text_stats": text_stats, "recall": recall}, path)
+        print(f"Contrastive head saved to: {path}")
+
+    instrumentation.finish(args)
+
+
+if __name__ == "__main__":
+    main()